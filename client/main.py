@@ -1,11 +1,28 @@
 from __future__ import annotations
 
 import argparse
-import socket
 import json
-from typing import Any, Dict, Optional
-
-from common.protocol import Message
+import select
+import socket
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from common.protocol import (
+    FRAME_HEADER,
+    FRAMING_FRAMES,
+    MAX_FRAME,
+    Framing,
+    Message,
+    decode_frame,
+    is_event,
+    loads_message,
+)
+from common.seats import FORMAT_COMPACT, decode_compact, grid_layout
+
+# Rows per list page (list_movies, list_showtimes, my_tickets).
+PAGE_SIZE = 20
+# Versioned replies (`if_version`) and seat maps (`since_version`) kept for re-reads, LRU each.
+VERSIONED_MAX = 256
  
  
 class Client:
@@ -16,6 +33,14 @@ class Client:
         self.f = None
         self.token: Optional[str] = None
         self.user: Optional[Dict[str, Any]] = None
+        self._next_id = 1
+        self.framing = Framing()
+        # Server-pushed events received while waiting for replies.
+        self.events: deque = deque(maxlen=1024)
+        # (action, data) -> (version, reply data) of the last versioned reply.
+        self._versioned: "OrderedDict[Tuple[str, str], Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        # showtime_id -> (version, {seat_code: status}) of the last seat map fetched.
+        self._seat_views: "OrderedDict[int, Tuple[int, Dict[str, str]]]" = OrderedDict()
 
     def connect(self) -> None:
         self.sock = socket.create_connection((self.host, self.port))
@@ -33,31 +58,212 @@ class Client:
         except Exception:
             pass
 
-    def request(self, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        if not self.f:
-            raise RuntimeError("Not connected")
+    def _with_token(self, data: Dict[str, Any]) -> Dict[str, Any]:
         # attach token for auth-required actions (server ignores if not needed)
         if self.token and "token" not in data:
             data = dict(data)
             data["token"] = self.token
-        msg = Message(action=action, data=data).to_json_line()
-        self.f.write(msg.encode("utf-8"))
-        self.f.flush()
-        line = self.f.readline()
-        if not line:
+        return data
+
+    def _read_response(self) -> Dict[str, Any]:
+        while True:
+            msg = self._read_message()
+            if not is_event(msg):
+                return msg
+            self.events.append(msg)
+
+    def _read_message(self) -> Dict[str, Any]:
+        if not self.framing.framed:
+            line = self.f.readline()
+            if not line:
+                raise RuntimeError("Server disconnected")
+            return loads_message(line)
+        header = self.f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
             raise RuntimeError("Server disconnected")
-        return json.loads(line.decode("utf-8"))
+        length, flags = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise RuntimeError("Frame too large")
+        body = self.f.read(length)
+        if len(body) < length:
+            raise RuntimeError("Server disconnected")
+        return loads_message(decode_frame(flags, body))
+
+    def request(self, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.f:
+            raise RuntimeError("Not connected")
+        msg = Message(action=action, data=self._with_token(data)).to_json_line()
+        self.f.write(self.framing.encode(msg))
+        self.f.flush()
+        return self._read_response()
+
+    def read(self, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        `request` for reads the server versions (list_movies, list_showtimes):
+        the last reply to the same request is kept with its
+        version and sent back as `if_version`; when the server answers "not
+        modified" the kept reply is returned instead, as if it had been sent.
+        """
+        key = (action, json.dumps(data, sort_keys=True))
+        cached = self._versioned.get(key)
+        resp = self.request(action, data if cached is None else dict(data, if_version=cached[0]))
+        if not resp.get("ok"):
+            return resp
+        reply = resp.get("data") or {}
+        if reply.get("not_modified") and cached is not None:
+            self._versioned.move_to_end(key)
+            return dict(resp, data=cached[1])
+        if reply.get("version") is not None:
+            self._versioned[key] = (reply["version"], reply)
+            self._versioned.move_to_end(key)
+            while len(self._versioned) > VERSIONED_MAX:
+                self._versioned.popitem(last=False)
+        return resp
+
+    def hello(self, framing: str = FRAMING_FRAMES, compress: bool = True) -> Dict[str, Any]:
+        """Negotiate the wire format; later requests use what the server accepted."""
+        data = self.ensure_ok(self.request("hello", {"framing": framing, "compress": compress}))
+        self.framing = Framing(mode=data["framing"], compress=bool(data.get("compress")))
+        return data
+
+    def pipeline(self, requests: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Send every (action, data) request in one write, then collect the replies:
+        one round trip for the whole batch. Replies may arrive out of order;
+        they are matched by request id and returned in request order. A reply
+        without a matching id (the server could not read that request) fails
+        the batch, after all its replies are read so the connection stays usable.
+        """
+        if not self.f:
+            raise RuntimeError("Not connected")
+        first_id = self._next_id
+        self._next_id += len(requests)
+        lines = [
+            Message(action=action, data=self._with_token(data), id=first_id + i).to_json_line()
+            for i, (action, data) in enumerate(requests)
+        ]
+        self.f.write(b"".join(self.framing.encode(line) for line in lines))
+        self.f.flush()
+        by_id: Dict[Any, Dict[str, Any]] = {}
+        unmatched: List[Dict[str, Any]] = []
+        wanted = range(first_id, first_id + len(requests))
+        for _ in requests:
+            resp = self._read_response()
+            rid = resp.get("id")
+            if isinstance(rid, int) and rid in wanted and rid not in by_id:
+                by_id[rid] = resp
+            else:
+                unmatched.append(resp)
+        if unmatched:
+            raise RuntimeError(f"Pipeline reply without a request id: {unmatched[0].get('error') or unmatched[0]}")
+        return [by_id[first_id + i] for i in range(len(requests))]
 
     def ensure_ok(self, resp: Dict[str, Any]) -> Dict[str, Any]:
         if not resp.get("ok"):
             raise RuntimeError(resp.get("error") or "Unknown error")
         return resp.get("data") or {}
 
+    def subscribe_seats(self, showtime_id: int) -> int:
+        """Ask for live seat events of a showtime; returns the current seat-map version."""
+        data = self.ensure_ok(self.request("subscribe_seats", {"showtime_id": showtime_id}))
+        return int(data.get("version") or 0)
+
+    def unsubscribe_seats(self, showtime_id: int) -> None:
+        self.ensure_ok(self.request("unsubscribe_seats", {"showtime_id": showtime_id}))
+
+    def wait_event(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Next pushed event, waiting up to `timeout` seconds (None: forever).
+        Only call while no request is outstanding.
+        """
+        if self.events:
+            return self.events.popleft()
+        # No timeout on the socket itself: its makefile() reader refuses to read after one.
+        if not self._buffered() and not select.select([self.sock], [], [], timeout)[0]:
+            return None
+        msg = self._read_message()
+        return msg if is_event(msg) else None
+
+    def _buffered(self) -> bool:
+        """Whether bytes already sit in the reader's buffer (peeked without blocking)."""
+        self.sock.setblocking(False)
+        try:
+            return bool(self.f.peek(1))
+        finally:
+            self.sock.setblocking(True)
+
+    def pages(self, action: str, key: str, data: Optional[Dict[str, Any]] = None,
+              limit: int = PAGE_SIZE) -> Iterator[Tuple[List[Dict[str, Any]], bool]]:
+        """
+        Yield (items, more) for the `key` list of `action` one page at a time;
+        the next page is requested only when the caller asks for it.
+        """
+        data = dict(data or {}, limit=limit)
+        while True:
+            page = self.ensure_ok(self.read(action, data))
+            cursor = page.get("next_cursor")
+            yield list(page.get(key) or []), bool(cursor)
+            if not cursor:
+                return
+            data.update(cursor)
+
+    def get_seats(self, showtime_id: int) -> List[Dict[str, Any]]:
+        """
+        Fetch the seat map in compact form and decode it to [{seat_code, status}].
+        Once a showtime has been fetched, later calls ask only for the seats
+        changed since (`since_version`) and apply them to the kept copy; the
+        server sends the whole map again when its change log is too short.
+        """
+        view = self._seat_views.get(showtime_id)
+        req: Dict[str, Any] = {"showtime_id": showtime_id, "format": FORMAT_COMPACT}
+        if view is not None:
+            req["since_version"] = view[0]
+        data = self.ensure_ok(self.request("get_seats", req))
+        if view is not None and "changes" in data:
+            status = dict(view[1])
+            status.update((ch["seat_code"], ch["status"]) for ch in data["changes"])
+        else:
+            seats = decode_compact(data) if data.get("format") == FORMAT_COMPACT else data.get("seats") or []
+            status = {s["seat_code"]: s["status"] for s in seats}
+        if data.get("version") is not None:
+            self._seat_views[showtime_id] = (data["version"], status)
+            self._seat_views.move_to_end(showtime_id)
+            while len(self._seat_views) > VERSIONED_MAX:
+                self._seat_views.popitem(last=False)
+        return [{"seat_code": code, "status": st} for code, st in status.items()]
+
+    def hold_seats(self, showtime_id: int, seat_codes: List[str], ttl: Optional[int] = None) -> Dict[str, Any]:
+        """Hold seats while the user confirms; returns {"hold_id", "expires_at", "ttl", ...}."""
+        data: Dict[str, Any] = {"showtime_id": showtime_id, "seat_codes": seat_codes}
+        if ttl:
+            data["ttl"] = ttl
+        return self.ensure_ok(self.request("hold_seats", data))
+
+    def confirm_hold(self, hold_id: str) -> List[int]:
+        data = self.ensure_ok(self.request("confirm_hold", {"hold_id": hold_id}))
+        return list(data.get("ticket_ids") or [])
+
+    def release_hold(self, hold_id: str) -> None:
+        self.ensure_ok(self.request("release_hold", {"hold_id": hold_id}))
+
+    def book_many(self, showtime_id: int, seat_codes: List[str]) -> List[int]:
+        """Book all seats in one round trip (all or nothing); returns ticket ids."""
+        data = self.ensure_ok(self.request("book_many", {"showtime_id": showtime_id, "seat_codes": seat_codes}))
+        return list(data.get("ticket_ids") or [])
+
 
 def prompt(msg: str) -> str:
     return input(msg).strip()
 
 
+def show_pages(pages: Iterator[Tuple[List[Dict[str, Any]], bool]], show) -> None:
+    """Print page by page, asking before fetching the next one."""
+    for items, more in pages:
+        show(items)
+        if not more or prompt("Enter = trang sau, q = dừng: ").lower() == "q":
+            break
+
+
 def print_movies(movies):
     if not movies:
         print("Chưa có phim nào.")
@@ -78,19 +284,37 @@ def print_showtimes(showtimes):
         print(f"[{s['id']}] {s['start_time']} | Phòng: {s['hall']} | Giá: {s['price']} | Phim: {s['movie_title']}")
 
  
+def print_tickets(tickets):
+    if not tickets:
+        print("Bạn chưa có vé.")
+        return
+    print("\n=== VÉ CỦA TÔI ===")
+    for t in tickets:
+        print(f"[{t['id']}] {t['movie_title']} | {t['start_time']} | {t['hall']} | Ghế {t['seat_code']} | {t['price']} | {t['status']}")
+
+
+SEAT_SYMBOLS = {"available": "O", "booked": "X", "held": "H"}
+
+
 def print_seats(seats):
-    # show as grid A-E, 1-8
+    # show as grid rows x cols (hàng chữ cái, cột số)
     status = {x["seat_code"]: x["status"] for x in seats}
-    rows = sorted(set(code[0] for code in status.keys()))
-    cols = sorted(set(int(code[1:]) for code in status.keys()))
-    print("\n=== GHẾ (O=trống, X=đã đặt) ===")
-    header = "    " + " ".join(f"{c:>2}" for c in cols)
+    layout = grid_layout(status.keys())
+    if layout is None:
+        for code, st in sorted(status.items()):
+            print(f"{code}: {st}")
+        return
+    rows, ncols, _ = layout
+    cols = range(1, ncols + 1)
+    print("\n=== GHẾ (O=trống, X=đã đặt, H=đang giữ) ===")
+    width = max((len(r) for r in rows), default=1)
+    header = " " * (width + 3) + " ".join(f"{c:>2}" for c in cols)
     print(header)
     for r in rows:
-        line = [r + " :"]
+        line = [f"{r:<{width}} :"]
         for c in cols:
-            code = f"{r}{c}"
-            line.append(" O" if status.get(code) == "available" else " X")
+            st = status.get(f"{r}{c}")
+            line.append("  " if st is None else " " + SEAT_SYMBOLS.get(st, "X"))
         print(" ".join(line))
     print("Ví dụ nhập ghế: A1, B5, E8 ...")
 
@@ -99,10 +323,13 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Cinema Booking Socket Client (CLI)")
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--frames", action="store_true", help="use length-prefixed frames instead of JSON lines")
     args = parser.parse_args()
 
     c = Client(args.host, args.port)
     c.connect()
+    if args.frames:
+        c.hello()
     print("Kết nối server OK.\n")
 
     try:
@@ -143,38 +370,39 @@ def main() -> None:
             if role == "admin":
                 print("7) (Admin) Thêm phim")
                 print("8) (Admin) Thêm suất chiếu")
+                print("12) (Admin) Thêm phòng chiếu")
             print("9) Đăng xuất")
+            print("10) Theo dõi ghế realtime")
+            print("11) Giữ ghế rồi xác nhận")
+            print("13) Tìm phim")
             choice = prompt("> ")
 
             if choice == "1":
-                data = c.ensure_ok(c.request("list_movies", {}))
-                print_movies(data.get("movies", []))
+                show_pages(c.pages("list_movies", "movies"), print_movies)
 
             elif choice == "2":
                 movie_id = int(prompt("Nhập movie_id: "))
-                data = c.ensure_ok(c.request("list_showtimes", {"movie_id": movie_id}))
-                print_showtimes(data.get("showtimes", []))
+                show_pages(c.pages("list_showtimes", "showtimes", {"movie_id": movie_id}), print_showtimes)
 
             elif choice == "3":
                 showtime_id = int(prompt("Nhập showtime_id: "))
-                data = c.ensure_ok(c.request("get_seats", {"showtime_id": showtime_id}))
-                print_seats(data.get("seats", []))
+                print_seats(c.get_seats(showtime_id))
 
             elif choice == "4":
                 showtime_id = int(prompt("Nhập showtime_id: "))
-                seat_code = prompt("Nhập seat_code (VD A1): ").upper()
-                data = c.ensure_ok(c.request("book", {"showtime_id": showtime_id, "seat_code": seat_code}))
-                print("✅", data.get("message"), "| ticket_id:", data.get("ticket_id"))
+                raw = prompt("Nhập seat_code (VD A1 hoặc A1,A2,A3): ").upper()
+                seat_codes = [x.strip() for x in raw.split(",") if x.strip()]
+                if not seat_codes:
+                    print("Chưa nhập ghế.")
+                elif len(seat_codes) > 1:
+                    ticket_ids = c.book_many(showtime_id, seat_codes)
+                    print("✅ Booked | ticket_ids:", ", ".join(str(t) for t in ticket_ids))
+                else:
+                    data = c.ensure_ok(c.request("book", {"showtime_id": showtime_id, "seat_code": seat_codes[0]}))
+                    print("✅", data.get("message"), "| ticket_id:", data.get("ticket_id"))
 
             elif choice == "5":
-                data = c.ensure_ok(c.request("my_tickets", {}))
-                tickets = data.get("tickets", [])
-                if not tickets:
-                    print("Bạn chưa có vé.")
-                else:
-                    print("\n=== VÉ CỦA TÔI ===")
-                    for t in tickets:
-                        print(f"[{t['id']}] {t['movie_title']} | {t['start_time']} | {t['hall']} | Ghế {t['seat_code']} | {t['price']} | {t['status']}")
+                show_pages(c.pages("my_tickets", "tickets"), print_tickets)
 
             elif choice == "6":
                 ticket_id = int(prompt("Nhập ticket_id muốn huỷ: "))
@@ -196,12 +424,62 @@ def main() -> None:
                 data = c.ensure_ok(c.request("admin_add_showtime", {"movie_id": movie_id, "start_time": start_time, "hall": hall, "price": price}))
                 print("✅ showtime_id:", data.get("showtime_id"))
 
+            elif choice == "12" and role == "admin":
+                name = prompt("Tên phòng (VD P4): ")
+                print("Sơ đồ từng hàng, mỗi ký tự 1 cột: S=thường, V=VIP, C=ghế đôi, .=lối đi (dòng trống để kết thúc)")
+                layout = []
+                while True:
+                    row = prompt(f"Hàng {len(layout) + 1}: ")
+                    if not row:
+                        break
+                    layout.append(row)
+                data = c.ensure_ok(c.request("admin_add_hall", {"name": name, "layout": layout}))
+                print("✅ hall_id:", data.get("hall_id"))
+
             elif choice == "9":
                 c.ensure_ok(c.request("logout", {}))
                 c.token = None
                 c.user = None
                 print("✅ Đã đăng xuất.")
 
+            elif choice == "10":
+                showtime_id = int(prompt("Nhập showtime_id: "))
+                c.subscribe_seats(showtime_id)
+                print_seats(c.get_seats(showtime_id))
+                print("Đang theo dõi... (Ctrl+C để dừng)")
+                try:
+                    while True:
+                        ev = c.wait_event(timeout=1.0)
+                        if not ev:
+                            continue
+                        d = ev.get("data") or {}
+                        if d.get("resync"):
+                            print_seats(c.get_seats(showtime_id))
+                        for ch in d.get("changes", []):
+                            print(f"  [v{d.get('version')}] {ch['seat_code']} -> {ch['status']}")
+                except KeyboardInterrupt:
+                    pass
+                c.unsubscribe_seats(showtime_id)
+
+            elif choice == "11":
+                showtime_id = int(prompt("Nhập showtime_id: "))
+                raw = prompt("Ghế muốn giữ (VD A1,A2): ").upper()
+                seat_codes = [x.strip() for x in raw.split(",") if x.strip()]
+                hold = c.hold_seats(showtime_id, seat_codes)
+                print(f"⏳ Đã giữ {', '.join(hold['seat_codes'])} trong {hold['ttl']} giây.")
+                if prompt("Xác nhận đặt? (y/n): ").lower() == "y":
+                    ticket_ids = c.confirm_hold(hold["hold_id"])
+                    print("✅ Booked | ticket_ids:", ", ".join(str(t) for t in ticket_ids))
+                else:
+                    c.release_hold(hold["hold_id"])
+                    print("✅ Đã trả ghế.")
+
+            elif choice == "13":
+                q = prompt("Từ khoá: ")
+                upcoming = prompt("Chỉ phim sắp chiếu? (y/n): ").lower() == "y"
+                data = c.ensure_ok(c.request("search_movies", {"q": q, "upcoming": upcoming}))
+                print_movies(data.get("movies", []))
+
             else:
                 print("Lựa chọn không hợp lệ.")
 
@@ -3,10 +3,30 @@ Simple JSON-over-TCP line protocol (one JSON object per line).
 Every request/response is a dict serialized to JSON and terminated by '\n'.
 
 Request:
-  {"action": "<string>", "data": {...}}
+  {"action": "<string>", "data": {...}, "id": <optional int/string>}
 
 Response:
-  {"ok": true/false, "data": {...} or null, "error": "<message>" or null}
+  {"ok": true/false, "data": {...} or null, "error": "<message>" or null, "id": <echoed>}
+
+Pipelining:
+- A request carrying "id" gets the same "id" back in its response, so a client
+  may write many requests before reading any reply.
+- The server may answer id-tagged read-only requests out of order; requests
+  without "id" (and every write) are still answered strictly in order.
+
+Events (server push, only after a subscribe action):
+  {"event": "<name>", "data": {...}}
+  Events carry no "ok"/"id" and may arrive between responses; clients must
+  set them aside while waiting for a reply.
+
+Framing (negotiated with the "hello" action, JSON lines stay the default):
+  -> {"action": "hello", "data": {"framing": "frames", "compress": true}}
+  <- {"ok": true, "data": {"framing": "frames", "compress": true, "max_frame": N}}
+  After that reply both sides send length-prefixed frames instead of lines:
+    4-byte big-endian body length | 1-byte flags | body
+  The body is the same compact UTF-8 JSON document without the trailing
+  newline; flag 0x01 marks a zlib-compressed body (only used for bodies of
+  at least COMPRESS_MIN bytes, and only if "compress" was negotiated).
 
 Notes:
 - This module has no socket code; it only provides helpers/constants.
@@ -15,8 +35,10 @@ Notes:
 from __future__ import annotations
 
 import json as _json
+import struct
+import zlib
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Mapping
+from typing import Any, Dict, Optional, Mapping, Tuple
 
 
 # ---- JSON keys (constants, tránh sai chính tả) ----
@@ -24,19 +46,38 @@ KEY_ACTION = "action"
 KEY_DATA = "data"
 KEY_OK = "ok"
 KEY_ERROR = "error"
+KEY_ID = "id"
+KEY_EVENT = "event"
+
+ACTION_HELLO = "hello"
+
+FRAMING_LINES = "lines"
+FRAMING_FRAMES = "frames"
+FRAME_HEADER = struct.Struct("!IB")  # body length, flags
+FLAG_ZLIB = 0x01
+MAX_FRAME = 16 * 1024 * 1024
+COMPRESS_MIN = 1024
+
+
+def _dumps(payload: Any) -> str:
+    # Compact separators: fewer bytes on the wire for every message.
+    return _json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
 
 
 @dataclass(slots=True)
 class Message:
     action: str
     data: Dict[str, Any]
+    id: Optional[Any] = None
 
     def to_json_line(self) -> str:
         payload = {
             KEY_ACTION: self.action,
             KEY_DATA: self.data,
         }
-        return json.dumps(payload, ensure_ascii=False) + "\n"
+        if self.id is not None:
+            payload[KEY_ID] = self.id
+        return _dumps(payload) + "\n"
 
 
 def response_ok(data: Optional[Dict[str, Any]] = None) -> str:
@@ -45,7 +86,7 @@ def response_ok(data: Optional[Dict[str, Any]] = None) -> str:
         KEY_DATA: data or {},
         KEY_ERROR: None,
     }
-    return json.dumps(payload, ensure_ascii=False) + "\n"
+    return _dumps(payload) + "\n"
 
 
 def response_error(
@@ -57,11 +98,96 @@ def response_error(
         KEY_DATA: data or {},
         KEY_ERROR: message,
     }
-    return _json.dumps(payload, ensure_ascii=False) + "\n"
+    return _dumps(payload) + "\n"
+
+
+def event_line(name: str, data: Dict[str, Any]) -> str:
+    return _dumps({KEY_EVENT: name, KEY_DATA: data}) + "\n"
+
+
+def is_event(payload: Mapping[str, Any]) -> bool:
+    return KEY_EVENT in payload
+
+
+def attach_id(line: str, req_id: Any) -> str:
+    """
+    Echo a request id into an already encoded response line.
+    Splices the id before the closing brace instead of re-parsing the JSON.
+    """
+    if req_id is None:
+        return line
+    return line[:-2] + ',"' + KEY_ID + '":' + _dumps(req_id) + "}\n"
 
 
 def loads_line(line: str) -> Dict[str, Any]:
     """
     Parse one JSON line (ended with '\\n') into a dict.
     """
-    return json.loads(line)
+    return _json.loads(line)
+
+
+def loads_message(raw: bytes) -> Dict[str, Any]:
+    """
+    Parse one request/response body straight from bytes (line or frame),
+    skipping the separate decode/strip copies.
+    """
+    return _json.loads(raw)
+
+
+def encode_frame(body: bytes, compress: bool = False) -> bytes:
+    flags = 0
+    if compress and len(body) >= COMPRESS_MIN:
+        packed = zlib.compress(body, 1)
+        if len(packed) < len(body):
+            body, flags = packed, FLAG_ZLIB
+    return FRAME_HEADER.pack(len(body), flags) + body
+
+
+def decode_frame(flags: int, body: bytes) -> bytes:
+    if flags & FLAG_ZLIB:
+        d = zlib.decompressobj()
+        try:
+            out = d.decompress(body, MAX_FRAME)
+        except zlib.error as e:
+            raise ValueError(f"Bad frame: {e}") from e
+        if d.unconsumed_tail:
+            raise ValueError("Frame too large")
+        return out
+    return body
+
+
+@dataclass(slots=True)
+class Framing:
+    """Per-connection wire format; starts as JSON lines."""
+    mode: str = FRAMING_LINES
+    compress: bool = False
+
+    @property
+    def framed(self) -> bool:
+        return self.mode == FRAMING_FRAMES
+
+    def encode(self, line: str) -> bytes:
+        """Encode a JSON line (as built by response_ok/Message) for the wire."""
+        if not self.framed:
+            return line.encode("utf-8")
+        return encode_frame(line[:-1].encode("utf-8"), self.compress)
+
+
+def is_hello(msg: Any) -> bool:
+    return isinstance(msg, dict) and msg.get(KEY_ACTION) == ACTION_HELLO
+
+
+def negotiate(data: Mapping[str, Any]) -> Tuple[str, Optional[Framing]]:
+    """
+    Answer a "hello" request. Returns the reply line (to be sent with the
+    *current* framing) and the framing to switch to right after it
+    (None: keep the current one).
+    """
+    if not isinstance(data, Mapping):
+        data = {}
+    mode = str(data.get("framing") or FRAMING_LINES)
+    if mode not in (FRAMING_LINES, FRAMING_FRAMES):
+        return response_error(f"Unsupported framing: {mode}"), None
+    framing = Framing(mode=mode, compress=bool(data.get("compress")) and mode == FRAMING_FRAMES)
+    reply = response_ok({"framing": framing.mode, "compress": framing.compress, "max_frame": MAX_FRAME})
+    return reply, framing
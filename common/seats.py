@@ -0,0 +1,143 @@
+"""
+Compact seat-map encoding for `get_seats` with {"format": "compact"}.
+
+Instead of one {"seat_code", "status"} object per seat, the hall is sent as
+its grid once plus a run-length encoded string of cell symbols, row-major:
+
+  {"format": "compact", "rows": ["A", "B"], "cols": 3, "cells": "4O1X1."}
+
+means A1..A3, B1 available, B2 booked, B3 is not a seat (gap).
+Symbols: O available, X booked, H held, . gap.
+Seat codes are <row letters><column number>, e.g. "A1", "AA12".
+
+Hall layouts (`admin_add_hall`) are one string per row, one character per
+column: "." is an aisle/gap, any other character is a seat of that class
+(S standard, V vip, C couple). Seats are named by grid position, so
+["SS.SS"] gives A1 A2 A4 A5 and the compact map shows the aisle.
+
+Notes:
+- No socket code; used by the server to encode and the client to decode.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+FORMAT_COMPACT = "compact"
+
+GAP = "."
+STATUS_TO_SYMBOL = {"available": "O", "booked": "X", "held": "H"}
+SYMBOL_TO_STATUS = {v: k for k, v in STATUS_TO_SYMBOL.items()}
+
+SEAT_CLASSES = {"S": "standard", "V": "vip", "C": "couple"}
+HALL_MAX_ROWS = 52
+HALL_MAX_COLS = 60
+
+_CODE_RE = re.compile(r"^([A-Z]+)(\d+)$")
+_RUN_RE = re.compile(r"(\d+)(\D)")
+
+
+def split_code(code: str) -> Optional[Tuple[str, int]]:
+    m = _CODE_RE.match(code)
+    if not m:
+        return None
+    return m.group(1), int(m.group(2))
+
+
+def _row_key(row: str) -> Tuple[int, str]:
+    return len(row), row  # A..Z, then AA, AB, ...
+
+
+def grid_layout(codes: Iterable[str]) -> Optional[Tuple[List[str], int, Dict[str, int]]]:
+    """
+    (rows, cols, cell index of every code) for a set of seat codes,
+    or None if some code does not follow the <letters><number> scheme.
+    """
+    parts = {}
+    for code in codes:
+        p = split_code(code)
+        if p is None:
+            return None
+        parts[code] = p
+    rows = sorted({r for r, _ in parts.values()}, key=_row_key)
+    cols = max((c for _, c in parts.values()), default=0)
+    row_idx = {r: i for i, r in enumerate(rows)}
+    return rows, cols, {code: row_idx[r] * cols + c - 1 for code, (r, c) in parts.items()}
+
+
+def row_name(i: int) -> str:
+    """0 -> "A", 25 -> "Z", 26 -> "AA" (the order `grid_layout` sorts rows in)."""
+    name = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        name = chr(ord("A") + r) + name
+    return name
+
+
+def layout_seats(layout: List[str]) -> List[Tuple[str, str]]:
+    """(seat_code, seat_class) of every seat of a hall layout; ValueError if malformed."""
+    if not isinstance(layout, list) or not layout or not all(isinstance(r, str) for r in layout):
+        raise ValueError("layout must be a non-empty list of strings")
+    if len(layout) > HALL_MAX_ROWS or max(len(r) for r in layout) > HALL_MAX_COLS:
+        raise ValueError(f"layout larger than {HALL_MAX_ROWS} rows x {HALL_MAX_COLS} columns")
+    seats = []
+    for i, row in enumerate(layout):
+        name = row_name(i)
+        for c, ch in enumerate(row.upper(), start=1):
+            if ch == GAP:
+                continue
+            if ch not in SEAT_CLASSES:
+                raise ValueError(f"Unknown seat class {ch!r} (use {', '.join(SEAT_CLASSES)} or {GAP!r})")
+            seats.append((f"{name}{c}", SEAT_CLASSES[ch]))
+    if not seats:
+        raise ValueError("layout has no seats")
+    return seats
+
+
+def rle_encode(cells: str) -> str:
+    out: List[str] = []
+    i, n = 0, len(cells)
+    while i < n:
+        ch = cells[i]
+        j = i + 1
+        while j < n and cells[j] == ch:
+            j += 1
+        out.append(f"{j - i}{ch}")
+        i = j
+    return "".join(out)
+
+
+def rle_decode(encoded: str) -> str:
+    return "".join(ch * int(count) for count, ch in _RUN_RE.findall(encoded))
+
+
+def encode_cells(rows: List[str], cols: int, cells: str) -> Dict[str, Any]:
+    return {"format": FORMAT_COMPACT, "rows": rows, "cols": cols, "cells": rle_encode(cells)}
+
+
+def encode_compact(seats: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Compact form of a `get_seats` list; None if the codes are not a grid."""
+    layout = grid_layout(s["seat_code"] for s in seats)
+    if layout is None:
+        return None
+    rows, cols, pos = layout
+    cells = [GAP] * (len(rows) * cols)
+    for s in seats:
+        cells[pos[s["seat_code"]]] = STATUS_TO_SYMBOL.get(s["status"], "X")
+    return encode_cells(rows, cols, "".join(cells))
+
+
+def decode_compact(compact: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Back to the plain [{"seat_code", "status"}] list (gaps dropped)."""
+    rows: List[str] = compact["rows"]
+    cols = int(compact["cols"])
+    cells = rle_decode(compact["cells"])
+    seats = []
+    for i, ch in enumerate(cells):
+        if ch == GAP:
+            continue
+        r, c = divmod(i, cols)
+        seats.append({"seat_code": f"{rows[r]}{c + 1}", "status": SYMBOL_TO_STATUS.get(ch, ch)})
+    return seats
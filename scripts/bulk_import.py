@@ -0,0 +1,110 @@
+"""
+Load movies and showtimes in bulk through the `admin_bulk_import` action.
+
+Usage:
+  python -m scripts.bulk_import schedule.ndjson
+  python -m scripts.bulk_import schedule.csv --batch 2000 --frames
+
+Records (one JSON object per line, or one CSV row with a header):
+  {"type": "movie", "title": "...", "description": "...", "duration_min": 120}
+  {"type": "showtime", "movie_title": "...", "start_time": "2026-01-12T19:30:00", "hall": "P1", "price": 75000}
+A showtime names its movie by `movie_id` or by `movie_title` (a movie earlier
+in the file works); `type` may be left out. CSV columns use the same names.
+
+The file is read lazily and sent `--batch` records per request, so its size
+is not limited by memory. Rejected records are listed on stderr by line
+number; the totals are printed as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from client.main import Client
+
+BATCH_DEFAULT = 1000
+
+
+def read_records(path: str, fmt: str = "auto") -> Iterator[Tuple[int, Any]]:
+    """(line number, record) pairs; a line that is not valid JSON yields its error message as a str."""
+    if fmt == "auto":
+        fmt = "csv" if path.lower().endswith(".csv") else "ndjson"
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {k: v for k, v in row.items() if k and v not in (None, "")}
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, f"Invalid JSON: {e}"
+
+
+def send(client: Client, batch: List[Tuple[int, Any]], totals: Dict[str, Any]) -> None:
+    data = client.ensure_ok(client.request("admin_bulk_import", {"records": [rec for _, rec in batch]}))
+    for key in ("movies", "showtimes", "seats"):
+        totals[key] += data.get(key, 0)
+    for err in data.get("errors") or []:
+        totals["errors"].append((batch[err["row"]][0], err["error"]))
+
+
+def run(client: Client, path: str, fmt: str = "auto", batch_size: int = BATCH_DEFAULT) -> Dict[str, Any]:
+    totals: Dict[str, Any] = {"movies": 0, "showtimes": 0, "seats": 0, "errors": []}
+    batch: List[Tuple[int, Any]] = []
+    for line_no, rec in read_records(path, fmt):
+        if isinstance(rec, str):
+            totals["errors"].append((line_no, rec))
+            continue
+        batch.append((line_no, rec))
+        if len(batch) >= batch_size:
+            send(client, batch, totals)
+            batch = []
+    if batch:
+        send(client, batch, totals)
+    totals["errors"].sort()
+    return totals
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Bulk-load movies and showtimes (NDJSON or CSV)")
+    p.add_argument("path")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5555)
+    p.add_argument("--user", default="admin")
+    p.add_argument("--password", default="admin123")
+    p.add_argument("--format", choices=("auto", "ndjson", "csv"), default="auto")
+    p.add_argument("--batch", type=int, default=BATCH_DEFAULT, help="records per request")
+    p.add_argument("--frames", action="store_true", help="send compressed frames instead of JSON lines")
+    args = p.parse_args()
+
+    client = Client(args.host, args.port)
+    client.connect()
+    try:
+        if args.frames:
+            client.hello()
+        client.token = client.ensure_ok(
+            client.request("login", {"username": args.user, "password": args.password})
+        )["token"]
+        started = time.perf_counter()
+        totals = run(client, args.path, args.format, args.batch)
+        elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+
+    for line_no, error in totals["errors"]:
+        print(f"line {line_no}: {error}", file=sys.stderr)
+    summary = {k: v for k, v in totals.items() if k != "errors"}
+    summary.update(errors=len(totals["errors"]), elapsed_s=round(elapsed, 3))
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
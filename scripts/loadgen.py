@@ -0,0 +1,317 @@
+"""
+Load generator: many simulated users against a running server, one JSON
+report at the end so engine and DB changes can be compared run-to-run.
+
+Usage:
+  python -m scripts.loadgen --users 2000 --duration 30 --mix browse
+  python -m scripts.loadgen --users 500 --mix rush --out rush.json
+
+Mixes:
+  browse  catalogue and seat-map reads (list_movies, list_showtimes, get_seats, my_tickets)
+  rush    premiere rush: every user fights for the seats of the same showtime
+  churn   book a random seat, then cancel it, over a few showtimes
+
+Each user is one connection speaking the JSON line protocol on raw asyncio
+streams (no thread per user), so thousands fit in one process. Setup (an
+admin creates a movie and showtimes, users register and log in) is not
+counted in the report.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from common.protocol import Message, loads_message
+from common.seats import FORMAT_COMPACT, decode_compact
+from server.admission import SERVER_BUSY
+
+MIXES = ("browse", "rush", "churn")
+CONFLICT_ERRORS = ("Seat already booked", "Seat is held")
+SETUP_CONCURRENCY = 200
+
+
+@dataclass
+class LoadConfig:
+    host: str = "127.0.0.1"
+    port: int = 5555
+    users: int = 100
+    duration: float = 10.0
+    mix: str = "browse"
+    think_ms: float = 0.0
+    showtimes: int = 4
+    seed: int = 1
+    admin_user: str = "admin"
+    admin_password: str = "admin123"
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.conflicts: Dict[str, int] = {}
+        self.disconnects = 0
+
+    def add(self, action: str, ms: float, resp: Dict[str, Any]) -> None:
+        self.latencies.setdefault(action, []).append(ms)
+        if not resp.get("ok"):
+            error = str(resp.get("error") or "")
+            if error.startswith(CONFLICT_ERRORS):
+                self.conflicts[action] = self.conflicts.get(action, 0) + 1
+            else:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    n = len(values)
+
+    def pick(q: float) -> float:
+        return round(values[min(n - 1, int(q / 100 * n))], 3)
+
+    return {
+        "mean": round(sum(values) / n, 3),
+        "p50": pick(50),
+        "p90": pick(90),
+        "p95": pick(95),
+        "p99": pick(99),
+        "max": round(values[-1], 3),
+    }
+
+
+class User:
+    """One simulated user: a connection, a token and a private random stream."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, rng: random.Random) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.token: Optional[str] = None
+        self.stats: Optional[Stats] = None
+
+    @classmethod
+    async def connect(cls, host: str, port: int, rng: random.Random) -> "User":
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 22)
+        return cls(reader, writer, rng)
+
+    async def call(self, action: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = dict(data or {})
+        if self.token:
+            data["token"] = self.token
+        t0 = time.perf_counter()
+        self.writer.write(Message(action=action, data=data).to_json_line().encode("utf-8"))
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Server disconnected")
+        resp = loads_message(line)
+        if self.stats is not None:
+            self.stats.add(action, (time.perf_counter() - t0) * 1000, resp)
+        return resp
+
+    async def call_retrying(self, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """`call`, retried with jitter while the server sheds load (after its `retry_after`, if any)."""
+        resp = await self.call(action, data)
+        while resp.get("error") == SERVER_BUSY:
+            retry_after = (resp.get("data") or {}).get("retry_after") or 0.0
+            await asyncio.sleep(retry_after + self.rng.uniform(0.05, 0.25))
+            resp = await self.call(action, data)
+        return resp
+
+    async def login(self, username: str, password: str, register: bool = False) -> None:
+        if register:
+            await self.call_retrying("register", {"username": username, "password": password})
+        resp = await self.call_retrying("login", {"username": username, "password": password})
+        if not resp.get("ok"):
+            raise RuntimeError(f"login {username}: {resp.get('error')}")
+        self.token = resp["data"]["token"]
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def _data(resp: Dict[str, Any]) -> Dict[str, Any]:
+    if not resp.get("ok"):
+        raise RuntimeError(resp.get("error") or "Unknown error")
+    return resp.get("data") or {}
+
+
+async def _available_seats(user: User, showtime_id: int) -> List[str]:
+    resp = await user.call("get_seats", {"showtime_id": showtime_id, "format": FORMAT_COMPACT})
+    data = resp.get("data") or {}
+    seats = decode_compact(data) if data.get("format") == FORMAT_COMPACT else data.get("seats", [])
+    return [s["seat_code"] for s in seats if s["status"] == "available"]
+
+
+async def browse(user: User, plan: Dict[str, Any]) -> None:
+    roll = user.rng.random()
+    if roll < 0.3:
+        await user.call("list_movies")
+    elif roll < 0.6:
+        await user.call("list_showtimes", {"movie_id": plan["movie_id"]})
+    elif roll < 0.9:
+        await user.call("get_seats", {"showtime_id": user.rng.choice(plan["showtime_ids"]), "format": FORMAT_COMPACT})
+    else:
+        await user.call("my_tickets")
+
+
+async def rush(user: User, plan: Dict[str, Any]) -> None:
+    showtime_id = plan["showtime_ids"][0]
+    free = await _available_seats(user, showtime_id)
+    if free:
+        await user.call("book", {"showtime_id": showtime_id, "seat_code": user.rng.choice(free)})
+
+
+async def churn(user: User, plan: Dict[str, Any]) -> None:
+    showtime_id = user.rng.choice(plan["showtime_ids"])
+    seat_code = user.rng.choice(plan["seat_codes"])
+    resp = await user.call("book", {"showtime_id": showtime_id, "seat_code": seat_code})
+    if resp.get("ok"):
+        await user.call("cancel", {"ticket_id": resp["data"]["ticket_id"]})
+
+
+WORKLOADS = {"browse": browse, "rush": rush, "churn": churn}
+
+
+async def _prepare(config: LoadConfig) -> Dict[str, Any]:
+    """Admin creates the movie and showtimes this run works on."""
+    admin = await User.connect(config.host, config.port, random.Random(config.seed))
+    try:
+        await admin.login(config.admin_user, config.admin_password)
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{random.Random().randrange(1 << 16):04x}"
+        resp = await admin.call("admin_add_movie", {"title": f"loadgen {stamp}", "duration_min": 120})
+        movie_id = _data(resp)["movie_id"]
+        showtime_ids = []
+        for i in range(max(1, config.showtimes)):
+            resp = await admin.call("admin_add_showtime", {
+                "movie_id": movie_id,
+                "start_time": f"2099-01-01T{10 + i % 12:02d}:00:00",
+                "hall": f"LG{i + 1}",
+                "price": 50000,
+            })
+            showtime_ids.append(_data(resp)["showtime_id"])
+        seat_codes = await _available_seats(admin, showtime_ids[0])
+        return {"movie_id": movie_id, "showtime_ids": showtime_ids, "seat_codes": seat_codes, "run": stamp}
+    finally:
+        admin.close()
+
+
+async def run(config: LoadConfig) -> Dict[str, Any]:
+    if config.mix not in WORKLOADS:
+        raise ValueError(f"Unknown mix: {config.mix}")
+    plan = await _prepare(config)
+    workload = WORKLOADS[config.mix]
+    stats = Stats()
+    gate = asyncio.Semaphore(SETUP_CONCURRENCY)
+    setup_failures = 0
+
+    async def set_up(i: int) -> Optional[User]:
+        nonlocal setup_failures
+        async with gate:
+            try:
+                user = await User.connect(config.host, config.port, random.Random(config.seed * 1_000_003 + i))
+                await user.login(f"lg{plan['run']}-{i}", "loadgen", register=True)
+                return user
+            except Exception:
+                setup_failures += 1
+                return None
+
+    users = [u for u in await asyncio.gather(*(set_up(i) for i in range(config.users))) if u is not None]
+    think = config.think_ms / 1000
+
+    async def drive(user: User, deadline: float) -> None:
+        user.stats = stats
+        try:
+            while time.monotonic() < deadline:
+                await workload(user, plan)
+                if think:
+                    await asyncio.sleep(user.rng.uniform(0, 2 * think))
+        except (ConnectionError, OSError, ValueError):
+            stats.disconnects += 1
+        finally:
+            user.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(drive(u, started + config.duration) for u in users))
+    elapsed = time.monotonic() - started
+    return report(config, stats, elapsed, len(users), setup_failures)
+
+
+def report(config: LoadConfig, stats: Stats, elapsed: float, users: int, setup_failures: int) -> Dict[str, Any]:
+    total = sum(len(v) for v in stats.latencies.values())
+    errors = sum(stats.errors.values())
+    conflicts = sum(stats.conflicts.values())
+    return {
+        "config": asdict(config),
+        "users_connected": users,
+        "setup_failures": setup_failures,
+        "disconnects": stats.disconnects,
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "conflicts": conflicts,
+        "conflict_rate": round(conflicts / total, 4) if total else 0.0,
+        "latency_ms": _percentiles([ms for v in stats.latencies.values() for ms in v]),
+        "actions": {
+            action: {
+                "count": len(values),
+                "errors": stats.errors.get(action, 0),
+                "conflicts": stats.conflicts.get(action, 0),
+                "latency_ms": _percentiles(values),
+            }
+            for action, values in sorted(stats.latencies.items())
+        },
+    }
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Simulated users against a cinema booking server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5555)
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--duration", type=float, default=10.0, help="seconds of measured load")
+    p.add_argument("--mix", choices=MIXES, default="browse")
+    p.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's steps")
+    p.add_argument("--showtimes", type=int, default=4, help="showtimes created for the run")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--admin-user", default="admin")
+    p.add_argument("--admin-password", default="admin123")
+    p.add_argument("--out", default=None, help="write the JSON report here instead of stdout")
+    args = p.parse_args()
+
+    config = LoadConfig(
+        host=args.host,
+        port=args.port,
+        users=args.users,
+        duration=args.duration,
+        mix=args.mix,
+        think_ms=args.think_ms,
+        showtimes=args.showtimes,
+        seed=args.seed,
+        admin_user=args.admin_user,
+        admin_password=args.admin_password,
+    )
+    try:
+        from server.aio import raise_nofile_limit
+
+        raise_nofile_limit()
+    except Exception:
+        pass
+    result = json.dumps(asyncio.run(run(config)), indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(result + "\n")
+    else:
+        sys.stdout.write(result + "\n")
+
+
+if __name__ == "__main__":
+    main()
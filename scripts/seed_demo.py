@@ -3,13 +3,38 @@ Seed demo data (movies + showtimes) into the server sqlite DB.
 
 Usage:
   python -m scripts.seed_demo --db server/cinema.db
+  python -m scripts.seed_demo --db /tmp/big.db --scale --movies 20000 --days 30 --users 100000
+
+--scale generates a production-sized data set for benchmarking instead of the
+three demo movies: halls with varied layouts, movies, showtimes for every
+hall over --days days, users, and tickets for about --booked of all seats
+(plus a few cancelled ones). The same --seed gives the same data. Rows go in
+with executemany inside a handful of transactions; the report (JSON) gives
+the time per phase, row counts, the database size and a few probe query
+timings.
 """
 from __future__ import annotations
 
 import argparse
 import datetime as dt
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
 
+from server import db
 from server.db import connect, init_db, add_movie, add_showtime
+from server.passwords import hash_password
+
+SCALE_PASSWORD = "demo123"
+CANCELLED_SHARE = 0.05
+SLOT_HOURS = (9, 12, 15, 18, 21, 23)
+WORDS = (
+    "night city love war star dream ghost river fire shadow king road last secret storm heart "
+    "ocean winter golden silent lost iron blue garden empire wild summer"
+).split()
 
 
 def _movie_exists(conn, title: str) -> bool:
@@ -22,16 +47,199 @@ def _count_showtimes(conn) -> int:
     return int(row["c"]) if row else 0
 
 
+def _hall_layout(rng: random.Random) -> List[str]:
+    """Rows of standard seats split by an aisle, VIP rows in the middle, couple seats at the back."""
+    rows, cols = rng.randint(8, 16), rng.randint(12, 24)
+    aisle = cols // 2
+    layout = []
+    for r in range(rows):
+        cls = "C" if r == rows - 1 else "V" if rows // 2 - 1 <= r <= rows // 2 else "S"
+        layout.append("".join("." if c == aisle else cls for c in range(cols)))
+    return layout
+
+
+def _timed(report: Dict[str, Any], phase: str, started: float) -> float:
+    now = time.perf_counter()
+    report["phases_s"][phase] = round(now - started, 3)
+    return now
+
+
+def _probe(conn, fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(conn, *args)
+    return round((time.perf_counter() - t0) * 1000, 3)
+
+
+def _bulk_import(conn, records: List[Any]) -> Dict[str, Any]:
+    """db.bulk_import, failing on the first rejected record: the rest of the data set depends on every row."""
+    result = db.bulk_import(conn, records)
+    if result["errors"]:
+        first = result["errors"][0]
+        raise RuntimeError(f"bulk import rejected {len(result['errors'])} records, first {first['row']}: {first['error']}")
+    return result
+
+
+def seed_scale(conn, movies: int, halls: int, days: int, users: int, booked: float, seed: int,
+               start_date: Optional[dt.date] = None) -> Dict[str, Any]:
+    """Showtimes run for `days` days from `start_date` (default today); the same seed and date give the same rows."""
+    rng = random.Random(seed)
+    start_date = start_date or dt.date.today()
+    report: Dict[str, Any] = {"seed": seed, "start_date": start_date.isoformat(), "phases_s": {}, "rows": {}}
+    started = t = time.perf_counter()
+
+    # Halls: one small transaction each (a few dozen at most). A hall left by an
+    # earlier run keeps its layout, so seat codes are read back from the database.
+    names = [f"S{i + 1}" for i in range(halls)]
+    for name in names:
+        db.add_hall(conn, name, _hall_layout(rng))
+    hall_seats: Dict[str, List[str]] = {name: [] for name in names}
+    for row in conn.execute(
+        "SELECT h.name, hs.seat_code FROM halls h JOIN hall_seats hs ON hs.hall_id = h.id ORDER BY h.id, hs.seat_code"
+    ):
+        if row["name"] in hall_seats:
+            hall_seats[row["name"]].append(row["seat_code"])
+    t = _timed(report, "halls", t)
+
+    # Movies, then showtimes (seats generated in bulk), through the bulk import path.
+    records: List[Any] = [
+        {
+            "type": "movie",
+            "title": " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))) + f" {i + 1}",
+            "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 40))),
+            "duration_min": rng.randint(80, 180),
+        }
+        for i in range(movies)
+    ]
+    movie_ids = _bulk_import(conn, records)["movie_ids"]
+    t = _timed(report, "movies", t)
+
+    first_show = conn.execute("SELECT COALESCE(MAX(id), 0) FROM showtimes").fetchone()[0] + 1
+    first_day = dt.datetime.combine(start_date, dt.time())
+    records = []
+    for day in range(days):
+        for name in hall_seats:
+            for hour in SLOT_HOURS:
+                start = first_day + dt.timedelta(days=day, hours=hour, minutes=rng.choice((0, 15, 30)))
+                records.append({
+                    "movie_id": movie_ids[min(movies - 1, int(rng.paretovariate(1.2)) - 1)],
+                    "start_time": start.isoformat(),
+                    "hall": name,
+                    "price": rng.choice((60000, 75000, 90000, 120000)),
+                })
+    result = _bulk_import(conn, records)
+    t = _timed(report, "showtimes_and_seats", t)
+
+    # Users share one password hash: a KDF per user would dominate the run. The
+    # names carry a prefix of their own so a second run never hits a taken one.
+    prefix = f"u{uuid.uuid4().hex[:8]}-"
+    report["username_prefix"] = prefix
+    password_hash = hash_password(SCALE_PASSWORD)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users(username, password_hash, role) VALUES(?,?,'user')",
+            ((f"{prefix}{i + 1}", password_hash) for i in range(users)),
+        )
+    user_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE username GLOB ? ORDER BY id", (prefix + "*",))]
+    t = _timed(report, "users", t)
+
+    # Tickets: each showtime sells a share around --booked (popular slots more), buyers skewed to heavy users.
+    tickets: List[Tuple[int, int, str, str, str]] = []
+    sold: List[Tuple[int, str, int, str]] = []
+    showtimes = conn.execute("SELECT id, hall, start_time FROM showtimes WHERE id >= ?", (first_show,)).fetchall()
+    if not user_ids:
+        showtimes = []
+    for st in showtimes:
+        codes = hall_seats.get(st["hall"], [])
+        share = min(1.0, max(0.0, rng.gauss(booked, booked / 2)))
+        created = (dt.datetime.fromisoformat(st["start_time"]) - dt.timedelta(days=rng.random() * 7)).isoformat()
+        for code in rng.sample(codes, int(len(codes) * share)):
+            user_id = user_ids[min(users - 1, int(rng.expovariate(8 / max(users, 1))))]
+            if rng.random() < CANCELLED_SHARE:
+                tickets.append((user_id, st["id"], code, created, "cancelled"))
+            else:
+                tickets.append((user_id, st["id"], code, created, "active"))
+                sold.append((user_id, created, st["id"], code))
+    cur = conn.cursor()
+    db.begin_immediate(cur)
+    cur.executemany(
+        "INSERT INTO tickets(user_id, showtime_id, seat_code, created_at, status) VALUES(?,?,?,?,?)", tickets
+    )
+    # Seats are booked with showtime_version_seat dropped: it would bump the
+    # version and write a seat_changes row per seat. Each showtime gets one
+    # bump instead and no log (readers of an older version get a snapshot).
+    # The trigger is back before the commit, so no other connection sees it gone.
+    trigger = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'showtime_version_seat'"
+    ).fetchone()[0]
+    cur.execute("DROP TRIGGER showtime_version_seat")
+    cur.executemany(
+        "UPDATE seats SET status='booked', booked_by=?, booked_at=? WHERE showtime_id=? AND seat_code=?", sold
+    )
+    cur.execute(trigger)
+    cur.executemany(
+        "UPDATE showtimes SET version = version + 1 WHERE id = ?", ((st_id,) for st_id in sorted({s[2] for s in sold}))
+    )
+    conn.commit()
+    t = _timed(report, "tickets", t)
+
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    report["phases_s"]["total"] = round(time.perf_counter() - started, 3)
+    report["rows"] = {
+        "halls": halls,
+        "movies": movies,
+        "showtimes": result["showtimes"],
+        "seats": result["seats"],
+        "users": users,
+        "tickets": len(tickets),
+        "booked_seats": len(sold),
+    }
+    report["db_bytes"] = os.path.getsize(conn.execute("PRAGMA database_list").fetchone()["file"])
+
+    heavy = conn.execute(
+        "SELECT user_id FROM tickets WHERE user_id >= ? GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1", (user_ids[0] if user_ids else 0,)
+    ).fetchone()
+    busy = conn.execute(
+        "SELECT movie_id FROM showtimes WHERE id >= ? GROUP BY movie_id ORDER BY COUNT(*) DESC LIMIT 1", (first_show,)
+    ).fetchone()
+    if heavy is not None and busy is not None:
+        report["probe_ms"] = {
+            "my_tickets_heaviest_user": _probe(conn, db.my_tickets, heavy[0]),
+            "my_tickets_first_page": _probe(conn, db.my_tickets, heavy[0], 20),
+            "list_showtimes_busiest_movie": _probe(conn, db.list_showtimes, busy[0]),
+            "list_movies_first_page": _probe(conn, db.list_movies, 20),
+            "search_movies": _probe(conn, db.search_movies, "night sta", 20),
+        }
+    return report
+
+
 def main() -> None:
     p = argparse.ArgumentParser(
     description="Seed demo movies & showtimes into cinema DB"
 )
     p.add_argument("--db", default="server/cinema.db")
+    p.add_argument("--scale", action="store_true", help="generate a large benchmark data set (see below)")
+    p.add_argument("--movies", type=int, default=5000)
+    p.add_argument("--halls", type=int, default=20)
+    p.add_argument("--days", type=int, default=14, help="days of showtimes, %d per hall and day" % len(SLOT_HOURS))
+    p.add_argument("--users", type=int, default=20000)
+    p.add_argument("--booked", type=float, default=0.35, help="average share of seats sold per showtime")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument(
+        "--start-date", type=dt.date.fromisoformat, default=None,
+        help="first showtime day, YYYY-MM-DD (default: today); fix it to reproduce a data set exactly",
+    )
     args = p.parse_args()
 
     conn = connect(args.db)
     init_db(conn)
 
+    if args.scale:
+        report = seed_scale(conn, args.movies, args.halls, args.days, args.users, args.booked, args.seed, args.start_date)
+        print(json.dumps(report, indent=2))
+        conn.close()
+        return
+
     # If already seeded, don't create duplicates.
     # (Still prints what is currently in DB so it's easy to demo.)
     if _count_showtimes(conn) > 0:
@@ -0,0 +1,191 @@
+"""
+Admission control: which requests get to run, checked before `handle`.
+
+  connections  at most `max_connections` open at once (per process); one
+               more gets a single busy reply and is closed.
+  rate         token buckets per client IP and per session token: `rate`
+               requests/s on average, `burst` back to back. An empty bucket
+               is answered at once with `retry_after`, never reaching SQLite.
+               Only a live session gets a bucket of its own; any other token
+               is charged to one token bucket per client IP, so inventing a
+               new token per request buys nothing.
+  queue        requests waiting for a handler thread are bounded
+               (`queue_max`); one that already waited `queue_wait` seconds
+               is shed instead of run, since its client is about to time out
+               and running it would only delay the requests behind it.
+
+Every rejection is the same `Server busy, retry later` error the password
+hasher uses, with `data.retry_after` in seconds. All limits are off (0) by
+default.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from common.protocol import response_error
+
+SERVER_BUSY = "Server busy, retry later"
+# retry_after for a full server (connections, queue) rather than an empty bucket.
+RETRY_AFTER_BUSY = 0.5
+RATE_KEYS_MAX = 65536
+
+
+def busy_response(retry_after: float = RETRY_AFTER_BUSY) -> str:
+    return response_error(SERVER_BUSY, {"retry_after": round(retry_after, 3)})
+
+
+@dataclass(frozen=True, slots=True)
+class Limits:
+    """The `--max-connections`, `--rate-*` and `--queue-*` options; 0 turns a limit off."""
+    max_connections: int = 0
+    ip_rate: float = 0.0
+    ip_burst: float = 0.0  # 0: one second's worth of `ip_rate`
+    token_rate: float = 0.0
+    token_burst: float = 0.0
+    queue_max: int = 0
+    queue_wait: float = 0.0
+
+
+class RateLimiter:
+    """Token buckets keyed by client IP or token; the least recently seen keys are dropped past `max_keys`."""
+
+    def __init__(self, rate: float, burst: float = 0.0, max_keys: int = RATE_KEYS_MAX,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.burst = max(burst or rate, 1.0)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: Hashable) -> float:
+        """Spend one token of `key`'s bucket: 0.0 if it had one, else seconds until it will."""
+        with self._lock:
+            now = self.clock()
+            entry = self._buckets.pop(key, None)
+            tokens = self.burst if entry is None else min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+
+class Admission:
+    """
+    `slots`: handlers allowed to run at once. The threaded engine has no
+    handler pool of its own (every connection thread runs its requests), so
+    it passes one to give the queue limits something to wait for; the
+    asyncio engine's executor already bounds it.
+    """
+
+    def __init__(self, limits: Limits = Limits(), slots: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 is_session: Optional[Callable[[str], bool]] = None) -> None:
+        self.limits = limits
+        self.clock = clock
+        self.is_session = is_session  # SessionStore.known; None: no token is trusted
+        self.by_ip = RateLimiter(limits.ip_rate, limits.ip_burst, clock=clock) if limits.ip_rate > 0 else None
+        self.by_token = (RateLimiter(limits.token_rate, limits.token_burst, clock=clock)
+                         if limits.token_rate > 0 else None)
+        self.queueing = bool(limits.queue_max or limits.queue_wait)
+        self._slots = threading.Semaphore(slots) if slots and self.queueing else None
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.waiting = 0
+        self.connections_rejected = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def connect(self) -> bool:
+        """Count a new connection; False (close it) when `max_connections` are already open."""
+        with self._lock:
+            if self.limits.max_connections and self.connections >= self.limits.max_connections:
+                self.connections_rejected += 1
+                return False
+            self.connections += 1
+            return True
+
+    def disconnect(self) -> None:
+        with self._lock:
+            self.connections -= 1
+
+    def check(self, addr: Any, msg: Any) -> Optional[str]:
+        """None if `msg` from `addr` is within its rate limits, else the busy response."""
+        wait = 0.0
+        if self.by_ip is not None and isinstance(addr, tuple) and addr:
+            wait = self.by_ip.take(addr[0])
+        if not wait and self.by_token is not None and isinstance(msg, dict):
+            data = msg.get("data")
+            token = data.get("token") if isinstance(data, dict) else None
+            if token and isinstance(token, str):
+                if self.is_session is not None and self.is_session(token):
+                    wait = self.by_token.take(token)
+                else:
+                    wait = self.by_token.take(("unknown token", addr[0] if isinstance(addr, tuple) and addr else None))
+        if not wait:
+            return None
+        with self._lock:
+            self.rate_limited += 1
+        return busy_response(wait)
+
+    def enter(self) -> Optional[float]:
+        """Queue a request for a handler: the time it was queued, or None (shed) when `queue_max` already wait."""
+        if not self.queueing:
+            return 0.0
+        with self._lock:
+            if self.limits.queue_max and self.waiting >= self.limits.queue_max:
+                self.shed += 1
+                return None
+            self.waiting += 1
+        return self.clock()
+
+    def _start(self, entered: float) -> bool:
+        """Leave the queue on the handler thread, taking a slot; False when the request waited too long."""
+        wait = self.limits.queue_wait
+        admitted = True
+        if self._slots is not None:
+            if wait:
+                admitted = self._slots.acquire(timeout=max(wait - (self.clock() - entered), 0.0))
+            else:
+                self._slots.acquire()
+        elif wait:
+            admitted = self.clock() - entered <= wait
+        with self._lock:
+            self.waiting -= 1
+            if not admitted:
+                self.shed += 1
+        return admitted
+
+    def run(self, entered: Optional[float], fn: Callable[..., str], *args: Any) -> str:
+        """`fn(*args)` for a request queued at `entered` (see `enter`), or the busy response if it is shed."""
+        if not self.queueing:
+            return fn(*args)
+        if entered is None or not self._start(entered):
+            return busy_response()
+        try:
+            return fn(*args)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "connections_rejected_total": self.connections_rejected,
+                "rate_limited_total": self.rate_limited,
+                "requests_shed_total": self.shed,
+                "requests_queued": self.waiting,
+            }
@@ -0,0 +1,346 @@
+"""
+asyncio server engine.
+
+All connections live on one event loop (one coroutine per client instead of
+one OS thread), so thousands of idle CLI clients cost only a StreamReader
+buffer each. Handler work, which touches SQLite and may block, runs on a
+bounded thread pool so the loop itself never waits on the database.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns
+from typing import Optional, Set, Tuple
+
+from common.protocol import (
+    FRAME_HEADER,
+    MAX_FRAME,
+    Framing,
+    attach_id,
+    decode_frame,
+    is_hello,
+    loads_message,
+    negotiate,
+    response_error,
+)
+from .admission import Admission, Limits, busy_response
+from .db import ConnectionPool, init_db
+from .handlers import Peer, ServerContext, SessionStore, can_pipeline, handle
+from .holds import HOLD_TTL_DEFAULT
+from .main import PIPELINE_MAX_INFLIGHT, build_context, build_sessions, start_metrics_endpoint
+from .metrics import discard
+from .passwords import DEFAULT_SCHEME, PasswordHasher
+from .sessions import SESSION_TTL_DEFAULT, SESSIONS_MAX_DEFAULT
+from .pubsub import Subscriber
+
+# Max size of one request line; longer lines are rejected and the client dropped.
+LINE_LIMIT = 1 << 20
+DB_THREADS_DEFAULT = 8
+BACKLOG_DEFAULT = 4096
+
+
+def raise_nofile_limit() -> None:
+    """
+    Lift the soft open-files limit to the hard limit so the process can hold
+    10k+ sockets. Best effort: no-op where `resource` is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def _handle_pooled(
+    pool: ConnectionPool, sessions: SessionStore, msg, ctx: ServerContext, peer: Peer, parse_ns: int = 0
+) -> str:
+    return handle(pool.get(), sessions, msg, ctx, peer, parse_ns)
+
+
+class AsyncSubscriber(Subscriber):
+    """Seat events for one asyncio connection; the dispatcher thread wakes a writer task."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, send) -> None:
+        super().__init__()
+        self._loop = loop
+        self._send = send
+        self._flag = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._kick)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def _kick(self) -> None:
+        if self._closed:
+            return
+        self._flag.set()
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while not self._closed:
+                await self._flag.wait()
+                self._flag.clear()
+                for line in self.drain():
+                    await self._send(line)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+
+
+async def read_request(reader: asyncio.StreamReader, framing: Framing) -> Optional[bytes]:
+    """Read one request body (a JSON line or a frame); None on EOF."""
+    if not framing.framed:
+        return await reader.readline() or None
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, flags = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise ValueError("Frame too large")
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return decode_frame(flags, body)
+
+
+async def serve_client(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    pool: ConnectionPool,
+    sessions: SessionStore,
+    ctx: ServerContext,
+    executor: ThreadPoolExecutor,
+) -> None:
+    """
+    Same line-by-line request/response loop as `main.client_thread`, but the
+    read/write waits are awaits on the event loop. Each executor thread uses
+    its own pooled SQLite connection.
+
+    Pipelined (id-tagged, read-only) requests become tasks answered as they
+    complete; any other request first waits for those tasks. Requests over
+    `ctx.admission`'s limits are answered on the loop without a thread.
+    """
+    admission = ctx.admission or Admission()
+    if not admission.connect():
+        writer.write(busy_response().encode("utf-8"))
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        return
+    loop = asyncio.get_running_loop()
+    drain_lock = asyncio.Lock()
+    inflight: Set[asyncio.Task] = set()
+    framing = Framing()
+    count = ctx.metrics.incr if ctx.metrics is not None else discard
+    count("connections_opened")
+
+    async def send(resp: str, switch_to: Optional[Framing] = None) -> None:
+        out = framing.encode(resp)
+        writer.write(out)
+        count("bytes_out", len(out))
+        if switch_to is not None:
+            # Before any await: no event may slip out in the old framing.
+            framing.mode, framing.compress = switch_to.mode, switch_to.compress
+        async with drain_lock:
+            await writer.drain()
+
+    peer = Peer(addr=writer.get_extra_info("peername"), subscriber=AsyncSubscriber(loop, send))
+
+    async def run_handler(msg, parse_ns: int) -> str:
+        entered = admission.enter()
+        if entered is None:
+            return busy_response()
+        fut = loop.run_in_executor(
+            executor, admission.run, entered, _handle_pooled, pool, sessions, msg, ctx, peer, parse_ns
+        )
+        # A queued job must still run (or be shed) to leave the queue, even if this client is gone.
+        return await (asyncio.shield(fut) if admission.queueing else fut)
+
+    async def run_pipelined(msg, parse_ns: int) -> None:
+        resp = await run_handler(msg, parse_ns)
+        await send(attach_id(resp, msg.get("id")))
+
+    try:
+        while True:
+            try:
+                raw = await read_request(reader, framing)
+            except ValueError:
+                # Longer than LINE_LIMIT / MAX_FRAME: answer once, then drop the client.
+                await send(response_error("Request too large"))
+                break
+            if raw is None:
+                break
+            count("bytes_in", len(raw) + (FRAME_HEADER.size if framing.framed else 0))
+
+            t0 = perf_counter_ns()
+            try:
+                msg = loads_message(raw)
+            except Exception as exc:
+                await send(response_error(f"Bad request: {exc}"))
+                continue
+            parse_ns = perf_counter_ns() - t0
+
+            busy = admission.check(peer.addr, msg)
+            if busy is None and can_pipeline(msg):
+                if len(inflight) >= PIPELINE_MAX_INFLIGHT:
+                    await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                task = asyncio.create_task(run_pipelined(msg, parse_ns))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+                continue
+
+            if inflight:
+                await asyncio.gather(*inflight, return_exceptions=True)
+
+            if busy is not None:
+                await send(attach_id(busy, msg.get("id") if isinstance(msg, dict) else None))
+                continue
+
+            if is_hello(msg):
+                resp, switch_to = negotiate(msg.get("data") or {})
+                await send(attach_id(resp, msg.get("id")), switch_to)
+                continue
+
+            try:
+                resp = await run_handler(msg, parse_ns)
+            except Exception as exc:
+                resp = response_error(f"Bad request: {exc}")
+            await send(attach_id(resp, msg.get("id") if isinstance(msg, dict) else None))
+
+        if inflight:
+            await asyncio.gather(*inflight, return_exceptions=True)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception:
+        count("client_errors")
+    finally:
+        count("connections_closed")
+        admission.disconnect()
+        for task in inflight:
+            task.cancel()
+        if ctx.events is not None:
+            ctx.events.unsubscribe(peer.subscriber)
+        peer.subscriber.close()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def serve(
+    host: str,
+    port: int,
+    db_path: str,
+    db_threads: int = DB_THREADS_DEFAULT,
+    backlog: int = BACKLOG_DEFAULT,
+    ready: "asyncio.Future[Tuple[str, int]] | None" = None,
+    use_seatmap: bool = True,
+    hold_ttl: int = HOLD_TTL_DEFAULT,
+    metrics_port: Optional[int] = None,
+    kdf: str = DEFAULT_SCHEME,
+    hash_workers: Optional[int] = None,
+    hash_queue: Optional[int] = None,
+    session_store: str = "sqlite",
+    session_ttl: float = SESSION_TTL_DEFAULT,
+    max_sessions: int = SESSIONS_MAX_DEFAULT,
+    session_snapshot: Optional[str] = None,
+    sock: Optional[socket.socket] = None,
+    shared_db: bool = False,
+    limits: Limits = Limits(),
+) -> None:
+    """`sock`, `shared_db` and `limits` as for `main.run_server`; `db_threads` bound the running handlers."""
+    pool = ConnectionPool(db_path)
+    init_db(pool.get())
+
+    sessions = build_sessions(pool, session_store, session_ttl, max_sessions, session_snapshot, shared_db)
+    hasher = PasswordHasher(kdf, hash_workers, hash_queue)
+    ctx = build_context(pool, use_seatmap, hold_ttl, hasher, shared_db, Admission(limits, is_session=sessions.known))
+    metrics_http = start_metrics_endpoint(host, metrics_port, ctx, sessions) if metrics_port is not None else None
+    executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="db")
+
+    async def on_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await serve_client(reader, writer, pool, sessions, ctx, executor)
+
+    if sock is not None:
+        server = await asyncio.start_server(on_client, sock=sock, limit=LINE_LIMIT)
+    else:
+        server = await asyncio.start_server(
+            on_client, host, port, limit=LINE_LIMIT, backlog=backlog, reuse_address=True
+        )
+    bound = server.sockets[0].getsockname()[:2]
+    print(f"[SERVER] Listening on {bound[0]}:{bound[1]} (engine=asyncio, db={db_path}, pid={os.getpid()})")
+    if ready is not None:
+        ready.set_result(bound)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if metrics_http is not None:
+            metrics_http.shutdown()
+        executor.shutdown(wait=False, cancel_futures=True)
+        ctx.hasher.close()
+        sessions.close()
+        if ctx.seatmap is not None:
+            ctx.seatmap.close()
+        if ctx.events is not None:
+            ctx.events.close()
+        if ctx.holds is not None:
+            ctx.holds.close()
+        pool.close_all()
+
+
+def run_asyncio_server(
+    host: str,
+    port: int,
+    db_path: str,
+    db_threads: int = DB_THREADS_DEFAULT,
+    backlog: int = BACKLOG_DEFAULT,
+    use_seatmap: bool = True,
+    hold_ttl: int = HOLD_TTL_DEFAULT,
+    metrics_port: Optional[int] = None,
+    kdf: str = DEFAULT_SCHEME,
+    hash_workers: Optional[int] = None,
+    hash_queue: Optional[int] = None,
+    session_store: str = "sqlite",
+    session_ttl: float = SESSION_TTL_DEFAULT,
+    max_sessions: int = SESSIONS_MAX_DEFAULT,
+    session_snapshot: Optional[str] = None,
+    sock: Optional[socket.socket] = None,
+    shared_db: bool = False,
+    limits: Limits = Limits(),
+) -> None:
+    raise_nofile_limit()
+    try:
+        asyncio.run(
+            serve(
+                host, port, db_path, db_threads, backlog,
+                use_seatmap=use_seatmap, hold_ttl=hold_ttl, metrics_port=metrics_port,
+                kdf=kdf, hash_workers=hash_workers, hash_queue=hash_queue,
+                session_store=session_store, session_ttl=session_ttl,
+                max_sessions=max_sessions, session_snapshot=session_snapshot,
+                sock=sock, shared_db=shared_db, limits=limits,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,114 @@
+"""
+Read cache for catalogue queries (`list_movies`, `list_showtimes`).
+
+The catalogue only changes through the admin actions, so every cached entry
+is tagged with the catalogue version it was built from and the admin write
+paths bump that version. Entries are kept already serialized as response
+lines, so a hit costs no SQLite query and no JSON encoding. The version is
+also what clients send back as `if_version`.
+
+With a `stamp` (the catalogue version the database keeps, see
+`db.catalogue_version`) the cache reports that version instead of a counter
+of its own, so it survives restarts and is the same in every process. It is
+read once and again after each local `invalidate`; with `shared` (several
+server processes on one database, where an admin write lands in only one
+of them) on every lookup, invalidating on a change.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+SHOWTIME_ENTRIES_DEFAULT = 1024
+MOVIE_ENTRIES_DEFAULT = 256
+
+class CatalogueCache:
+    """
+    `list_movies` and `list_showtimes` lines are cached per request shape
+    (page cursor, limit, fields): each is an LRU-bounded dict keyed by it.
+    """
+
+    def __init__(self, max_showtime_entries: int = SHOWTIME_ENTRIES_DEFAULT,
+                 stamp: Optional[Callable[[], int]] = None, max_movie_entries: int = MOVIE_ENTRIES_DEFAULT,
+                 shared: bool = False) -> None:
+        self.max_showtime_entries = max_showtime_entries
+        self.max_movie_entries = max_movie_entries
+        self.stamp = stamp
+        self.shared = shared
+        self._stamped = False
+        self._lock = threading.Lock()
+        self._version = 0
+        self._movies: "OrderedDict[Hashable, Tuple[int, str]]" = OrderedDict()
+        self._showtimes: "OrderedDict[Hashable, Tuple[int, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> int:
+        """Called after an admin write commits; returns the new version."""
+        with self._lock:
+            if self.stamp is not None:
+                self._check_stamp()
+            else:
+                self._invalidate(self._version + 1)
+            return self._version
+
+    def _invalidate(self, version: int) -> None:
+        self._version = version
+        self._movies.clear()
+        self._showtimes.clear()
+
+    def _check_stamp(self) -> None:
+        """Take the database's version (caller holds the lock)."""
+        version = self.stamp()
+        self._stamped = True
+        if version != self._version:
+            self._invalidate(version)
+
+    def _current(self) -> int:
+        if self.stamp is not None and (self.shared or not self._stamped):
+            self._check_stamp()
+        return self._version
+
+    def _cached(self, entries: "OrderedDict[Hashable, Tuple[int, str]]", cap: int, key: Hashable,
+                build: Callable[[int], str], if_version: Optional[int]) -> Tuple[int, Optional[str]]:
+        with self._lock:
+            version = self._current()
+            if if_version == version:
+                return version, None
+            entry = entries.get(key)
+            if entry is not None and entry[0] == version:
+                entries.move_to_end(key)
+                self.hits += 1
+                return version, entry[1]
+            self.misses += 1
+        line = build(version)
+        with self._lock:
+            # Store only if no admin write happened while building.
+            if self._version == version:
+                entries[key] = (version, line)
+                entries.move_to_end(key)
+                while len(entries) > cap:
+                    entries.popitem(last=False)
+        return version, line
+
+    def movies(self, build: Callable[[int], str], key: Hashable = (),
+               if_version: Optional[int] = None) -> Tuple[int, Optional[str]]:
+        """
+        (version, cached `list_movies` response line); `build(version)` runs
+        on a miss. The line is None when `if_version` is the current version.
+        """
+        return self._cached(self._movies, self.max_movie_entries, key, build, if_version)
+
+    def showtimes(self, movie_id: int, build: Callable[[int], str], key: Hashable = (),
+                  if_version: Optional[int] = None) -> Tuple[int, Optional[str]]:
+        """Cached `list_showtimes` response line for one movie, as `movies`."""
+        return self._cached(self._showtimes, self.max_showtime_entries, (movie_id, key), build, if_version)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._showtimes) + len(self._movies)
@@ -1,30 +1,121 @@
 from __future__ import annotations
 
 import os
+import re
 import sqlite3
-import hashlib
+import threading
+import time
+import uuid
 import datetime as dt
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from common.seats import layout_seats
+from .metrics import Counters
+from .passwords import hash_password, needs_rehash, verify_password
 
 DB_PATH_DEFAULT = os.path.join(os.path.dirname(__file__), "cinema.db")
 
+# Connection tuning (see `connect`).
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 64 * 1024 * 1024
+CACHE_SIZE_KIB = 16 * 1024
+
+# A BEGIN IMMEDIATE slower than this waited for another writer's lock.
+LOCK_WAIT_THRESHOLD_NS = 1_000_000
+
+# Process-wide write-lock contention: lock_waits, lock_wait_us, busy_errors.
+lock_stats = Counters()
 
-def connect(db_path: str = DB_PATH_DEFAULT) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+
+def connect(db_path: str = DB_PATH_DEFAULT, check_same_thread: bool = False) -> sqlite3.Connection:
+    """
+    Open a tuned connection: WAL journal so readers never wait for the writer,
+    synchronous=NORMAL (durable at checkpoints, safe with WAL), a busy timeout
+    so concurrent BEGIN IMMEDIATE calls queue instead of failing, and mmap'd reads.
+    """
+    conn = sqlite3.connect(
+        db_path, check_same_thread=check_same_thread, timeout=BUSY_TIMEOUT_MS / 1000
+    )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
     return conn
 
 
-def sha256_hex(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+def begin_immediate(cur: sqlite3.Cursor) -> None:
+    """BEGIN IMMEDIATE, counting waits for (and timeouts on) the write lock in `lock_stats`."""
+    t0 = time.perf_counter_ns()
+    try:
+        cur.execute("BEGIN IMMEDIATE;")
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e) or "busy" in str(e):
+            lock_stats.incr("busy_errors")
+        raise
+    waited = time.perf_counter_ns() - t0
+    if waited >= LOCK_WAIT_THRESHOLD_NS:
+        lock_stats.incr("lock_waits")
+        lock_stats.incr("lock_wait_us", waited // 1000)
+
+
+class ConnectionPool:
+    """
+    Hands every worker thread its own connection (created on first use), so
+    transactions from different threads never share a connection object and
+    WAL readers run alongside the single writer.
+    """
 
+    def __init__(self, db_path: str = DB_PATH_DEFAULT) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: List[sqlite3.Connection] = []
 
-def init_db(conn: sqlite3.Connection) -> None:
-    cur = conn.cursor()
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
 
-    cur.executescript(
-        """
+    def release(self) -> None:
+        """Close the calling thread's connection (short-lived client threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            try:
+                self._conns.remove(conn)
+            except ValueError:
+                pass
+        conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._conns)
+
+
+# Schema history, applied in order by `migrate`. Never edit a released step:
+# append a new one. Each script runs in one write transaction together with
+# the schema_version bump, so a step is applied completely or not at all.
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "base schema", """
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT NOT NULL UNIQUE,
@@ -72,61 +163,330 @@ def init_db(conn: sqlite3.Connection) -> None:
             FOREIGN KEY(showtime_id) REFERENCES showtimes(id)
         );
 
+        -- Temporary holds: a seat stays 'available' in seats while held;
+        -- a hold only counts while expires_at (unix time) is in the future.
+        CREATE TABLE IF NOT EXISTS seat_holds (
+            showtime_id INTEGER NOT NULL,
+            seat_code TEXT NOT NULL,
+            hold_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY(showtime_id, seat_code),
+            FOREIGN KEY(showtime_id) REFERENCES showtimes(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_seat_holds_hold ON seat_holds(hold_id);
+    """),
+    (2, "covering index for list_showtimes", """
+        -- list_showtimes: movie filter already in start_time order, no row lookups.
+        -- (authenticate needs nothing new: UNIQUE(username) is already its index.)
+        CREATE INDEX IF NOT EXISTS idx_showtimes_movie_start ON showtimes(movie_id, start_time, hall, price);
+    """),
+    (3, "tickets: unique seat among active tickets only, index on user_id", """
+        -- UNIQUE(showtime_id, seat_code) also counted cancelled tickets, so a
+        -- seat could never be booked again after a cancel. SQLite cannot drop
+        -- a table constraint: rebuild the table.
+        CREATE TABLE tickets_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            showtime_id INTEGER NOT NULL,
+            seat_code TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('active','cancelled')),
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(showtime_id) REFERENCES showtimes(id)
+        );
+        INSERT INTO tickets_new(id, user_id, showtime_id, seat_code, created_at, status)
+            SELECT id, user_id, showtime_id, seat_code, created_at, status FROM tickets;
+        DROP TABLE tickets;
+        ALTER TABLE tickets_new RENAME TO tickets;
+        CREATE UNIQUE INDEX uq_tickets_active_seat ON tickets(showtime_id, seat_code) WHERE status = 'active';
+        -- my_tickets: rowid order within one user, so ORDER BY id needs no sort.
+        CREATE INDEX idx_tickets_user ON tickets(user_id);
+    """),
+    (4, "hall layouts; seats copied from hall_seats when a showtime is added", """
+        CREATE TABLE halls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            rows INTEGER NOT NULL,
+            cols INTEGER NOT NULL,
+            layout TEXT NOT NULL          -- layout rows joined by '/', see common.seats
+        );
+        -- Seat template of a hall, materialized once when the hall is created.
+        CREATE TABLE hall_seats (
+            hall_id INTEGER NOT NULL,
+            seat_code TEXT NOT NULL,
+            seat_class TEXT NOT NULL,
+            PRIMARY KEY(hall_id, seat_code),
+            FOREIGN KEY(hall_id) REFERENCES halls(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        ALTER TABLE seats ADD COLUMN seat_class TEXT NOT NULL DEFAULT 'standard';
+
+        -- Showtimes in a hall nobody laid out get the old 5 x 8 grid.
+        INSERT INTO halls(name, rows, cols, layout)
+            VALUES('default', 5, 8, 'SSSSSSSS/SSSSSSSS/SSSSSSSS/SSSSSSSS/SSSSSSSS');
+        INSERT INTO hall_seats(hall_id, seat_code, seat_class)
+            WITH RECURSIVE r(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM r WHERE i < 4),
+                           c(j) AS (SELECT 1 UNION ALL SELECT j + 1 FROM c WHERE j < 8)
+            SELECT (SELECT id FROM halls WHERE name = 'default'), char(65 + i) || j, 'standard' FROM r, c;
+        -- Seats used to be created lazily on first read: fill in any showtime still without them.
+        INSERT INTO seats(showtime_id, seat_code, status, seat_class)
+            SELECT st.id, hs.seat_code, 'available', hs.seat_class
+            FROM showtimes st
+            JOIN hall_seats hs ON hs.hall_id = (SELECT id FROM halls WHERE name = 'default')
+            WHERE NOT EXISTS (SELECT 1 FROM seats WHERE seats.showtime_id = st.id);
+    """),
+    (5, "persistent login sessions", """
+        -- Keyed by SHA-256 of the token: a copy of the database hands out no live tokens.
+        CREATE TABLE sessions (
+            token_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_sessions_expires ON sessions(expires_at);
+    """),
+    (6, "list_showtimes keyset order", """
+        -- Pages of list_showtimes are ordered by (start_time, id): id joins the key
+        -- ahead of the covered columns so paging needs no sort.
+        DROP INDEX IF EXISTS idx_showtimes_movie_start;
+        CREATE INDEX idx_showtimes_movie_start ON showtimes(movie_id, start_time, id, hall, price);
+    """),
+    (7, "full-text search over movie titles and descriptions", """
+        -- Contentless index (rows live in movies, joined on rowid). unicode61 drops
+        -- accents but 'đ' is a letter of its own, so the triggers fold it to 'd'
+        -- (and fts_query does the same): "hanh dong" finds "Hành động".
+        -- Prefix indexes serve the "term*" queries.
+        CREATE VIRTUAL TABLE movies_fts USING fts5(
+            title, description,
+            content='',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+        -- ORDER BY rank: BM25 with a title hit worth ten description hits.
+        INSERT INTO movies_fts(movies_fts, rank) VALUES('rank', 'bm25(10.0, 1.0)');
+        INSERT INTO movies_fts(rowid, title, description)
+            SELECT id, replace(replace(title, 'đ', 'd'), 'Đ', 'D'),
+                   replace(replace(coalesce(description, ''), 'đ', 'd'), 'Đ', 'D')
+            FROM movies;
+        CREATE TRIGGER movies_fts_insert AFTER INSERT ON movies BEGIN
+            INSERT INTO movies_fts(rowid, title, description)
+                VALUES (new.id, replace(replace(new.title, 'đ', 'd'), 'Đ', 'D'),
+                        replace(replace(coalesce(new.description, ''), 'đ', 'd'), 'Đ', 'D'));
+        END;
+        CREATE TRIGGER movies_fts_delete AFTER DELETE ON movies BEGIN
+            INSERT INTO movies_fts(movies_fts, rowid, title, description)
+                VALUES ('delete', old.id, replace(replace(old.title, 'đ', 'd'), 'Đ', 'D'),
+                        replace(replace(coalesce(old.description, ''), 'đ', 'd'), 'Đ', 'D'));
+        END;
+        CREATE TRIGGER movies_fts_update AFTER UPDATE OF title, description ON movies BEGIN
+            INSERT INTO movies_fts(movies_fts, rowid, title, description)
+                VALUES ('delete', old.id, replace(replace(old.title, 'đ', 'd'), 'Đ', 'D'),
+                        replace(replace(coalesce(old.description, ''), 'đ', 'd'), 'Đ', 'D'));
+            INSERT INTO movies_fts(rowid, title, description)
+                VALUES (new.id, replace(replace(new.title, 'đ', 'd'), 'Đ', 'D'),
+                        replace(replace(coalesce(new.description, ''), 'đ', 'd'), 'Đ', 'D'));
+        END;
+    """),
+    (8, "catalogue and per-showtime versions", """
+        -- Monotonic counters behind `if_version` reads. Triggers bump them on
+        -- every write, whichever process or code path makes it.
+        CREATE TABLE counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        INSERT INTO counters(name, value) VALUES('catalogue', 1), ('seatmap_epoch', 0);
+        CREATE TRIGGER catalogue_movie_insert AFTER INSERT ON movies BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
+        CREATE TRIGGER catalogue_movie_update AFTER UPDATE ON movies BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
+        CREATE TRIGGER catalogue_movie_delete AFTER DELETE ON movies BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
+        CREATE TRIGGER catalogue_showtime_insert AFTER INSERT ON showtimes BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
+        CREATE TRIGGER catalogue_showtime_update AFTER UPDATE OF movie_id, start_time, hall, price ON showtimes BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
+        CREATE TRIGGER catalogue_showtime_delete AFTER DELETE ON showtimes BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalogue';
+        END;
 
-        """
-    )
-    conn.commit()
+        -- Seat view of one showtime: seat status plus live holds.
+        ALTER TABLE showtimes ADD COLUMN version INTEGER NOT NULL DEFAULT 1;
+        CREATE TRIGGER showtime_version_seat AFTER UPDATE OF status ON seats BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = new.showtime_id;
+        END;
+        CREATE TRIGGER showtime_version_hold AFTER INSERT ON seat_holds BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = new.showtime_id;
+        END;
+        CREATE TRIGGER showtime_version_unhold AFTER DELETE ON seat_holds BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = old.showtime_id;
+        END;
+    """),
+    (9, "per-showtime seat change log", """
+        -- One row per showtime version: the seat whose view changed and its new
+        -- status (get_seats since_version). Only the last 256 versions of a
+        -- showtime are kept (SEAT_LOG_MAX); older readers get a full snapshot.
+        CREATE TABLE seat_changes (
+            showtime_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            seat_code TEXT NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY(showtime_id, version)
+        ) WITHOUT ROWID;
+        DROP TRIGGER showtime_version_seat;
+        DROP TRIGGER showtime_version_hold;
+        DROP TRIGGER showtime_version_unhold;
+        CREATE TRIGGER showtime_version_seat AFTER UPDATE OF status ON seats BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = new.showtime_id;
+            INSERT INTO seat_changes(showtime_id, version, seat_code, status)
+                SELECT id, version, new.seat_code, new.status FROM showtimes WHERE id = new.showtime_id;
+            DELETE FROM seat_changes WHERE showtime_id = new.showtime_id
+                AND version <= (SELECT version FROM showtimes WHERE id = new.showtime_id) - 256;
+        END;
+        CREATE TRIGGER showtime_version_hold AFTER INSERT ON seat_holds BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = new.showtime_id;
+            INSERT INTO seat_changes(showtime_id, version, seat_code, status)
+                SELECT id, version, new.seat_code, 'held' FROM showtimes WHERE id = new.showtime_id;
+            DELETE FROM seat_changes WHERE showtime_id = new.showtime_id
+                AND version <= (SELECT version FROM showtimes WHERE id = new.showtime_id) - 256;
+        END;
+        -- A hold going away leaves the seat as seats has it (booked when confirmed).
+        CREATE TRIGGER showtime_version_unhold AFTER DELETE ON seat_holds BEGIN
+            UPDATE showtimes SET version = version + 1 WHERE id = old.showtime_id;
+            INSERT INTO seat_changes(showtime_id, version, seat_code, status)
+                SELECT st.id, st.version, old.seat_code, COALESCE(s.status, 'available')
+                FROM showtimes st
+                LEFT JOIN seats s ON s.showtime_id = st.id AND s.seat_code = old.seat_code
+                WHERE st.id = old.showtime_id;
+            DELETE FROM seat_changes WHERE showtime_id = old.showtime_id
+                AND version <= (SELECT version FROM showtimes WHERE id = old.showtime_id) - 256;
+        END;
+    """),
+    (10, "movies showing after a time", """
+        -- search_movies(showing_after): the movies with an upcoming showtime,
+        -- read from the index alone, restrict the ranked full-text matches.
+        CREATE INDEX idx_showtimes_start_movie ON showtimes(start_time, movie_id);
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+DEFAULT_HALL = "default"
+# Versions of one showtime kept in seat_changes (the triggers of step 9).
+SEAT_LOG_MAX = 256
+
+
+def _statements(script: str) -> List[str]:
+    """Split a migration script into statements (trigger bodies stay whole)."""
+    out: List[str] = []
+    buf = ""
+    for part in script.split(";"):
+        buf += part + ";"
+        if sqlite3.complete_statement(buf):
+            stmt = "\n".join(
+                line for line in buf.strip().splitlines() if not line.strip().startswith("--")
+            ).strip()
+            if stmt != ";":
+                out.append(stmt)
+            buf = ""
+    return out
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return int(row[0] or 0)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Bring the schema up to SCHEMA_VERSION; returns the version. Databases
+    created before versioning start at 0 and go through every step (step 1
+    only creates what is missing). Safe to race: the version is re-read
+    under the write lock, so concurrent servers apply each step once.
+    """
+    for version, _name, script in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        cur = conn.cursor()
+        begin_immediate(cur)
+        try:
+            if schema_version(conn) < version:
+                for stmt in _statements(script):
+                    cur.execute(stmt)
+                cur.execute("DELETE FROM schema_version")
+                cur.execute("INSERT INTO schema_version(version) VALUES(?)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+def init_db(conn: sqlite3.Connection) -> None:
+    migrate(conn)
+    cur = conn.cursor()
 
     # Seed admin if missing
     cur.execute("SELECT id FROM users WHERE username = ?", ("admin",))
     if cur.fetchone() is None:
         cur.execute(
             "INSERT INTO users(username, password_hash, role) VALUES(?,?,?)",
-            ("admin", sha256_hex("admin123"), "admin"),
+            ("admin", hash_password("admin123"), "admin"),
         )
         conn.commit()
 
 
-def ensure_seats_for_showtime(conn: sqlite3.Connection, showtime_id: int, rows: int = 5, cols: int = 8) -> None:
-    """
-    Create seats for a showtime if not already created.
-    Default: 5 rows (A-E) x 8 columns (1-8) = 40 seats.
-    """
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM seats WHERE showtime_id = ?", (showtime_id,))
-    if cur.fetchone()["c"] > 0:
-        return
-    for r in range(rows):
-        row_letter = chr(ord("A") + r)
-        for c in range(1, cols + 1):
-            code = f"{row_letter}{c}"
-            cur.execute(
-                "INSERT INTO seats(showtime_id, seat_code, status, booked_by, booked_at) VALUES(?,?,?,?,?)",
-                (showtime_id, code, "available", None, None),
-            )
-    conn.commit()
-
-
-def create_user(conn: sqlite3.Connection, username: str, password: str) -> Tuple[bool, str]:
+def create_user(conn: sqlite3.Connection, username: str, password: str,
+                password_hash: Optional[str] = None) -> Tuple[bool, str]:
+    """`password_hash` lets the caller hash off-thread; otherwise it is computed here."""
+    if password_hash is None:
+        password_hash = hash_password(password)
+    # `with conn`: a failed INSERT must roll back, or the implicit transaction
+    # keeps the write lock and every other writer times out.
     try:
-        conn.execute(
-            "INSERT INTO users(username, password_hash, role) VALUES(?,?,?)",
-            (username, sha256_hex(password), "user"),
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                "INSERT INTO users(username, password_hash, role) VALUES(?,?,?)",
+                (username, password_hash, "user"),
+            )
         return True, "OK"
     except sqlite3.IntegrityError:
         return False, "Username already exists"
 
 
-def authenticate(conn: sqlite3.Connection, username: str, password: str) -> Optional[Dict[str, Any]]:
+def get_login(conn: sqlite3.Connection, username: str) -> Optional[Dict[str, Any]]:
+    """The user row plus its stored hash; the caller verifies the password."""
     row = conn.execute(
-        "SELECT id, username, role FROM users WHERE username=? AND password_hash=?",
-        (username, sha256_hex(password)),
+        "SELECT id, username, role, password_hash FROM users WHERE username=?", (username,)
     ).fetchone()
-    if not row:
+    return dict(row) if row else None
+
+
+def update_password_hash(conn: sqlite3.Connection, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """Swap in a rehashed password unless another login already did."""
+    with conn:
+        cur = conn.execute(
+            "UPDATE users SET password_hash=? WHERE id=? AND password_hash=?", (new_hash, user_id, old_hash)
+        )
+    return cur.rowcount == 1
+
+
+def authenticate(conn: sqlite3.Connection, username: str, password: str) -> Optional[Dict[str, Any]]:
+    """Verify inline and upgrade legacy hashes (the server does this via its PasswordHasher)."""
+    user = get_login(conn, username)
+    if not user:
         return None
-    return dict(row)
+    stored = user.pop("password_hash")
+    if not verify_password(password, stored):
+        return None
+    if needs_rehash(stored):
+        update_password_hash(conn, user["id"], stored, hash_password(password))
+    return user
 
 
 def get_user_by_id(conn: sqlite3.Connection, user_id: int) -> Optional[Dict[str, Any]]:
@@ -134,43 +494,377 @@ def get_user_by_id(conn: sqlite3.Connection, user_id: int) -> Optional[Dict[str,
     return dict(row) if row else None
 
 
-def list_movies(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
-    rows = conn.execute("SELECT * FROM movies ORDER BY id DESC").fetchall()
+def catalogue_version(conn: sqlite3.Connection) -> int:
+    """Bumped (by trigger) on every write to movies or showtimes."""
+    return int(conn.execute("SELECT value FROM counters WHERE name = 'catalogue'").fetchone()[0])
+
+
+def showtime_version(conn: sqlite3.Connection, showtime_id: int) -> Optional[Tuple[int, bool]]:
+    """
+    (version, settled) of a showtime's seat view, None if it does not exist.
+    A hold stops counting when it expires, before its row is deleted; until
+    then the view has changed without a bump and `settled` is False.
+    """
+    row = conn.execute(
+        "SELECT version, NOT EXISTS(SELECT 1 FROM seat_holds WHERE showtime_id = s.id AND expires_at <= ?) "
+        "FROM showtimes s WHERE id = ?",
+        (time.time(), showtime_id),
+    ).fetchone()
+    return (int(row[0]), bool(row[1])) if row else None
+
+
+def seat_changes(conn: sqlite3.Connection, showtime_id: int,
+                 since_version: int) -> Optional[Tuple[int, List[Dict[str, str]]]]:
+    """
+    (version, [{"seat_code", "status"}]) of the seats whose view changed
+    after `since_version`, one entry per seat with its latest status. None
+    when the log no longer reaches back to `since_version` (or never did).
+    """
+    rows = conn.execute(
+        "SELECT version, seat_code, status FROM seat_changes WHERE showtime_id = ? AND version > ? ORDER BY version",
+        (showtime_id, since_version),
+    ).fetchall()
+    if not rows or rows[0]["version"] != since_version + 1:
+        return None
+    latest = {r["seat_code"]: r["status"] for r in rows}
+    return int(rows[-1]["version"]), [{"seat_code": c, "status": st} for c, st in latest.items()]
+
+
+def next_seatmap_epoch(conn: sqlite3.Connection) -> int:
+    """A number no earlier call returned: each seat map load starts its versions above the last."""
+    with conn:
+        return int(conn.execute(
+            "UPDATE counters SET value = value + 1 WHERE name = 'seatmap_epoch' RETURNING value"
+        ).fetchone()[0])
+
+
+def save_session(conn: sqlite3.Connection, token_hash: str, user_id: int, expires_at: float) -> None:
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions(token_hash, user_id, expires_at) VALUES(?,?,?)",
+            (token_hash, user_id, expires_at),
+        )
+
+
+def touch_session(conn: sqlite3.Connection, token_hash: str, expires_at: float) -> None:
+    with conn:
+        conn.execute("UPDATE sessions SET expires_at=? WHERE token_hash=?", (expires_at, token_hash))
+
+
+def delete_session(conn: sqlite3.Connection, token_hash: str) -> None:
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE token_hash=?", (token_hash,))
+
+
+def load_session(conn: sqlite3.Connection, token_hash: str, now: float) -> Optional[Tuple[Dict[str, Any], float]]:
+    """The (user, expires_at) of a live session, or None."""
+    row = conn.execute(
+        "SELECT u.id, u.username, u.role, s.expires_at FROM sessions s JOIN users u ON u.id = s.user_id "
+        "WHERE s.token_hash=? AND s.expires_at > ?",
+        (token_hash, now),
+    ).fetchone()
+    if not row:
+        return None
+    return {"id": row["id"], "username": row["username"], "role": row["role"]}, row["expires_at"]
+
+
+def purge_sessions(conn: sqlite3.Connection, now: float) -> int:
+    with conn:
+        return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+
+
+# Projectable columns of the list queries (`fields`); the keyset columns
+# (id, and start_time for showtimes) are always returned.
+MOVIE_FIELDS = {"id": "id", "title": "title", "description": "description", "duration_min": "duration_min"}
+SHOWTIME_FIELDS = {
+    "id": "s.id", "movie_id": "s.movie_id", "start_time": "s.start_time", "hall": "s.hall",
+    "price": "s.price", "movie_title": "m.title AS movie_title",
+}
+TICKET_FIELDS = {
+    "id": "t.id", "seat_code": "t.seat_code", "created_at": "t.created_at", "status": "t.status",
+    "start_time": "s.start_time", "hall": "s.hall", "price": "s.price", "movie_title": "m.title AS movie_title",
+}
+# after_start_time without after_id: skip every showtime at that time.
+AFTER_ID_MAX = 1 << 62
+# Search words shorter than this are dropped (the shortest movies_fts prefix index).
+SEARCH_TERM_MIN = 2
+# The 'rank' option of movies_fts (migration 7), spelled out.
+SEARCH_RANK = "bm25(movies_fts, 10.0, 1.0)"
+
+
+def _columns(columns: Dict[str, str], fields: Optional[Sequence[str]], keys: Sequence[str]) -> str:
+    """SELECT list for `fields` (already validated against `columns`), keyset columns first."""
+    names = list(keys) + [f for f in (fields or columns) if f not in keys]
+    return ", ".join(columns[f] for f in names)
+
+
+def _limit(limit: Optional[int]) -> int:
+    return -1 if limit is None else limit  # LIMIT -1: no limit
+
+
+def list_movies(conn: sqlite3.Connection, limit: Optional[int] = None, after_id: Optional[int] = None,
+                fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Newest first; keyset page: ids below `after_id`."""
+    rows = conn.execute(
+        f"SELECT {_columns(MOVIE_FIELDS, fields, ('id',))} FROM movies WHERE id < ? ORDER BY id DESC LIMIT ?",
+        (AFTER_ID_MAX if after_id is None else after_id, _limit(limit)),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def fts_query(text: str) -> str:
+    """
+    FTS5 MATCH expression for free text: every word must match, each as a
+    prefix ("bat ma" finds "Batman"). Words are quoted, so FTS5 operators and
+    column filters typed by a user are searched for literally. 'đ' is folded
+    as in the movies_fts triggers. Words shorter than SEARCH_TERM_MIN are
+    dropped: a one-letter prefix is served by no prefix index and matches
+    nearly every movie.
+    """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    return " ".join(f'"{w}"*' for w in re.findall(r"\w+", text) if len(w) >= SEARCH_TERM_MIN)
+
+
+def search_movies(conn: sqlite3.Connection, text: str, limit: int, showing_after: Optional[str] = None,
+                  fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Best matches first. `showing_after` (ISO time) keeps only movies with a
+    showtime starting at or after it.
+
+    Matches are ranked on movies_fts alone and only the best `limit` are
+    joined to movies; with `showing_after` the full-text scan is restricted to
+    the movies showing (idx_showtimes_start_movie) before ranking. bm25() is
+    called with the weights of the 'rank' option directly, the same order at
+    about two thirds of the cost per match.
+    """
+    match = fts_query(text)
+    if not match:
+        return []
+    columns = {name: f"m.{col}" for name, col in MOVIE_FIELDS.items()}
+    ranked = f"SELECT rowid, {SEARCH_RANK} AS score FROM movies_fts WHERE movies_fts MATCH ?"
+    params: List[Any] = [match]
+    if showing_after is not None:
+        ranked += " AND rowid IN (SELECT movie_id FROM showtimes WHERE start_time >= ?)"
+        params.append(showing_after)
+    sql = f"SELECT {_columns(columns, fields, ('id',))} FROM ({ranked} ORDER BY score LIMIT ?) f " \
+          "JOIN movies m ON m.id = f.rowid ORDER BY f.score"
+    rows = conn.execute(sql, (*params, limit)).fetchall()
     return [dict(r) for r in rows]
 
 
 def add_movie(conn: sqlite3.Connection, title: str, description: str, duration_min: int) -> int:
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO movies(title, description, duration_min) VALUES(?,?,?)",
-        (title, description, duration_min),
-    )
-    conn.commit()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO movies(title, description, duration_min) VALUES(?,?,?)",
+            (title, description, duration_min),
+        )
     return int(cur.lastrowid)
 
 
 def add_showtime(conn: sqlite3.Connection, movie_id: int, start_time_iso: str, hall: str, price: int) -> int:
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO showtimes(movie_id, start_time, hall, price) VALUES(?,?,?,?)",
-        (movie_id, start_time_iso, hall, price),
-    )
-    conn.commit()
-    showtime_id = int(cur.lastrowid)
-    ensure_seats_for_showtime(conn, showtime_id)
+    """
+    Add a showtime and all its seats in one transaction: one INSERT ... SELECT
+    copies the seat template of `hall` (or of the default hall if no layout
+    has that name).
+    """
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO showtimes(movie_id, start_time, hall, price) VALUES(?,?,?,?)",
+            (movie_id, start_time_iso, hall, price),
+        )
+        showtime_id = int(cur.lastrowid)
+        conn.execute(
+            """
+            INSERT INTO seats(showtime_id, seat_code, status, seat_class)
+            SELECT ?, seat_code, 'available', seat_class FROM hall_seats
+            WHERE hall_id = COALESCE(
+                (SELECT id FROM halls WHERE name = ?), (SELECT id FROM halls WHERE name = ?)
+            )
+            """,
+            (showtime_id, hall, DEFAULT_HALL),
+        )
     return showtime_id
 
 
-def list_showtimes(conn: sqlite3.Connection, movie_id: int) -> List[Dict[str, Any]]:
+def add_hall(conn: sqlite3.Connection, name: str, layout: List[str]) -> Tuple[bool, str, Optional[int]]:
+    """Store a hall layout and its seat template; showtimes in hall `name` then use it."""
+    try:
+        seats = layout_seats(layout)
+    except ValueError as e:
+        return False, str(e), None
+    layout = [row.upper() for row in layout]
+    try:
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO halls(name, rows, cols, layout) VALUES(?,?,?,?)",
+                (name, len(layout), max(len(row) for row in layout), "/".join(layout)),
+            )
+            hall_id = int(cur.lastrowid)
+            conn.executemany(
+                "INSERT INTO hall_seats(hall_id, seat_code, seat_class) VALUES(?,?,?)",
+                [(hall_id, code, seat_class) for code, seat_class in seats],
+            )
+    except sqlite3.IntegrityError:
+        return False, "Hall already exists", None
+    return True, "OK", hall_id
+
+
+BULK_CHUNK = 1000
+
+# Seats of every showtime with id > ?, copied from its hall's template (or the default hall's).
+_BULK_SEATS_SQL = """
+    INSERT INTO seats(showtime_id, seat_code, status, seat_class)
+    SELECT st.id, hs.seat_code, 'available', hs.seat_class
+    FROM showtimes st
+    JOIN hall_seats hs ON hs.hall_id = COALESCE(
+        (SELECT id FROM halls WHERE name = st.hall), (SELECT id FROM halls WHERE name = ?)
+    )
+    WHERE st.id > ?
+"""
+
+
+def _import_record(rec: Any) -> Tuple[str, Dict[str, Any]]:
+    """Validate one bulk record: ("movie" | "showtime", normalized fields); raises ValueError."""
+    if not isinstance(rec, dict):
+        raise ValueError("record must be an object")
+    kind = str(rec.get("type") or ("showtime" if rec.get("start_time") else "movie")).strip().lower()
+    if kind == "movie":
+        title = str(rec.get("title") or "").strip()
+        if not title:
+            raise ValueError("title required")
+        duration = rec.get("duration_min")
+        return kind, {
+            "title": title,
+            "description": str(rec.get("description") or "").strip(),
+            "duration_min": int(duration) if duration not in (None, "") else 0,
+        }
+    if kind == "showtime":
+        start_time = str(rec.get("start_time") or "").strip()
+        hall = str(rec.get("hall") or "").strip()
+        price = int(rec.get("price") or 0)
+        if not start_time or not hall or price <= 0:
+            raise ValueError("start_time, hall, price required")
+        dt.datetime.fromisoformat(start_time)
+        movie_id = rec.get("movie_id")
+        movie_title = str(rec.get("movie_title") or "").strip()
+        if movie_id in (None, "") and not movie_title:
+            raise ValueError("movie_id or movie_title required")
+        return kind, {
+            "movie_id": int(movie_id) if movie_id not in (None, "") else None,
+            "movie_title": movie_title,
+            "start_time": start_time,
+            "hall": hall,
+            "price": price,
+        }
+    raise ValueError(f"Unknown record type: {kind}")
+
+
+def _movie_ids(cur: sqlite3.Cursor, titles: List[str], ids: List[int]) -> Tuple[Dict[str, int], set]:
+    """Latest movie id per title and the subset of `ids` that exist."""
+    by_title: Dict[str, int] = {}
+    for i in range(0, len(titles), 500):
+        part = titles[i:i + 500]
+        marks = ",".join("?" * len(part))
+        by_title.update(cur.execute(
+            f"SELECT title, MAX(id) FROM movies WHERE title IN ({marks}) GROUP BY title", part
+        ).fetchall())
+    found = set()
+    for i in range(0, len(ids), 500):
+        part = ids[i:i + 500]
+        marks = ",".join("?" * len(part))
+        found.update(r[0] for r in cur.execute(f"SELECT id FROM movies WHERE id IN ({marks})", part))
+    return by_title, found
+
+
+def bulk_import(conn: sqlite3.Connection, records: List[Any], chunk_size: int = BULK_CHUNK) -> Dict[str, Any]:
+    """
+    Insert movie and showtime records (see `_import_record`) in transactions
+    of `chunk_size` records: movies of a chunk first (so its showtimes can
+    name them by `movie_title`), then its showtimes with executemany, then
+    every seat of those showtimes in one INSERT ... SELECT. Invalid records
+    are skipped and reported as {"row": index into records, "error": ...};
+    a chunk the database rejects is rolled back and reported row by row.
+    `movie_ids` lists the ids of the movies inserted, in record order.
+    """
+    counts = {"movies": 0, "showtimes": 0, "seats": 0}
+    errors: List[Dict[str, Any]] = []
+    movie_ids: List[int] = []
+    for start in range(0, len(records), chunk_size):
+        movies: List[Tuple[int, Dict[str, Any]]] = []
+        showtimes: List[Tuple[int, Dict[str, Any]]] = []
+        for row in range(start, min(start + chunk_size, len(records))):
+            try:
+                kind, fields = _import_record(records[row])
+            except (TypeError, ValueError) as e:
+                errors.append({"row": row, "error": str(e)})
+                continue
+            (movies if kind == "movie" else showtimes).append((row, fields))
+        if not movies and not showtimes:
+            continue
+        cur = conn.cursor()
+        begin_immediate(cur)
+        try:
+            # Ids only grow (AUTOINCREMENT) and we hold the write lock: new rows are id > last.
+            last = cur.execute("SELECT COALESCE(MAX(id), 0) FROM movies").fetchone()[0]
+            cur.executemany(
+                "INSERT INTO movies(title, description, duration_min) VALUES(:title, :description, :duration_min)",
+                [fields for _, fields in movies],
+            )
+            new_movies = [r[0] for r in cur.execute("SELECT id FROM movies WHERE id > ? ORDER BY id", (last,))]
+            by_title, found = _movie_ids(
+                cur,
+                sorted({f["movie_title"] for _, f in showtimes if f["movie_id"] is None}),
+                sorted({f["movie_id"] for _, f in showtimes if f["movie_id"] is not None}),
+            )
+            rows = []
+            for row, f in showtimes:
+                movie_id = f["movie_id"] if f["movie_id"] is not None else by_title.get(f["movie_title"])
+                if movie_id is None or (f["movie_id"] is not None and movie_id not in found):
+                    errors.append({"row": row, "error": "Movie not found"})
+                    continue
+                rows.append((movie_id, f["start_time"], f["hall"], f["price"]))
+            last = cur.execute("SELECT COALESCE(MAX(id), 0) FROM showtimes").fetchone()[0]
+            cur.executemany("INSERT INTO showtimes(movie_id, start_time, hall, price) VALUES(?,?,?,?)", rows)
+            seats = cur.execute(_BULK_SEATS_SQL, (DEFAULT_HALL, last)).rowcount if rows else 0
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            errors.extend({"row": row, "error": f"Rolled back: {e}"} for row, _ in movies + showtimes)
+            continue
+        counts["movies"] += len(movies)
+        counts["showtimes"] += len(rows)
+        counts["seats"] += seats
+        movie_ids.extend(new_movies)
+    errors.sort(key=lambda e: e["row"])
+    return dict(counts, errors=errors, movie_ids=movie_ids)
+
+
+def list_halls(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
     rows = conn.execute(
         """
-        SELECT s.*, m.title AS movie_title
+        SELECT h.id, h.name, h.rows, h.cols, h.layout, COUNT(hs.seat_code) AS seats
+        FROM halls h LEFT JOIN hall_seats hs ON hs.hall_id = h.id
+        GROUP BY h.id ORDER BY h.name
+        """
+    ).fetchall()
+    return [dict(r, layout=r["layout"].split("/")) for r in rows]
+
+
+def list_showtimes(conn: sqlite3.Connection, movie_id: int, limit: Optional[int] = None,
+                   after_start_time: Optional[str] = None, after_id: Optional[int] = None,
+                   fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """In start_time order (id breaks ties); keyset page: after (`after_start_time`, `after_id`)."""
+    after = ("", 0) if after_start_time is None else (after_start_time, AFTER_ID_MAX if after_id is None else after_id)
+    rows = conn.execute(
+        f"""
+        SELECT {_columns(SHOWTIME_FIELDS, fields, ('id', 'start_time'))}
         FROM showtimes s
         JOIN movies m ON m.id = s.movie_id
-        WHERE s.movie_id = ?
-        ORDER BY s.start_time ASC
+        WHERE s.movie_id = ? AND (s.start_time, s.id) > (?, ?)
+        ORDER BY s.start_time ASC, s.id ASC
+        LIMIT ?
         """,
-        (movie_id,),
+        (movie_id, after[0], after[1], _limit(limit)),
     ).fetchall()
     return [dict(r) for r in rows]
 
@@ -189,92 +883,328 @@ def get_showtime(conn: sqlite3.Connection, showtime_id: int) -> Optional[Dict[st
 
 
 def get_seats(conn: sqlite3.Connection, showtime_id: int) -> List[Dict[str, Any]]:
-    ensure_seats_for_showtime(conn, showtime_id)
+    """Seat statuses; an available seat under a live hold is reported as 'held'."""
     rows = conn.execute(
-        "SELECT seat_code, status FROM seats WHERE showtime_id=? ORDER BY seat_code",
-        (showtime_id,),
+        """
+        SELECT s.seat_code,
+               CASE WHEN s.status = 'available' AND h.hold_id IS NOT NULL THEN 'held' ELSE s.status END AS status
+        FROM seats s
+        LEFT JOIN seat_holds h
+          ON h.showtime_id = s.showtime_id AND h.seat_code = s.seat_code AND h.expires_at > ?
+        WHERE s.showtime_id=?
+        ORDER BY s.seat_code
+        """,
+        (time.time(), showtime_id),
     ).fetchall()
     return [dict(r) for r in rows]
 
 
+def get_seat_holds(conn: sqlite3.Connection, showtime_id: int) -> Dict[str, Tuple[str, int, float]]:
+    """Live holds of a showtime: seat_code -> (hold_id, user_id, expires_at)."""
+    rows = conn.execute(
+        "SELECT seat_code, hold_id, user_id, expires_at FROM seat_holds WHERE showtime_id=? AND expires_at > ?",
+        (showtime_id, time.time()),
+    ).fetchall()
+    return {r["seat_code"]: (r["hold_id"], int(r["user_id"]), float(r["expires_at"])) for r in rows}
+
+
+def utc_now_iso() -> str:
+    return dt.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def book_seat_in_tx(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    showtime_id: int,
+    seat_code: str,
+    now: str,
+    hold_id: Optional[str] = None,
+) -> Tuple[bool, str, Optional[int]]:
+    """
+    Booking step for a caller that already holds a write transaction
+    (no BEGIN/COMMIT here). On failure nothing has been written.
+    A seat under someone else's live hold is refused; `hold_id` is the
+    caller's own hold when confirming it.
+    """
+    row = cur.execute(
+        "SELECT status FROM seats WHERE showtime_id=? AND seat_code=?",
+        (showtime_id, seat_code),
+    ).fetchone()
+    if not row:
+        return False, "Seat not found", None
+    if row["status"] != "available":
+        return False, "Seat already booked", None
+    held = cur.execute(
+        "SELECT hold_id FROM seat_holds WHERE showtime_id=? AND seat_code=? AND expires_at > ?",
+        (showtime_id, seat_code, time.time()),
+    ).fetchone()
+    if held and held["hold_id"] != hold_id:
+        return False, "Seat is held", None
+
+    cur.execute(
+        "UPDATE seats SET status='booked', booked_by=?, booked_at=? WHERE showtime_id=? AND seat_code=?",
+        (user_id, now, showtime_id, seat_code),
+    )
+    cur.execute(
+        "INSERT INTO tickets(user_id, showtime_id, seat_code, created_at, status) VALUES(?,?,?,?,?)",
+        (user_id, showtime_id, seat_code, now, "active"),
+    )
+    return True, "Booked", int(cur.lastrowid)
+
+
 def book_seat(conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_code: str) -> Tuple[bool, str, Optional[int]]:
     """
     Transactional seat booking.
     """
-    ensure_seats_for_showtime(conn, showtime_id)
     cur = conn.cursor()
     try:
-        cur.execute("BEGIN IMMEDIATE;")
+        begin_immediate(cur)
+        ok, m, ticket_id = book_seat_in_tx(cur, user_id, showtime_id, seat_code, utc_now_iso())
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
+        return ok, m, ticket_id
+    except Exception as e:
+        try:
+            cur.execute("ROLLBACK;")
+        except Exception:
+            pass
+        return False, f"Booking failed: {e}", None
+
+
+def book_seats_in_tx(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    showtime_id: int,
+    seat_codes: List[str],
+    now: str,
+    hold_id: Optional[str] = None,
+) -> Tuple[bool, str, List[int]]:
+    """
+    Multi-seat variant of `book_seat_in_tx`. Stops at the first unavailable
+    seat; the caller must roll back in that case (all or nothing).
+    """
+    ticket_ids: List[int] = []
+    for code in seat_codes:
+        ok, m, ticket_id = book_seat_in_tx(cur, user_id, showtime_id, code, now, hold_id)
+        if not ok:
+            return False, f"{m}: {code}", []
+        ticket_ids.append(int(ticket_id))
+    return True, "Booked", ticket_ids
+
+
+def book_seats(conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_codes: List[str]) -> Tuple[bool, str, List[int]]:
+    """
+    Book several seats of one showtime in a single transaction: either every
+    seat is booked (one ticket each) or none is.
+    """
+    cur = conn.cursor()
+    try:
+        begin_immediate(cur)
+        ok, m, ticket_ids = book_seats_in_tx(cur, user_id, showtime_id, seat_codes, utc_now_iso())
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
+        return ok, m, ticket_ids
+    except Exception as e:
+        try:
+            cur.execute("ROLLBACK;")
+        except Exception:
+            pass
+        return False, f"Booking failed: {e}", []
+
+
+def new_hold_id() -> str:
+    return uuid.uuid4().hex
+
+
+def hold_seats_in_tx(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    showtime_id: int,
+    seat_codes: List[str],
+    hold_id: str,
+    expires_at: float,
+) -> Tuple[bool, str]:
+    """Place one hold over all `seat_codes` (caller rolls back on failure)."""
+    now = time.time()
+    for code in seat_codes:
         row = cur.execute(
             "SELECT status FROM seats WHERE showtime_id=? AND seat_code=?",
-            (showtime_id, seat_code),
+            (showtime_id, code),
         ).fetchone()
         if not row:
-            cur.execute("ROLLBACK;")
-            return False, "Seat not found", None
+            return False, f"Seat not found: {code}"
         if row["status"] != "available":
-            cur.execute("ROLLBACK;")
-            return False, "Seat already booked", None
-
-        now = dt.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+            return False, f"Seat already booked: {code}"
+        # An expired hold no longer counts; clear it so the insert below fits.
         cur.execute(
-            "UPDATE seats SET status='booked', booked_by=?, booked_at=? WHERE showtime_id=? AND seat_code=?",
-            (user_id, now, showtime_id, seat_code),
+            "DELETE FROM seat_holds WHERE showtime_id=? AND seat_code=? AND expires_at <= ?",
+            (showtime_id, code, now),
         )
+        if cur.execute(
+            "SELECT 1 FROM seat_holds WHERE showtime_id=? AND seat_code=?", (showtime_id, code)
+        ).fetchone():
+            return False, f"Seat is held: {code}"
         cur.execute(
-            "INSERT INTO tickets(user_id, showtime_id, seat_code, created_at, status) VALUES(?,?,?,?,?)",
-            (user_id, showtime_id, seat_code, now, "active"),
+            "INSERT INTO seat_holds(showtime_id, seat_code, hold_id, user_id, expires_at) VALUES(?,?,?,?,?)",
+            (showtime_id, code, hold_id, user_id, expires_at),
         )
-        ticket_id = int(cur.lastrowid)
-        cur.execute("COMMIT;")
-        return True, "Booked", ticket_id
+    return True, "Held"
+
+
+def hold_seats(
+    conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_codes: List[str], ttl: float
+) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+    """
+    Hold seats for `ttl` seconds (all or nothing). Returns the hold as
+    {"hold_id", "showtime_id", "seat_codes", "expires_at"}.
+    """
+    hold_id, expires_at = new_hold_id(), time.time() + ttl
+    cur = conn.cursor()
+    try:
+        begin_immediate(cur)
+        ok, m = hold_seats_in_tx(cur, user_id, showtime_id, seat_codes, hold_id, expires_at)
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
     except Exception as e:
         try:
             cur.execute("ROLLBACK;")
         except Exception:
             pass
-        return False, f"Booking failed: {e}", None
+        return False, f"Hold failed: {e}", None
+    if not ok:
+        return False, m, None
+    return True, m, {"hold_id": hold_id, "showtime_id": showtime_id, "seat_codes": seat_codes, "expires_at": expires_at}
+
+
+def _hold_rows(cur: sqlite3.Cursor, user_id: int, hold_id: str) -> Tuple[bool, str, Optional[int], List[str]]:
+    rows = cur.execute(
+        "SELECT showtime_id, seat_code, expires_at FROM seat_holds WHERE hold_id=? AND user_id=?",
+        (hold_id, user_id),
+    ).fetchall()
+    if not rows:
+        return False, "Hold not found", None, []
+    if min(float(r["expires_at"]) for r in rows) <= time.time():
+        return False, "Hold expired", None, []
+    return True, "OK", int(rows[0]["showtime_id"]), [r["seat_code"] for r in rows]
+
+
+def confirm_hold_in_tx(
+    cur: sqlite3.Cursor, user_id: int, hold_id: str, now: str
+) -> Tuple[bool, str, List[int], Optional[int], List[str]]:
+    """Turn a live hold into tickets: (ok, msg, ticket_ids, showtime_id, seat_codes)."""
+    ok, m, showtime_id, codes = _hold_rows(cur, user_id, hold_id)
+    if not ok:
+        return False, m, [], None, []
+    ok, m, ticket_ids = book_seats_in_tx(cur, user_id, showtime_id, codes, now, hold_id)
+    if not ok:
+        return False, m, [], showtime_id, codes
+    cur.execute("DELETE FROM seat_holds WHERE hold_id=?", (hold_id,))
+    return True, "Booked", ticket_ids, showtime_id, codes
+
+
+def confirm_hold(conn: sqlite3.Connection, user_id: int, hold_id: str) -> Tuple[bool, str, List[int]]:
+    cur = conn.cursor()
+    try:
+        begin_immediate(cur)
+        ok, m, ticket_ids, _, _ = confirm_hold_in_tx(cur, user_id, hold_id, utc_now_iso())
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
+        return ok, m, ticket_ids
+    except Exception as e:
+        try:
+            cur.execute("ROLLBACK;")
+        except Exception:
+            pass
+        return False, f"Booking failed: {e}", []
+
+
+def release_hold_in_tx(
+    cur: sqlite3.Cursor, user_id: int, hold_id: str
+) -> Tuple[bool, str, Optional[int], List[str]]:
+    ok, m, showtime_id, codes = _hold_rows(cur, user_id, hold_id)
+    if not ok:
+        return False, m, None, []
+    cur.execute("DELETE FROM seat_holds WHERE hold_id=?", (hold_id,))
+    return True, "Released", showtime_id, codes
 
 
-def my_tickets(conn: sqlite3.Connection, user_id: int) -> List[Dict[str, Any]]:
+def release_hold(conn: sqlite3.Connection, user_id: int, hold_id: str) -> Tuple[bool, str]:
+    cur = conn.cursor()
+    try:
+        begin_immediate(cur)
+        ok, m, _, _ = release_hold_in_tx(cur, user_id, hold_id)
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
+        return ok, m
+    except Exception as e:
+        try:
+            cur.execute("ROLLBACK;")
+        except Exception:
+            pass
+        return False, f"Release failed: {e}"
+
+
+def expire_hold(conn: sqlite3.Connection, hold_id: str) -> int:
+    """Delete a hold whose TTL has passed; returns the number of seats freed."""
+    with conn:
+        cur = conn.execute(
+            "DELETE FROM seat_holds WHERE hold_id=? AND expires_at <= ?", (hold_id, time.time())
+        )
+    return cur.rowcount
+
+
+def list_holds(conn: sqlite3.Connection) -> List[Tuple[str, float]]:
+    """(hold_id, expires_at) of every hold, expired or not, for the expiry scheduler."""
     rows = conn.execute(
-        """
-        SELECT t.id, t.seat_code, t.created_at, t.status,
-               s.start_time, s.hall, s.price,
-               m.title AS movie_title
+        "SELECT hold_id, MIN(expires_at) AS expires_at FROM seat_holds GROUP BY hold_id"
+    ).fetchall()
+    return [(r["hold_id"], float(r["expires_at"])) for r in rows]
+
+
+def my_tickets(conn: sqlite3.Connection, user_id: int, limit: Optional[int] = None,
+               after_id: Optional[int] = None, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Newest first; keyset page: ticket ids below `after_id`."""
+    rows = conn.execute(
+        f"""
+        SELECT {_columns(TICKET_FIELDS, fields, ('id',))}
         FROM tickets t
         JOIN showtimes s ON s.id = t.showtime_id
         JOIN movies m ON m.id = s.movie_id
-        WHERE t.user_id = ?
+        WHERE t.user_id = ? AND t.id < ?
         ORDER BY t.id DESC
+        LIMIT ?
         """,
-        (user_id,),
+        (user_id, AFTER_ID_MAX if after_id is None else after_id, _limit(limit)),
     ).fetchall()
     return [dict(r) for r in rows]
 
 
+def cancel_ticket_in_tx(
+    cur: sqlite3.Cursor, user_id: int, ticket_id: int
+) -> Tuple[bool, str, Optional[sqlite3.Row]]:
+    """
+    Cancel step for a caller that already holds a write transaction.
+    Returns the ticket row (showtime_id, seat_code) on success.
+    """
+    row = cur.execute(
+        "SELECT showtime_id, seat_code, status FROM tickets WHERE id=? AND user_id=?",
+        (ticket_id, user_id),
+    ).fetchone()
+    if not row:
+        return False, "Ticket not found", None
+    if row["status"] != "active":
+        return False, "Ticket already cancelled", None
+
+    cur.execute("UPDATE tickets SET status='cancelled' WHERE id=?", (ticket_id,))
+    cur.execute(
+        "UPDATE seats SET status='available', booked_by=NULL, booked_at=NULL WHERE showtime_id=? AND seat_code=?",
+        (row["showtime_id"], row["seat_code"]),
+    )
+    return True, "Cancelled", row
+
+
 def cancel_ticket(conn: sqlite3.Connection, user_id: int, ticket_id: int) -> Tuple[bool, str]:
     cur = conn.cursor()
     try:
-        cur.execute("BEGIN IMMEDIATE;")
-        row = cur.execute(
-            "SELECT showtime_id, seat_code, status FROM tickets WHERE id=? AND user_id=?",
-            (ticket_id, user_id),
-        ).fetchone()
-        if not row:
-            cur.execute("ROLLBACK;")
-            return False, "Ticket not found"
-        if row["status"] != "active":
-            cur.execute("ROLLBACK;")
-            return False, "Ticket already cancelled"
-
-        cur.execute("UPDATE tickets SET status='cancelled' WHERE id=?", (ticket_id,))
-        cur.execute(
-            "UPDATE seats SET status='available', booked_by=NULL, booked_at=NULL WHERE showtime_id=? AND seat_code=?",
-            (row["showtime_id"], row["seat_code"]),
-        )
-        cur.execute("COMMIT;")
-        return True, "Cancelled"
+        begin_immediate(cur)
+        ok, m, _ = cancel_ticket_in_tx(cur, user_id, ticket_id)
+        cur.execute("COMMIT;" if ok else "ROLLBACK;")
+        return ok, m
     except Exception as e:
         try:
             cur.execute("ROLLBACK;")
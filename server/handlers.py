@@ -1,26 +1,55 @@
 from __future__ import annotations
 
-import uuid
-from typing import Any, Dict, Optional, Tuple
+import datetime as dt
+import os
+import threading
+from dataclasses import dataclass, field
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
 from common.protocol import response_ok, response_error
+from common.seats import FORMAT_COMPACT, encode_compact
 from . import db
+from .admission import SERVER_BUSY, Admission
+from .cache import CatalogueCache
+from .holds import HOLD_TTL_DEFAULT, HOLD_TTL_MAX, HoldExpiry
+from .metrics import Metrics
+from .passwords import INLINE, HasherBusy, PasswordHasher
+from .pubsub import SeatEvents, Subscriber
+from .seatmap import SeatMap
+from .sessions import SessionStore
 
 
-class SessionStore:
-    def __init__(self) -> None:
-        self._token_to_user: Dict[str, Dict[str, Any]] = {}
+MAX_SEATS_PER_BOOKING = 10
+PAGE_LIMIT_MAX = 200
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 50
+BULK_RECORDS_MAX = 10_000
 
-    def create(self, user: Dict[str, Any]) -> str:
-        token = uuid.uuid4().hex
-        self._token_to_user[token] = user
-        return token
+_OK_PREFIX = '{"ok":true'
 
-    def get(self, token: str) -> Optional[Dict[str, Any]]:
-        return self._token_to_user.get(token)
 
-    def delete(self, token: str) -> None:
-        self._token_to_user.pop(token, None)
+@dataclass(slots=True)
+class ServerContext:
+    """
+    In-process engines shared by every connection of one server.
+    Each field is optional; `handle` falls back to plain SQLite when unset.
+    """
+    seatmap: Optional[SeatMap] = None
+    cache: Optional[CatalogueCache] = None
+    events: Optional[SeatEvents] = None
+    holds: Optional[HoldExpiry] = None
+    metrics: Optional[Metrics] = None
+    hasher: Optional[PasswordHasher] = None
+    admission: Optional[Admission] = None
+    hold_ttl: int = HOLD_TTL_DEFAULT
+
+
+@dataclass(slots=True)
+class Peer:
+    """Per-connection state the transport hands to `handle`."""
+    addr: Any = None
+    subscriber: Optional[Subscriber] = None
 
 
 def require_auth(sessions: SessionStore, token: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
@@ -32,99 +61,630 @@ def require_auth(sessions: SessionStore, token: str) -> Tuple[Optional[Dict[str,
     return user, None
 
 
-def handle(conn, sessions: SessionStore, msg: Dict[str, Any]) -> str:
+def _seat_codes(data: Dict[str, Any]) -> Tuple[List[str], Optional[str]]:
+    """Normalized, de-duplicated `seat_codes` list of a request, or an error response."""
+    raw_codes = data.get("seat_codes") or []
+    if not isinstance(raw_codes, list):
+        return [], response_error("seat_codes must be a list")
+    seat_codes = list(dict.fromkeys(str(c).strip().upper() for c in raw_codes if str(c).strip()))
+    if not seat_codes:
+        return [], response_error("seat_codes required")
+    if len(seat_codes) > MAX_SEATS_PER_BOOKING:
+        return [], response_error(f"At most {MAX_SEATS_PER_BOOKING} seats per booking")
+    return seat_codes, None
+
+
+def _page_args(data: Dict[str, Any], columns: Mapping[str, str],
+               cursor: Mapping[str, type]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """`limit`, keyset cursor arguments and `fields` of a list request, or an error response."""
+    page: Dict[str, Any] = {}
+    for key, typ in (("limit", int), *cursor.items()):
+        if data.get(key) is None:
+            continue
+        try:
+            page[key] = typ(data[key])
+        except (TypeError, ValueError):
+            return {}, response_error(f"{key} must be {typ.__name__}")
+    if "limit" in page and not 1 <= page["limit"] <= PAGE_LIMIT_MAX:
+        return {}, response_error(f"limit must be 1..{PAGE_LIMIT_MAX}")
+    fields = data.get("fields")
+    if fields is not None:
+        if not isinstance(fields, list):
+            return {}, response_error("fields must be a list")
+        for name in fields:
+            if name not in columns:
+                return {}, response_error(f"Unknown field: {name}")
+        page["fields"] = tuple(fields)
+    return page, None
+
+
+def _paged(fetch: Callable[..., List[Dict[str, Any]]], page: Dict[str, Any],
+           keys: Tuple[str, ...]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
-    Return a JSON line response string.
+    Run `fetch` for one page (one extra row tells whether more follow) and
+    build `next_cursor`: the arguments that request the following page.
     """
-    if not msg:
-        return response_error("Invalid message")
+    limit = page.get("limit")
+    if limit is None:
+        return fetch(**page), None
+    rows = fetch(**dict(page, limit=limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, {f"after_{k}": rows[-1][k] for k in keys}
 
-    action = msg.get("action")
-    data: Dict[str, Any] = msg.get("data") or {}
-    
+
+def _if_version(data: Dict[str, Any], key: str = "if_version") -> Tuple[Optional[int], Optional[str]]:
+    """
+    A version argument of a read request, or an error response: `if_version`
+    (the version of the caller's copy) or `since_version` (get_seats deltas).
+    """
+    value = data.get(key)
+    if value is None:
+        return None, None
+    try:
+        return int(value), None
+    except (TypeError, ValueError):
+        return None, response_error(f"{key} must be int")
+
+
+def _not_modified(req: "Request", version: int) -> str:
+    """Reply to a read whose `if_version` is current: the caller's copy is still valid."""
+    metrics = req.ctx.metrics if req.ctx is not None else None
+    if metrics is not None:
+        metrics.incr("not_modified")
+    return req.ok({"not_modified": True, "version": version})
+
+
+def _catalogue_read(req: "Request", build: Callable[[int], str], if_version: Optional[int],
+                    lookup: Optional[Callable[..., Tuple[int, Optional[str]]]]) -> str:
+    """
+    Response of a catalogue list: from the cache `lookup` when there is one,
+    else built under the database's catalogue version.
+    """
+    if lookup is not None:
+        version, line = lookup(build, if_version)
+    else:
+        version = req.db(db.catalogue_version, req.conn)
+        line = None if version == if_version else build(version)
+    return _not_modified(req, version) if line is None else line
+
+
+def _refused(req: "Request", m: str) -> str:
+    """Error response for a failed seat operation; lost races are counted as conflicts."""
+    metrics = req.ctx.metrics if req.ctx is not None else None
+    if metrics is not None:
+        if m.startswith("Seat already booked"):
+            metrics.incr("booking_conflicts")
+        elif m.startswith("Seat is held"):
+            metrics.incr("hold_conflicts")
+    return response_error(m)
+
+
+class Request:
+    """
+    One request as seen by an action handler: the validated arguments in
+    `args`, the raw `data`, and the caller (`user`/`token`) for auth actions.
+    Storage calls go through `db` and responses through `ok`, which time
+    the DB and serialize phases when metrics are on.
+    """
+
+    __slots__ = ("conn", "sessions", "ctx", "peer", "data", "args", "user", "token", "timed", "db_ns", "serialize_ns")
+
+    def __init__(self, conn, sessions: SessionStore, ctx: Optional[ServerContext], peer: Optional[Peer],
+                 data: Dict[str, Any], timed: bool = False) -> None:
+        self.conn = conn
+        self.sessions = sessions
+        self.ctx = ctx
+        self.peer = peer
+        self.data = data
+        self.args: Dict[str, Any] = {}
+        self.user: Dict[str, Any] = {}
+        self.token = ""
+        self.timed = timed
+        self.db_ns = 0
+        self.serialize_ns = 0
+
+    @property
+    def seatmap(self) -> Optional[SeatMap]:
+        return self.ctx.seatmap if self.ctx is not None else None
+
+    @property
+    def cache(self) -> Optional[CatalogueCache]:
+        return self.ctx.cache if self.ctx is not None else None
+
+    @property
+    def hasher(self) -> PasswordHasher:
+        if self.ctx is not None and self.ctx.hasher is not None:
+            return self.ctx.hasher
+        return INLINE
+
+    @property
+    def user_id(self) -> int:
+        return int(self.user["id"])
+
+    def db(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if not self.timed:
+            return fn(*args, **kwargs)
+        t0 = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.db_ns += perf_counter_ns() - t0
+
+    def ok(self, payload: Optional[Dict[str, Any]] = None) -> str:
+        if not self.timed:
+            return response_ok(payload)
+        t0 = perf_counter_ns()
+        line = response_ok(payload)
+        self.serialize_ns += perf_counter_ns() - t0
+        return line
+
+
+@dataclass(frozen=True, slots=True)
+class Action:
+    """
+    Registry entry of one protocol action. `schema` maps required argument
+    names to the type they are converted to (into `Request.args`);
+    `read_only` actions may be pipelined.
+    """
+    name: str
+    func: Callable[[Request], str]
+    auth: bool = True
+    admin: bool = False
+    read_only: bool = False
+    schema: Mapping[str, type] = field(default_factory=dict)
+
+
+ACTIONS: Dict[str, Action] = {}
+
+
+def action(name: str, *, auth: bool = True, admin: bool = False, read_only: bool = False,
+           schema: Optional[Mapping[str, type]] = None):
+    def register(func: Callable[[Request], str]) -> Callable[[Request], str]:
+        ACTIONS[name] = Action(name, func, auth, admin, read_only, dict(schema or {}))
+        return func
+    return register
+
+
+@action("ping", auth=False, read_only=True)
+def _ping(req: Request) -> str:
+    return req.ok({"pong": True})
+
+
+@action("register", auth=False)
+def _register(req: Request) -> str:
+    username = str(req.data.get("username", "")).strip()
+    password = str(req.data.get("password", "")).strip()
+    if not username or not password:
+        return response_error("username/password required")
+    try:
+        password_hash = req.hasher.hash(password)
+    except HasherBusy:
+        return response_error(SERVER_BUSY)
+    ok, m = req.db(db.create_user, req.conn, username, password, password_hash)
+    return req.ok({"message": m}) if ok else response_error(m)
+
+
+@action("login", auth=False)
+def _login(req: Request) -> str:
+    username = str(req.data.get("username", "")).strip()
+    password = str(req.data.get("password", "")).strip()
+    user = req.db(db.get_login, req.conn, username)
+    hasher = req.hasher
+    try:
+        stored = user.pop("password_hash") if user else None
+        if not stored or not hasher.verify(password, stored):
+            return response_error("Invalid credentials")
+        if hasher.needs_rehash(stored):
+            req.db(db.update_password_hash, req.conn, user["id"], stored, hasher.hash(password))
+    except HasherBusy:
+        return response_error(SERVER_BUSY)
+    token = req.sessions.create(user)
+    return req.ok({"token": token, "user": user})
+
+
+@action("logout")
+def _logout(req: Request) -> str:
+    req.sessions.delete(req.token)
+    return req.ok({"message": "Logged out"})
+
+
+@action("list_movies", read_only=True)
+def _list_movies(req: Request) -> str:
+    page, err = _page_args(req.data, db.MOVIE_FIELDS, {"after_id": int})
+    if err:
+        return err
+    if_version, err = _if_version(req.data)
+    if err:
+        return err
+
+    def build(version: int) -> str:
+        movies, cursor = _paged(lambda **kw: req.db(db.list_movies, req.conn, **kw), page, ("id",))
+        return req.ok({"movies": movies, "next_cursor": cursor, "version": version})
+
+    cache = req.cache
+    key = tuple(sorted(page.items()))
+    lookup = (lambda b, v: cache.movies(b, key, v)) if cache is not None else None
+    return _catalogue_read(req, build, if_version, lookup)
+
+
+@action("search_movies", read_only=True, schema={"q": str})
+def _search_movies(req: Request) -> str:
+    page, err = _page_args(req.data, db.MOVIE_FIELDS, {})
+    if err:
+        return err
+    if page.get("limit", 0) > SEARCH_LIMIT_MAX:
+        return response_error(f"limit must be 1..{SEARCH_LIMIT_MAX}")
+    showing_after = None
+    if req.data.get("upcoming"):
+        showing_after = dt.datetime.now().isoformat(timespec="seconds")
+    movies = req.db(
+        db.search_movies, req.conn, req.args["q"], page.get("limit", SEARCH_LIMIT_DEFAULT), showing_after,
+        page.get("fields"),
+    )
+    return req.ok({"movies": movies})
+
+
+@action("list_showtimes", read_only=True, schema={"movie_id": int})
+def _list_showtimes(req: Request) -> str:
+    movie_id = req.args["movie_id"]
+    page, err = _page_args(req.data, db.SHOWTIME_FIELDS, {"after_start_time": str, "after_id": int})
+    if err:
+        return err
+    if_version, err = _if_version(req.data)
+    if err:
+        return err
+
+    def build(version: int) -> str:
+        showtimes, cursor = _paged(
+            lambda **kw: req.db(db.list_showtimes, req.conn, movie_id, **kw), page, ("start_time", "id")
+        )
+        return req.ok({"showtimes": showtimes, "next_cursor": cursor, "version": version})
+
+    cache = req.cache
+    key = tuple(sorted(page.items()))
+    lookup = (lambda b, v: cache.showtimes(movie_id, b, key, v)) if cache is not None else None
+    return _catalogue_read(req, build, if_version, lookup)
+
+
+@action("get_seats", read_only=True, schema={"showtime_id": int})
+def _get_seats(req: Request) -> str:
+    showtime_id = req.args["showtime_id"]
+    compact = req.data.get("format") == FORMAT_COMPACT
+    if_version, err = _if_version(req.data)
+    if err:
+        return err
+    since_version, err = _if_version(req.data, "since_version")
+    if err:
+        return err
+    seatmap = req.seatmap
+    if seatmap is not None:
+        result = req.db(seatmap.get_seats, req.conn, showtime_id, compact, if_version, since_version)
+        if result is None:
+            return response_error("Showtime not found")
+        if result.get("not_modified"):
+            return _not_modified(req, result["version"])
+        return req.ok(result)
+    # Version first: a write landing between the two reads makes the reply
+    # look older than it is (one extra full read later), never newer.
+    found = req.db(db.showtime_version, req.conn, showtime_id)
+    if found is None:
+        return response_error("Showtime not found")
+    version, settled = found
+    if settled and version == if_version:
+        return _not_modified(req, version)
+    if settled and since_version is not None:
+        delta = (version, []) if since_version == version else req.db(
+            db.seat_changes, req.conn, showtime_id, since_version
+        )
+        if delta is not None:
+            return req.ok({"changes": delta[1], "since_version": since_version, "version": delta[0]})
+    seats = req.db(db.get_seats, req.conn, showtime_id)
+    result = (encode_compact(seats) if compact else None) or {"seats": seats}
+    result["version"] = version
+    return req.ok(result)
+
+
+@action("book", schema={"showtime_id": int})
+def _book(req: Request) -> str:
+    showtime_id = req.args["showtime_id"]
+    seat_code = str(req.data.get("seat_code", "")).strip().upper()
+    if not seat_code:
+        return response_error("seat_code required")
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m, ticket_id = req.db(seatmap.book, req.conn, req.user_id, showtime_id, seat_code)
+    else:
+        ok, m, ticket_id = req.db(db.book_seat, req.conn, req.user_id, showtime_id, seat_code)
+    return req.ok({"message": m, "ticket_id": ticket_id}) if ok else _refused(req, m)
+
+
+@action("book_many", schema={"showtime_id": int})
+def _book_many(req: Request) -> str:
+    showtime_id = req.args["showtime_id"]
+    seat_codes, err = _seat_codes(req.data)
+    if err:
+        return err
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m, ticket_ids = req.db(seatmap.book_many, req.conn, req.user_id, showtime_id, seat_codes)
+    else:
+        ok, m, ticket_ids = req.db(db.book_seats, req.conn, req.user_id, showtime_id, seat_codes)
+    return req.ok({"message": m, "ticket_ids": ticket_ids}) if ok else _refused(req, m)
+
+
+@action("hold_seats", schema={"showtime_id": int})
+def _hold_seats(req: Request) -> str:
+    showtime_id = req.args["showtime_id"]
+    seat_codes, err = _seat_codes(req.data)
+    if err:
+        return err
+    ctx = req.ctx
+    default_ttl = ctx.hold_ttl if ctx is not None else HOLD_TTL_DEFAULT
     try:
-        if action == "ping":
-            return response_ok({"pong": True})
-
-        if action == "register":
-            username = str(data.get("username", "")).strip()
-            password = str(data.get("password", "")).strip()
-            if not username or not password:
-                return response_error("username/password required")
-            ok, m = db.create_user(conn, username, password)
-            return response_ok({"message": m}) if ok else response_error(m)
-
-        if action == "login":
-            username = str(data.get("username", "")).strip()
-            password = str(data.get("password", "")).strip()
-            user = db.authenticate(conn, username, password)
-            if not user:
-                return response_error("Invalid credentials")
-            token = sessions.create(user)
-            return response_ok({"token": token, "user": user})
-
-        # Auth-required actions
+        ttl = int(req.data.get("ttl") or default_ttl)
+    except (TypeError, ValueError):
+        return response_error("ttl must be int")
+    ttl = min(max(ttl, 1), HOLD_TTL_MAX)
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m, hold = req.db(seatmap.hold, req.conn, req.user_id, showtime_id, seat_codes, ttl)
+    else:
+        ok, m, hold = req.db(db.hold_seats, req.conn, req.user_id, showtime_id, seat_codes, ttl)
+    if not ok:
+        return _refused(req, m)
+    if ctx is not None and ctx.holds is not None:
+        ctx.holds.schedule(hold["hold_id"], hold["expires_at"])
+    return req.ok(dict(hold, ttl=ttl))
+
+
+@action("confirm_hold", schema={"hold_id": str})
+def _confirm_hold(req: Request) -> str:
+    hold_id = req.args["hold_id"].strip()
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m, ticket_ids = req.db(seatmap.confirm_hold, req.user_id, hold_id)
+    else:
+        ok, m, ticket_ids = req.db(db.confirm_hold, req.conn, req.user_id, hold_id)
+    return req.ok({"message": m, "ticket_ids": ticket_ids}) if ok else _refused(req, m)
+
+
+@action("release_hold", schema={"hold_id": str})
+def _release_hold(req: Request) -> str:
+    hold_id = req.args["hold_id"].strip()
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m = req.db(seatmap.release_hold, req.user_id, hold_id)
+    else:
+        ok, m = req.db(db.release_hold, req.conn, req.user_id, hold_id)
+    return req.ok({"message": m}) if ok else response_error(m)
+
+
+def _subscriptions(req: Request) -> Optional[SeatEvents]:
+    events = req.ctx.events if req.ctx is not None else None
+    if events is None or req.seatmap is None or req.peer is None or req.peer.subscriber is None:
+        return None
+    return events
+
+
+@action("subscribe_seats", schema={"showtime_id": int})
+def _subscribe_seats(req: Request) -> str:
+    events = _subscriptions(req)
+    if events is None:
+        return response_error("Subscriptions not available")
+    showtime_id = req.args["showtime_id"]
+    st = req.db(req.seatmap.showtime, req.conn, showtime_id)
+    if st is None:
+        return response_error("Showtime not found")
+    if not events.subscribe(req.peer.subscriber, showtime_id):
+        return response_error("Too many subscriptions")
+    return req.ok({"showtime_id": showtime_id, "version": st.version})
+
+
+@action("unsubscribe_seats", schema={"showtime_id": int})
+def _unsubscribe_seats(req: Request) -> str:
+    events = _subscriptions(req)
+    if events is None:
+        return response_error("Subscriptions not available")
+    showtime_id = req.args["showtime_id"]
+    events.unsubscribe(req.peer.subscriber, showtime_id)
+    return req.ok({"showtime_id": showtime_id})
+
+
+@action("my_tickets", read_only=True)
+def _my_tickets(req: Request) -> str:
+    page, err = _page_args(req.data, db.TICKET_FIELDS, {"after_id": int})
+    if err:
+        return err
+    tickets, cursor = _paged(lambda **kw: req.db(db.my_tickets, req.conn, req.user_id, **kw), page, ("id",))
+    return req.ok({"tickets": tickets, "next_cursor": cursor})
+
+
+@action("cancel", schema={"ticket_id": int})
+def _cancel(req: Request) -> str:
+    ticket_id = req.args["ticket_id"]
+    seatmap = req.seatmap
+    if seatmap is not None:
+        ok, m = req.db(seatmap.cancel, req.user_id, ticket_id)
+    else:
+        ok, m = req.db(db.cancel_ticket, req.conn, req.user_id, ticket_id)
+    return req.ok({"message": m}) if ok else response_error(m)
+
+
+@action("admin_add_movie", admin=True)
+def _admin_add_movie(req: Request) -> str:
+    title = str(req.data.get("title", "")).strip()
+    description = str(req.data.get("description", "")).strip()
+    duration_min = int(req.data.get("duration_min", 0))
+    if not title:
+        return response_error("title required")
+    movie_id = req.db(db.add_movie, req.conn, title, description, duration_min)
+    if req.cache is not None:
+        req.cache.invalidate()
+    return req.ok({"movie_id": movie_id})
+
+
+@action("admin_add_showtime", admin=True, schema={"movie_id": int})
+def _admin_add_showtime(req: Request) -> str:
+    movie_id = req.args["movie_id"]
+    start_time = str(req.data.get("start_time", "")).strip()  # ISO string
+    hall = str(req.data.get("hall", "")).strip()
+    price = int(req.data.get("price", 0))
+    if not start_time or not hall or price <= 0:
+        return response_error("start_time, hall, price required")
+    showtime_id = req.db(db.add_showtime, req.conn, movie_id, start_time, hall, price)
+    if req.cache is not None:
+        req.cache.invalidate()
+    return req.ok({"showtime_id": showtime_id})
+
+
+@action("admin_bulk_import", admin=True)
+def _admin_bulk_import(req: Request) -> str:
+    records = req.data.get("records")
+    if not isinstance(records, list) or not records:
+        return response_error("records must be a non-empty list")
+    if len(records) > BULK_RECORDS_MAX:
+        return response_error(f"At most {BULK_RECORDS_MAX} records per request")
+    result = req.db(db.bulk_import, req.conn, records)
+    if req.cache is not None and (result["movies"] or result["showtimes"]):
+        req.cache.invalidate()
+    return req.ok(result)
+
+
+@action("list_halls", read_only=True)
+def _list_halls(req: Request) -> str:
+    return req.ok({"halls": req.db(db.list_halls, req.conn)})
+
+
+@action("admin_add_hall", admin=True, schema={"name": str})
+def _admin_add_hall(req: Request) -> str:
+    name = req.args["name"].strip()
+    if not name:
+        return response_error("name required")
+    ok, m, hall_id = req.db(db.add_hall, req.conn, name, req.data.get("layout"))
+    return req.ok({"hall_id": hall_id}) if ok else response_error(m)
+
+
+def collect_stats(ctx: ServerContext, sessions: SessionStore) -> Dict[str, Any]:
+    """Server-wide numbers for `server_stats` and the `--metrics-port` endpoint."""
+    stats: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "threads": threading.active_count(),
+        "sessions": len(sessions),
+        "sessions_expired_total": sessions.counters.value("expired"),
+        "sessions_evicted_total": sessions.counters.value("evicted"),
+    }
+    metrics = ctx.metrics
+    if metrics is not None:
+        c = metrics.counters.values()
+        stats.update({
+            "uptime_s": round(metrics.uptime(), 1),
+            "connections": c.get("connections_opened", 0) - c.get("connections_closed", 0),
+            "connections_total": c.get("connections_opened", 0),
+            "client_errors_total": c.get("client_errors", 0),
+            "bytes_in_total": c.get("bytes_in", 0),
+            "bytes_out_total": c.get("bytes_out", 0),
+            "booking_conflicts_total": c.get("booking_conflicts", 0),
+            "hold_conflicts_total": c.get("hold_conflicts", 0),
+            "not_modified_total": c.get("not_modified", 0),
+        })
+    lock = db.lock_stats.values()
+    stats.update({
+        "sqlite_lock_waits_total": lock.get("lock_waits", 0),
+        "sqlite_lock_wait_ms_total": lock.get("lock_wait_us", 0) // 1000,
+        "sqlite_busy_errors_total": lock.get("busy_errors", 0),
+    })
+    if ctx.cache is not None:
+        stats["cache_hits_total"], stats["cache_misses_total"] = ctx.cache.hits, ctx.cache.misses
+    if ctx.events is not None:
+        stats["subscribers"] = ctx.events.subscriber_count()
+    if ctx.holds is not None:
+        stats["holds_pending"] = ctx.holds.pending()
+    if ctx.hasher is not None:
+        stats["password_hash_rejected_total"] = ctx.hasher.rejected
+    if ctx.admission is not None:
+        stats.update(ctx.admission.stats())
+    if metrics is not None:
+        stats["actions"] = metrics.snapshot()
+    return stats
+
+
+@action("server_stats", admin=True)
+def _server_stats(req: Request) -> str:
+    if req.ctx is None:
+        return response_error("Stats not available")
+    return req.ok(collect_stats(req.ctx, req.sessions))
+
+
+# Actions with no side effects: a connection may run several of them at once
+# when the client pipelines them with request ids.
+READ_ONLY_ACTIONS = frozenset(name for name, spec in ACTIONS.items() if spec.read_only)
+
+
+def can_pipeline(msg: Any) -> bool:
+    """True if `msg` is an id-tagged read-only request (may run concurrently)."""
+    return (
+        isinstance(msg, dict)
+        and msg.get("id") is not None
+        and msg.get("action") in READ_ONLY_ACTIONS
+    )
+
+
+def _dispatch(spec: Action, req: Request) -> str:
+    data = req.data
+    if spec.auth:
         token = str(data.get("token", "")).strip()
-        user, err = require_auth(sessions, token)
+        user, err = require_auth(req.sessions, token)
         if err:
             return err
+        if spec.admin and user.get("role") != "admin":
+            return response_error("Admin only")
+        req.user, req.token = user, token
+    for key, typ in spec.schema.items():
+        value = data.get(key)
+        if value is None or value == "":
+            return response_error(f"{key} required")
+        try:
+            req.args[key] = typ(value)
+        except (TypeError, ValueError):
+            return response_error(f"{key} must be {typ.__name__}")
+    return spec.func(req)
+
+
+def handle(
+    conn,
+    sessions: SessionStore,
+    msg: Dict[str, Any],
+    ctx: Optional[ServerContext] = None,
+    peer: Optional[Peer] = None,
+    parse_ns: int = 0,
+) -> str:
+    """
+    Return a JSON line response string.
 
-        if action == "logout":
-            sessions.delete(token)
-            return response_ok({"message": "Logged out"})
-
-        if action == "list_movies":
-            return response_ok({"movies": db.list_movies(conn)})
-
-        if action == "list_showtimes":
-            movie_id = int(data.get("movie_id"))
-            return response_ok({"showtimes": db.list_showtimes(conn, movie_id)})
-
-        if action == "get_seats":
-            showtime_id = int(data.get("showtime_id"))
-            return response_ok({"seats": db.get_seats(conn, showtime_id)})
-
-        if action == "book":
-            showtime_id = int(data.get("showtime_id"))
-            seat_code = str(data.get("seat_code", "")).strip().upper()
-            if not seat_code:
-                return response_error("seat_code required")
-            ok, m, ticket_id = db.book_seat(conn, int(user["id"]), showtime_id, seat_code)
-            return response_ok({"message": m, "ticket_id": ticket_id}) if ok else response_error(m)
-
-        if action == "my_tickets":
-            return response_ok({"tickets": db.my_tickets(conn, int(user["id"]))})
-
-        if action == "cancel":
-            ticket_id = int(data.get("ticket_id"))
-            ok, m = db.cancel_ticket(conn, int(user["id"]), ticket_id)
-            return response_ok({"message": m}) if ok else response_error(m)
-
-        # Admin actions
-        if action in ("admin_add_movie", "admin_add_showtime"):
-            if user.get("role") != "admin":
-                return response_error("Admin only")
-
-        if action == "admin_add_movie":
-            title = str(data.get("title", "")).strip()
-            description = str(data.get("description", "")).strip()
-            duration_min = int(data.get("duration_min", 0))
-            if not title:
-                return response_error("title required")
-            movie_id = db.add_movie(conn, title, description, duration_min)
-            return response_ok({"movie_id": movie_id})
-
-        if action == "admin_add_showtime":
-            movie_id = int(data.get("movie_id"))
-            start_time = str(data.get("start_time", "")).strip()  # ISO string
-            hall = str(data.get("hall", "")).strip()
-            price = int(data.get("price", 0))
-            if not start_time or not hall or price <= 0:
-                return response_error("start_time, hall, price required")
-            showtime_id = db.add_showtime(conn, movie_id, start_time, hall, price)
-            return response_ok({"showtime_id": showtime_id})
-
-        return response_error(f"Unknown action: {action}")
+    The action is looked up in `ACTIONS`; auth, admin role and the argument
+    schema are checked before its handler runs. `parse_ns` is the transport's
+    decode time of `msg`, recorded with the other phases.
+    """
+    if not msg:
+        return response_error("Invalid message")
 
+    name = msg.get("action")
+    data: Dict[str, Any] = msg.get("data") or {}
+    spec = ACTIONS.get(name)
+    if spec is None:
+        return response_error(f"Unknown action: {name}")
+
+    metrics = ctx.metrics if ctx is not None else None
+    req = Request(conn, sessions, ctx, peer, data, timed=metrics is not None)
+    t0 = perf_counter_ns() if metrics is not None else 0
+    try:
+        resp = _dispatch(spec, req)
     except Exception as e:
-        return response_error(f"Server error: {e}")
+        resp = response_error(f"Server error: {e}")
+    if metrics is not None:
+        metrics.record(
+            spec.name, resp.startswith(_OK_PREFIX), parse_ns, perf_counter_ns() - t0, req.db_ns, req.serialize_ns
+        )
+    return resp
@@ -0,0 +1,65 @@
+"""
+Expiry scheduler for temporary seat holds.
+
+Holds are kept in a min-heap ordered by expiry time and drained by one timer
+thread that sleeps until the earliest deadline, so reclaiming costs
+O(log n) per hold and never scans the seats table or blocks a request
+thread. Confirmed or released holds are not removed from the heap; their
+callback simply finds nothing left to free (lazy deletion).
+"""
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from typing import Callable, List, Tuple
+
+HOLD_TTL_DEFAULT = 300
+HOLD_TTL_MAX = 900
+
+
+class HoldExpiry:
+    def __init__(self, on_expire: Callable[[str], None]) -> None:
+        self.on_expire = on_expire
+        self._heap: List[Tuple[float, str]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, name="hold-expiry", daemon=True)
+        self._thread.start()
+
+    def schedule(self, hold_id: str, expires_at: float) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (expires_at, hold_id))
+            if self._heap[0][1] == hold_id:
+                self._cond.notify()  # new earliest deadline
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._closed:
+                    return
+                _, hold_id = heapq.heappop(self._heap)
+            try:
+                self.on_expire(hold_id)
+                self.expired += 1
+            except Exception:
+                pass
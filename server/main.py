@@ -1,66 +1,289 @@
 from __future__ import annotations
 
 import argparse
+import os
 import socket
 import threading
-from typing import Tuple
+from time import perf_counter_ns
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
-from common.protocol import loads_line, response_error
-from .db import connect, init_db
-from .handlers import SessionStore, handle
+from common.protocol import (
+    FRAME_HEADER,
+    MAX_FRAME,
+    Framing,
+    attach_id,
+    decode_frame,
+    is_hello,
+    loads_message,
+    negotiate,
+    response_error,
+)
+from .admission import Admission, Limits, busy_response
+from .db import ConnectionPool, init_db
+from .handlers import Peer, ServerContext, SessionStore, can_pipeline, collect_stats, handle
+from .pubsub import SeatEvents, ThreadedSubscriber
+from . import db
+from .cache import CatalogueCache
+from .holds import HOLD_TTL_DEFAULT, HoldExpiry
+from .metrics import Metrics, discard, serve_metrics
+from .passwords import DEFAULT_SCHEME, SCHEMES, PasswordHasher
+from .seatmap import SeatMap
+from .sessions import (
+    SESSION_TTL_DEFAULT,
+    SESSIONS_MAX_DEFAULT,
+    SnapshotSessions,
+    SqliteSessions,
+)
+
+# Max pipelined read-only requests one connection may have running at once.
+PIPELINE_MAX_INFLIGHT = 32
+PIPELINE_THREADS_DEFAULT = 16
+
+
+def _read_request(file_obj, framing: Framing) -> Optional[bytes]:
+    """Read one request body (a JSON line or a frame); None on EOF."""
+    if not framing.framed:
+        return file_obj.readline() or None
+    header = file_obj.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    length, flags = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError("Frame too large")
+    body = file_obj.read(length)
+    if len(body) < length:
+        return None
+    return decode_frame(flags, body)
+
+
+def _run_pipelined(
+    pool: ConnectionPool, sessions: SessionStore, ctx: ServerContext, msg, send, peer: Peer, parse_ns: int,
+    admission: Admission, entered: float
+) -> None:
+    try:
+        resp = admission.run(entered, handle, pool.get(), sessions, msg, ctx, peer, parse_ns)
+        send(attach_id(resp, msg.get("id")))
+    except Exception:
+        pass
 
 
 def client_thread(
     conn_sock: socket.socket,
     addr: Tuple[str, int],
-    db_conn,
-    sessions: SessionStore
+    pool: ConnectionPool,
+    sessions: SessionStore,
+    ctx: ServerContext,
+    pipeline: ThreadPoolExecutor,
 ) -> None:
     """
-    Mỗi client chạy trên một thread riêng.
+    Mỗi client chạy trên một thread riêng (với connection SQLite riêng lấy từ pool).
     Giao tiếp request/response theo từng dòng JSON.
+
+    Read-only requests tagged with an "id" are handed to the shared `pipeline`
+    pool and answered as soon as they finish (possibly out of order). Any other
+    request first waits for those in flight, so writes keep their order.
+    A "hello" request may switch the connection to length-prefixed frames.
+    Seat events for subscriptions are written by the peer's subscriber thread.
+    Every request passes `ctx.admission` first (see `admission`).
     """
+    admission = ctx.admission or Admission()
+    if not admission.connect():
+        with conn_sock:
+            try:
+                conn_sock.sendall(busy_response().encode("utf-8"))
+            except OSError:
+                pass
+        return
+    inflight: List[Future] = []
+    peer = Peer(addr=addr)
+    count = ctx.metrics.incr if ctx.metrics is not None else discard
+    count("connections_opened")
     try:
+        db_conn = pool.get()
         with conn_sock:
             file_obj = conn_sock.makefile("rwb")
+            write_lock = threading.Lock()
+            framing = Framing()
+
+            def send(resp: str, switch_to: Optional[Framing] = None) -> None:
+                with write_lock:
+                    out = framing.encode(resp)
+                    file_obj.write(out)
+                    file_obj.flush()
+                    count("bytes_out", len(out))
+                    if switch_to is not None:
+                        # Under the lock: no event may slip out in the old framing.
+                        framing.mode, framing.compress = switch_to.mode, switch_to.compress
+
+            peer.subscriber = ThreadedSubscriber(send)
 
             while True:
-                line = file_obj.readline()
-                if not line:
+                raw = _read_request(file_obj, framing)
+                if raw is None:
                     break
+                count("bytes_in", len(raw) + (FRAME_HEADER.size if framing.framed else 0))
 
+                t0 = perf_counter_ns()
                 try:
-                    msg = loads_line(line.decode("utf-8").strip())
-                    resp = handle(db_conn, sessions, msg)
+                    msg = loads_message(raw)
+                except Exception as exc:
+                    send(response_error(f"Bad request: {exc}"))
+                    continue
+                parse_ns = perf_counter_ns() - t0
+
+                busy = admission.check(addr, msg)
+                if busy is None and can_pipeline(msg):
+                    entered = admission.enter()
+                    if entered is None:
+                        send(attach_id(busy_response(), msg.get("id")))
+                        continue
+                    inflight = [f for f in inflight if not f.done()]
+                    if len(inflight) >= PIPELINE_MAX_INFLIGHT:
+                        inflight.pop(0).result()
+                    inflight.append(pipeline.submit(
+                        _run_pipelined, pool, sessions, ctx, msg, send, peer, parse_ns, admission, entered
+                    ))
+                    continue
+
+                for f in inflight:
+                    f.result()
+                inflight.clear()
+
+                if busy is not None:
+                    send(attach_id(busy, msg.get("id") if isinstance(msg, dict) else None))
+                    continue
+
+                if is_hello(msg):
+                    resp, switch_to = negotiate(msg.get("data") or {})
+                    send(attach_id(resp, msg.get("id")), switch_to)
+                    continue
+
+                try:
+                    resp = admission.run(admission.enter(), handle, db_conn, sessions, msg, ctx, peer, parse_ns)
                 except Exception as exc:
                     resp = response_error(f"Bad request: {exc}")
+                send(attach_id(resp, msg.get("id") if isinstance(msg, dict) else None))
 
-                file_obj.write(resp.encode("utf-8"))
-                file_obj.flush()
+            for f in inflight:
+                f.result()
 
     except Exception:
         # Không cho lỗi của 1 client làm sập server
+        count("client_errors")
         return
+    finally:
+        count("connections_closed")
+        admission.disconnect()
+        if peer.subscriber is not None:
+            if ctx.events is not None:
+                ctx.events.unsubscribe(peer.subscriber)
+            peer.subscriber.close()
+        pool.release()
+
+
+def build_context(pool: ConnectionPool, use_seatmap: bool = True, hold_ttl: int = HOLD_TTL_DEFAULT,
+                  hasher: Optional[PasswordHasher] = None, shared_db: bool = False,
+                  admission: Optional[Admission] = None) -> ServerContext:
+    """
+    `shared_db`: other server processes write to the same database (--workers),
+    so the catalogue cache re-checks the database instead of trusting local
+    invalidation. The seat map cannot be shared and must be off.
+    """
+    cache = CatalogueCache(stamp=lambda: db.catalogue_version(pool.get()), shared=shared_db)
+    ctx = ServerContext(cache=cache, metrics=Metrics(), hasher=hasher, admission=admission, hold_ttl=hold_ttl)
+    if use_seatmap:
+        ctx.events = SeatEvents()
+        ctx.seatmap = SeatMap(pool.db_path, on_change=ctx.events.publish)
+        ctx.seatmap.load(pool.get())
+        ctx.holds = HoldExpiry(ctx.seatmap.expire_hold)
+    else:
+        # The expiry thread gets its own pooled connection.
+        ctx.holds = HoldExpiry(lambda hold_id: db.expire_hold(pool.get(), hold_id))
+    for hold_id, expires_at in db.list_holds(pool.get()):
+        ctx.holds.schedule(hold_id, expires_at)
+    return ctx
+
+
+SESSION_STORES = ("sqlite", "snapshot", "memory")
+# With --workers, how stale a process's copy of a session may get (logout elsewhere).
+SESSION_REVALIDATE_SHARED = 2.0
 
 
-def run_server(host: str, port: int, db_path: str) -> None:
-    db_conn = connect(db_path)
-    init_db(db_conn)
+def build_sessions(pool: ConnectionPool, store: str = "sqlite", ttl: float = SESSION_TTL_DEFAULT,
+                   max_sessions: int = SESSIONS_MAX_DEFAULT, snapshot_path: Optional[str] = None,
+                   shared_db: bool = False) -> SessionStore:
+    if store == "sqlite":
+        backend = SqliteSessions(pool)
+    elif store == "snapshot":
+        backend = SnapshotSessions(snapshot_path or f"{pool.db_path}.sessions.json")
+    else:
+        backend = None
+    revalidate = SESSION_REVALIDATE_SHARED if shared_db else 0.0
+    return SessionStore(ttl=ttl, max_sessions=max_sessions, backend=backend, revalidate=revalidate)
 
-    sessions = SessionStore()
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
-        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_sock.bind((host, port))
-        server_sock.listen()
+def start_metrics_endpoint(host: str, port: int, ctx: ServerContext, sessions: SessionStore):
+    """HTTP endpoint with the `server_stats` numbers in Prometheus text format."""
+    httpd = serve_metrics(host, port, lambda: collect_stats(ctx, sessions))
+    bound = httpd.server_address
+    print(f"[SERVER] Metrics on http://{bound[0]}:{bound[1]}/metrics")
+    return httpd
 
-        print(f"[SERVER] Listening on {host}:{port} (db={db_path})")
+
+def listen_socket(host: str, port: int, reuseport: bool = False, listen: bool = True) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+def run_server(
+    host: str,
+    port: int,
+    db_path: str,
+    use_seatmap: bool = True,
+    hold_ttl: int = HOLD_TTL_DEFAULT,
+    metrics_port: Optional[int] = None,
+    kdf: str = DEFAULT_SCHEME,
+    hash_workers: Optional[int] = None,
+    hash_queue: Optional[int] = None,
+    session_store: str = "sqlite",
+    session_ttl: float = SESSION_TTL_DEFAULT,
+    max_sessions: int = SESSIONS_MAX_DEFAULT,
+    session_snapshot: Optional[str] = None,
+    sock: Optional[socket.socket] = None,
+    shared_db: bool = False,
+    limits: Limits = Limits(),
+) -> None:
+    """
+    `sock`: an already listening socket (a --workers process); `shared_db`: see `build_context`.
+    With queue `limits`, at most PIPELINE_THREADS_DEFAULT handlers run at once.
+    """
+    pool = ConnectionPool(db_path)
+    init_db(pool.get())
+
+    sessions = build_sessions(pool, session_store, session_ttl, max_sessions, session_snapshot, shared_db)
+    hasher = PasswordHasher(kdf, hash_workers, hash_queue)
+    admission = Admission(limits, slots=PIPELINE_THREADS_DEFAULT, is_session=sessions.known)
+    ctx = build_context(pool, use_seatmap, hold_ttl, hasher, shared_db, admission)
+    if metrics_port is not None:
+        start_metrics_endpoint(host, metrics_port, ctx, sessions)
+    pipeline = ThreadPoolExecutor(max_workers=PIPELINE_THREADS_DEFAULT, thread_name_prefix="pipeline")
+
+    with sock or listen_socket(host, port) as server_sock:
+        bound = server_sock.getsockname()[:2]
+        print(f"[SERVER] Listening on {bound[0]}:{bound[1]} (db={db_path}, pid={os.getpid()})")
 
         while True:
             client_sock, client_addr = server_sock.accept()
             thread = threading.Thread(
                 target=client_thread,
-                args=(client_sock, client_addr, db_conn, sessions),
+                args=(client_sock, client_addr, pool, sessions, ctx, pipeline),
                 daemon=True,
             )
             thread.start()
@@ -73,12 +296,132 @@ def main() -> None:
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=5555)
     parser.add_argument("--db", default=None, help="Path to sqlite db file")
+    parser.add_argument(
+        "--engine",
+        choices=("threaded", "asyncio"),
+        default="threaded",
+        help="threaded: one OS thread per client; asyncio: one event loop for all clients",
+    )
+    parser.add_argument(
+        "--db-threads",
+        type=int,
+        default=8,
+        help="(asyncio engine) size of the thread pool running handler/SQLite work",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=0,
+        help="open connections per process; more are answered 'Server busy' and closed (0 = unlimited)",
+    )
+    parser.add_argument("--rate-ip", type=float, default=0.0, help="requests/s allowed per client IP (0 = off)")
+    parser.add_argument("--rate-ip-burst", type=float, default=0.0, help="requests per IP at once (default: --rate-ip)")
+    parser.add_argument("--rate-token", type=float, default=0.0, help="requests/s allowed per login token (0 = off)")
+    parser.add_argument(
+        "--rate-token-burst", type=float, default=0.0, help="requests per token at once (default: --rate-token)"
+    )
+    parser.add_argument(
+        "--queue-max",
+        type=int,
+        default=0,
+        help="requests waiting for a handler thread before new ones get 'Server busy' (0 = unbounded)",
+    )
+    parser.add_argument(
+        "--queue-wait-ms",
+        type=float,
+        default=0.0,
+        help="a request queued longer than this is answered 'Server busy' instead of run (0 = never)",
+    )
+    parser.add_argument(
+        "--no-seatmap",
+        action="store_true",
+        help="serve seats straight from SQLite instead of the in-memory seat map",
+    )
+    parser.add_argument(
+        "--hold-ttl",
+        type=int,
+        default=HOLD_TTL_DEFAULT,
+        help="default lifetime in seconds of a seat hold (hold_seats)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="also serve Prometheus-style metrics over HTTP on this port (GET /metrics)",
+    )
+    parser.add_argument("--kdf", choices=SCHEMES, default=DEFAULT_SCHEME, help="password hashing scheme")
+    parser.add_argument(
+        "--hash-workers",
+        type=int,
+        default=None,
+        help="processes computing password hashes (default: CPU count, at most 4; 0 = inline)",
+    )
+    parser.add_argument(
+        "--hash-queue",
+        type=int,
+        default=None,
+        help="register/login hashes allowed in flight before answering 'Server busy'",
+    )
+    parser.add_argument(
+        "--session-store",
+        choices=SESSION_STORES,
+        default="sqlite",
+        help="where login sessions survive a restart: sqlite table, JSON snapshot file, or nowhere",
+    )
+    parser.add_argument("--session-ttl", type=float, default=SESSION_TTL_DEFAULT, help="idle seconds before a token expires")
+    parser.add_argument("--max-sessions", type=int, default=SESSIONS_MAX_DEFAULT, help="sessions kept in memory (LRU)")
+    parser.add_argument("--session-snapshot", default=None, help="snapshot file (default: <db>.sessions.json)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="run N server processes on the same port and database, restarted if they crash",
+    )
+    parser.add_argument(
+        "--reuseport",
+        action="store_true",
+        help="(--workers) each process binds its own SO_REUSEPORT socket instead of sharing one",
+    )
     args = parser.parse_args()
+    if args.workers and args.session_store != "sqlite":
+        parser.error("--workers needs --session-store sqlite (sessions are shared through the database)")
 
     from .db import DB_PATH_DEFAULT
 
     db_path = args.db or DB_PATH_DEFAULT
-    run_server(args.host, args.port, db_path)
+    options = dict(
+        use_seatmap=not args.no_seatmap,
+        hold_ttl=args.hold_ttl,
+        metrics_port=args.metrics_port,
+        kdf=args.kdf,
+        hash_workers=args.hash_workers,
+        hash_queue=args.hash_queue,
+        session_store=args.session_store,
+        session_ttl=args.session_ttl,
+        max_sessions=args.max_sessions,
+        session_snapshot=args.session_snapshot,
+        limits=Limits(
+            max_connections=args.max_connections,
+            ip_rate=args.rate_ip,
+            ip_burst=args.rate_ip_burst,
+            token_rate=args.rate_token,
+            token_burst=args.rate_token_burst,
+            queue_max=args.queue_max,
+            queue_wait=args.queue_wait_ms / 1000,
+        ),
+    )
+    if args.engine == "asyncio":
+        options["db_threads"] = args.db_threads
+    if args.workers:
+        from .workers import run_workers
+
+        run_workers(args.workers, args.host, args.port, db_path, args.engine, options, reuseport=args.reuseport)
+    elif args.engine == "asyncio":
+        from .aio import run_asyncio_server
+
+        run_asyncio_server(args.host, args.port, db_path, **options)
+    else:
+        run_server(args.host, args.port, db_path, **options)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""
+Per-action request metrics.
+
+Every handled request records its latency split into phases:
+
+  parse      decoding the request line/frame (transport)
+  handle     the whole handler, auth and argument checks included
+  db         time spent in storage calls (SQLite or the seat map)
+  serialize  encoding the response JSON
+
+Plain event counters (connections, bytes, booking conflicts, SQLite lock
+waits) live in `Counters`.
+
+Recording sits on every request path, so each thread writes to its own shard
+without any lock; readers merge the shards when somebody asks. The shard of a
+thread that exits is folded into a retired total, so their number follows
+the live threads, not every connection ever served. Latencies go
+into power-of-two microsecond buckets, which is enough for percentile
+estimates at a fixed, tiny cost per request.
+
+`render_text` turns a `server_stats` result into the Prometheus text format
+and `serve_metrics` exposes it over HTTP (`--metrics-port`).
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Sequence, Set
+
+PHASES = ("parse", "handle", "db", "serialize")
+BUCKETS = 32  # bucket i holds latencies below 2**i µs; the last one takes the rest
+PERCENTILES = (50, 95, 99)
+
+
+def bucket_of(ns: int) -> int:
+    return min((ns // 1000).bit_length(), BUCKETS - 1)
+
+
+def percentile(hist: Sequence[int], q: float) -> int:
+    """Upper bound in µs of the bucket holding the q-th percentile (0 if empty)."""
+    total = sum(hist)
+    if not total:
+        return 0
+    rank = total * q / 100
+    seen = 0
+    for i, n in enumerate(hist):
+        seen += n
+        if seen >= rank:
+            return 1 << i
+    return 1 << (BUCKETS - 1)
+
+
+def discard(name: str, n: int = 1) -> None:
+    """Stand-in for `Metrics.incr` when a server runs without metrics."""
+
+
+class _Owner:
+    """Held in a thread's local storage; freed (and finalized) when the thread exits."""
+
+
+class _Shards:
+    """
+    Per-thread dicts, registered once per thread; only the owner thread writes
+    to its dict. When a thread exits, its dict is folded into one retired
+    total with `add(into, shard)`, so a thread per connection does not leave
+    a shard behind for every connection the server ever had.
+    """
+
+    def __init__(self, add: Callable[[Dict[str, Any], Dict[str, Any]], None]) -> None:
+        self._add = add
+        self._local = threading.local()
+        self._ids = itertools.count()
+        self._shards: Dict[int, Dict[str, Any]] = {}
+        self._retired: Dict[str, Any] = {}
+        self._lock = threading.Lock()  # guards registration, retiring and merging, never a write
+
+    def mine(self) -> Dict[str, Any]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard, owner, key = {}, _Owner(), next(self._ids)
+            with self._lock:
+                self._shards[key] = shard
+            weakref.finalize(owner, self._retire, key)
+            self._local.shard, self._local.owner = shard, owner
+        return shard
+
+    def _retire(self, key: int) -> None:
+        with self._lock:
+            self._add(self._retired, self._shards.pop(key))
+
+    def merged(self) -> Dict[str, Any]:
+        """The retired total plus every live shard, added into a fresh dict."""
+        out: Dict[str, Any] = {}
+        with self._lock:
+            self._add(out, self._retired)
+            for shard in self._shards.values():
+                self._add(out, shard)
+        return out
+
+    def __len__(self) -> int:
+        """Live shards, i.e. threads that recorded something and are still running."""
+        with self._lock:
+            return len(self._shards)
+
+
+def _add_counts(into: Dict[str, Any], shard: Dict[str, Any]) -> None:
+    for name, n in list(shard.items()):
+        into[name] = into.get(name, 0) + n
+
+
+class Counters:
+    """Named monotonic counters, sharded per thread and summed on read."""
+
+    def __init__(self) -> None:
+        self._shards = _Shards(_add_counts)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        shard = self._shards.mine()
+        shard[name] = shard.get(name, 0) + n
+
+    def values(self) -> Dict[str, int]:
+        return self._shards.merged()
+
+    def value(self, name: str) -> int:
+        return self._shards.merged().get(name, 0)
+
+
+class _Counters:
+    __slots__ = ("count", "errors", "total_ns", "hist")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total_ns = [0] * len(PHASES)
+        self.hist = [[0] * BUCKETS for _ in PHASES]
+
+
+def _add_actions(into: Dict[str, Any], shard: Dict[str, Any]) -> None:
+    for action, c in list(shard.items()):
+        m = into.get(action)
+        if m is None:
+            m = into[action] = _Counters()
+        m.count += c.count
+        m.errors += c.errors
+        for i in range(len(PHASES)):
+            m.total_ns[i] += c.total_ns[i]
+            m.hist[i] = [a + b for a, b in zip(m.hist[i], c.hist[i])]
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._shards = _Shards(_add_actions)
+        self.counters = Counters()
+        self.started = time.monotonic()
+
+    def uptime(self) -> float:
+        return time.monotonic() - self.started
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters.incr(name, n)
+
+    def record(self, action: str, ok: bool, parse_ns: int, handle_ns: int, db_ns: int, serialize_ns: int) -> None:
+        shard = self._shards.mine()
+        c = shard.get(action)
+        if c is None:
+            c = shard[action] = _Counters()
+        c.count += 1
+        if not ok:
+            c.errors += 1
+        for i, ns in enumerate((parse_ns, handle_ns, db_ns, serialize_ns)):
+            c.total_ns[i] += ns
+            c.hist[i][bucket_of(ns)] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """{action: {"count", "errors", "rps", <phase>: {"avg_us", "p50_us", "p95_us", "p99_us"}}}"""
+        out: Dict[str, Dict[str, Any]] = {}
+        uptime = max(self.uptime(), 1e-9)
+        for action, c in sorted(self._shards.merged().items()):
+            entry: Dict[str, Any] = {"count": c.count, "errors": c.errors, "rps": round(c.count / uptime, 2)}
+            for i, phase in enumerate(PHASES):
+                stats = {"avg_us": round(c.total_ns[i] / c.count / 1000, 1) if c.count else 0.0}
+                for q in PERCENTILES:
+                    stats[f"p{q}_us"] = percentile(c.hist[i], q)
+                entry[phase] = stats
+            out[action] = entry
+        return out
+
+
+def _sample(out: List[str], typed: Set[str], name: str, kind: str, value: Any, labels: str = "") -> None:
+    if name not in typed:
+        typed.add(name)
+        out.append(f"# TYPE {name} {kind}")
+    out.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+
+def render_text(stats: Dict[str, Any], prefix: str = "cinema") -> str:
+    """Prometheus text exposition of a `server_stats` result."""
+    out: List[str] = []
+    typed: Set[str] = set()
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            kind = "counter" if key.endswith("_total") else "gauge"
+            _sample(out, typed, f"{prefix}_{key}", kind, value)
+    for action, entry in stats.get("actions", {}).items():
+        label = f'action="{action}"'
+        _sample(out, typed, f"{prefix}_requests_total", "counter", entry["count"], label)
+        _sample(out, typed, f"{prefix}_request_errors_total", "counter", entry["errors"], label)
+        for phase in PHASES:
+            for q in PERCENTILES:
+                _sample(
+                    out, typed, f"{prefix}_request_latency_us", "summary", entry[phase][f"p{q}_us"],
+                    f'{label},phase="{phase}",quantile="{q / 100}"',
+                )
+    return "\n".join(out) + "\n"
+
+
+def serve_metrics(host: str, port: int, collect: Callable[[], Dict[str, Any]]) -> ThreadingHTTPServer:
+    """Serve `render_text(collect())` on GET /metrics from a daemon thread; call `shutdown()` to stop."""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render_text(collect()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
@@ -0,0 +1,143 @@
+"""
+Password hashing.
+
+Stored hashes carry their scheme and parameters:
+
+  scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+  pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+
+Rows written before salted hashing hold a bare SHA-256 hex digest; they
+still verify, and `needs_rehash` tells login to replace them.
+
+A KDF is slow on purpose and holds the GIL, so the server runs it in worker
+processes (`PasswordHasher`). The queue in front of them is bounded: when a
+login storm fills it, `HasherBusy` is raised at once instead of letting auth
+work pile up behind (and slow down) seat bookings.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from .metrics import Counters
+
+SCHEME_SCRYPT = "scrypt"
+SCHEME_PBKDF2 = "pbkdf2_sha256"
+SCHEMES = (SCHEME_SCRYPT, SCHEME_PBKDF2)
+DEFAULT_SCHEME = SCHEME_SCRYPT
+
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 200_000
+SALT_BYTES = 16
+
+HASH_WORKERS_MAX = 4
+QUEUE_PER_WORKER = 16
+WAIT_TIMEOUT = 30.0
+
+
+class HasherBusy(Exception):
+    """The hashing queue is full; the caller should retry later."""
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+
+def hash_password(password: str, scheme: str = DEFAULT_SCHEME) -> str:
+    salt = os.urandom(SALT_BYTES)
+    if scheme == SCHEME_SCRYPT:
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"{SCHEME_SCRYPT}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    if scheme == SCHEME_PBKDF2:
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, PBKDF2_ITERATIONS)
+        return f"{SCHEME_PBKDF2}${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+    raise ValueError(f"Unknown password scheme: {scheme}")
+
+
+def verify_password(password: str, stored: str) -> bool:
+    parts = stored.split("$")
+    try:
+        if parts[0] == SCHEME_SCRYPT and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            digest = _scrypt(password, bytes.fromhex(parts[4]), n, r, p)
+            return hmac.compare_digest(digest.hex(), parts[5])
+        if parts[0] == SCHEME_PBKDF2 and len(parts) == 4:
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(parts[2]), int(parts[1]))
+            return hmac.compare_digest(digest.hex(), parts[3])
+    except ValueError:
+        return False
+    if len(parts) == 1:  # legacy unsalted SHA-256
+        return hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).hexdigest(), stored)
+    return False
+
+
+def needs_rehash(stored: str, scheme: str = DEFAULT_SCHEME) -> bool:
+    """True for legacy rows and for hashes made with another scheme or weaker parameters."""
+    parts = stored.split("$")
+    if scheme == SCHEME_SCRYPT:
+        return parts[:4] != [SCHEME_SCRYPT, str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return parts[:2] != [SCHEME_PBKDF2, str(PBKDF2_ITERATIONS)]
+
+
+class PasswordHasher:
+    """
+    Hash/verify passwords in a process pool owned by the server.
+    workers=0 computes in the calling thread (tests, scripts).
+    """
+
+    def __init__(self, scheme: str = DEFAULT_SCHEME, workers: Optional[int] = None,
+                 max_pending: Optional[int] = None) -> None:
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown password scheme: {scheme}")
+        self.scheme = scheme
+        if workers is None:
+            workers = min(os.cpu_count() or 1, HASH_WORKERS_MAX)
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            # spawn: never fork a process that is running server threads.
+            self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.max_pending = max_pending if max_pending is not None else max(workers, 1) * QUEUE_PER_WORKER
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.counters = Counters()
+
+    @property
+    def rejected(self) -> int:
+        return self.counters.value("rejected")
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pool is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.counters.incr("rejected")
+            raise HasherBusy()
+        try:
+            fut = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut.result(timeout=WAIT_TIMEOUT)
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password, self.scheme)
+
+    def verify(self, password: str, stored: str) -> bool:
+        return self._run(verify_password, password, stored)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.scheme)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+INLINE = PasswordHasher(workers=0)
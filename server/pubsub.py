@@ -0,0 +1,169 @@
+"""
+Push notifications of seat changes to subscribed connections.
+
+The booking path only calls `SeatEvents.publish`, which appends to a queue
+and returns. A dispatcher thread serializes each event once and offers the
+line to every subscriber of that showtime. Each subscriber has a bounded
+buffer: when a slow consumer's buffer is full, its pending events are
+dropped and replaced by a single "resync" event telling the client to
+re-fetch the seat map, so a stalled client never holds memory or the
+dispatcher.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from common.protocol import event_line
+
+EVENT_SEATS = "seats"
+SUBSCRIBER_BUFFER = 256
+MAX_SUBSCRIPTIONS_PER_CONN = 16
+
+
+class Subscriber:
+    """
+    Event buffer of one connection. `offer` never blocks; transports
+    override `wake` to get the buffered lines written out (`drain`).
+    """
+
+    def __init__(self, maxlen: int = SUBSCRIBER_BUFFER) -> None:
+        self.maxlen = maxlen
+        self._buf: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def offer(self, line: str, resync_line: str) -> None:
+        with self._lock:
+            if len(self._buf) >= self.maxlen:
+                self.dropped += len(self._buf)
+                self._buf.clear()
+                self._buf.append(resync_line)
+            else:
+                self._buf.append(line)
+        self.wake()
+
+    def drain(self) -> List[str]:
+        with self._lock:
+            lines = list(self._buf)
+            self._buf.clear()
+        return lines
+
+    def wake(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ThreadedSubscriber(Subscriber):
+    """For the threaded engine: a sender thread (started on first event) writes the lines."""
+
+    def __init__(self, send, maxlen: int = SUBSCRIBER_BUFFER) -> None:
+        super().__init__(maxlen)
+        self._send = send
+        self._cond = threading.Condition()
+        self._pending = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="subscriber", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                self._pending = False
+            try:
+                for line in self.drain():
+                    self._send(line)
+            except Exception:
+                return
+
+
+class SeatEvents:
+    """Subscription registry and dispatcher; plug `publish` into `SeatMap.on_change`."""
+
+    def __init__(self) -> None:
+        self._subs: Dict[int, Set[Subscriber]] = {}
+        self._by_sub: Dict[Subscriber, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.SimpleQueue[Optional[Tuple[int, int, List[Tuple[str, str]]]]]" = queue.SimpleQueue()
+        self.published = 0
+        self._thread = threading.Thread(target=self._run, name="seat-events", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, sub: Subscriber, showtime_id: int) -> bool:
+        with self._lock:
+            topics = self._by_sub.setdefault(sub, set())
+            if showtime_id not in topics and len(topics) >= MAX_SUBSCRIPTIONS_PER_CONN:
+                return False
+            topics.add(showtime_id)
+            self._subs.setdefault(showtime_id, set()).add(sub)
+            return True
+
+    def unsubscribe(self, sub: Subscriber, showtime_id: Optional[int] = None) -> None:
+        """Drop one subscription, or all of them (connection closed) when showtime_id is None."""
+        with self._lock:
+            topics = self._by_sub.get(sub, set())
+            for sid in list(topics) if showtime_id is None else [showtime_id]:
+                topics.discard(sid)
+                subs = self._subs.get(sid)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[sid]
+            if not topics:
+                self._by_sub.pop(sub, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._by_sub)
+
+    def publish(self, showtime_id: int, version: int, changes: List[Tuple[str, str]]) -> None:
+        self._queue.put((showtime_id, version, changes))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            showtime_id, version, changes = item
+            with self._lock:
+                subs = list(self._subs.get(showtime_id, ()))
+            self.published += 1
+            if not subs:
+                continue
+            line = event_line(EVENT_SEATS, {
+                "showtime_id": showtime_id,
+                "version": version,
+                "changes": [{"seat_code": code, "status": status} for code, status in changes],
+            })
+            resync = event_line(EVENT_SEATS, {"showtime_id": showtime_id, "version": version, "resync": True})
+            for sub in subs:
+                try:
+                    sub.offer(line, resync)
+                except Exception:
+                    self.unsubscribe(sub)
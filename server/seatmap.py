@@ -0,0 +1,589 @@
+"""
+In-memory authoritative seat state, one compact map per showtime.
+
+Each showtime keeps its seat codes once plus a bytearray with one state byte
+per seat, guarded by a per-showtime lock. Availability reads and booking
+decisions never touch SQLite; a conflicting `book` ("Seat already booked") is
+rejected in O(1) under the lock.
+
+Each showtime carries a version, bumped on every change of its seat view,
+which `get_seats` reports and `if_version` compares against. Versions of
+one load start at `epoch << EPOCH_SHIFT`, with the epoch taken from a
+database counter, so a restarted server never reuses a version it handed
+out before (the loaded state may differ: holds expire while it is down).
+
+Accepted changes are persisted by a single write-behind thread that drains a
+queue and applies every pending operation in one transaction (group commit,
+one SAVEPOINT per operation). A booking caller waits for its batch to commit
+so the ticket id it returns always exists; if the write fails the in-memory
+seat is released again. SQLite keeps the final say: the write re-checks the
+seat row inside the transaction, so memory and DB can never both hand out
+the same seat. Those writes still fire the seats/seat_holds triggers, which
+bump showtimes.version and append to seat_changes: seat-map mode pays for
+the DB log (about 3x the bare UPDATE) so a DB-mode process (`--workers`)
+reading the same file stays in sync.
+"""
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.seats import GAP, STATUS_TO_SYMBOL, encode_cells, grid_layout
+from . import db
+
+AVAILABLE = 0
+BOOKED = 1
+HELD = 2
+STATUS_NAMES = ("available", "booked", "held")
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+# state byte -> compact-format symbol byte
+STATE_SYMBOLS = bytes(ord(STATUS_TO_SYMBOL[name]) for name in STATUS_NAMES)
+
+ChangeListener = Callable[[int, int, List[Tuple[str, str]]], None]
+HoldInfo = Tuple[str, int, float]  # (hold_id, user_id, expires_at)
+
+# Max operations the writer folds into one transaction.
+WRITE_BATCH_MAX = 256
+# Room for 2**32 changes per showtime within one load.
+EPOCH_SHIFT = 32
+# Versions of one showtime whose changes are kept for `since_version` reads.
+SEAT_LOG_MAX = db.SEAT_LOG_MAX
+
+
+class ShowtimeSeats:
+    """Seat map of one showtime. `state[i]` is the status of `codes[i]`."""
+
+    __slots__ = ("showtime_id", "codes", "index", "state", "holds", "lock", "grid", "version", "log")
+
+    def __init__(
+        self,
+        showtime_id: int,
+        rows: List[Tuple[str, str]],
+        holds: Optional[Dict[str, HoldInfo]] = None,
+        version: int = 0,
+    ) -> None:
+        rows = sorted(rows)  # same order as `ORDER BY seat_code`
+        self.showtime_id = showtime_id
+        self.codes: List[str] = [code for code, _ in rows]
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        self.state = bytearray(STATUS_CODES.get(status, BOOKED) for _, status in rows)
+        # seat index -> (hold_id, user_id, expires_at) for HELD seats
+        self.holds: Dict[int, HoldInfo] = {}
+        for code, info in (holds or {}).items():
+            idx = self.index.get(code)
+            if idx is not None and self.state[idx] == AVAILABLE:
+                self.state[idx] = HELD
+                self.holds[idx] = info
+        self.lock = threading.Lock()
+        # Bumped once per committed change (booking, cancel), and when a
+        # change that was visible while pending is undone.
+        self.version = version
+        # (version, [(seat_code, status)]) of the last SEAT_LOG_MAX versions.
+        self.log: "deque[Tuple[int, List[Tuple[str, str]]]]" = deque(maxlen=SEAT_LOG_MAX)
+        # (rows, cols, grid cell of each seat index) for the compact format.
+        layout = grid_layout(self.codes)
+        self.grid: Optional[Tuple[List[str], int, List[int]]] = None
+        if layout is not None:
+            rows, cols, pos = layout
+            self.grid = (rows, cols, [pos[c] for c in self.codes])
+
+    def is_free(self, idx: int, now: float, hold_id: Optional[str] = None) -> bool:
+        """Bookable by the caller (under `lock`): available, or held by an expired or own hold."""
+        st = self.state[idx]
+        if st == AVAILABLE:
+            return True
+        if st == HELD:
+            info = self.holds.get(idx)
+            return info is None or info[2] <= now or (hold_id is not None and info[0] == hold_id)
+        return False
+
+    def take(self, idx: int, new_state: int) -> None:
+        """Set a seat's state (under `lock`), dropping any hold bookkeeping."""
+        self.state[idx] = new_state
+        self.holds.pop(idx, None)
+
+    def snapshot(self) -> Tuple[bytes, int]:
+        with self.lock:
+            return bytes(self.state), self.version
+
+    def bump(self, changes: List[Tuple[str, str]]) -> int:
+        """New version for `changes` (under `lock`), recorded in the log."""
+        self.version += 1
+        self.log.append((self.version, changes))
+        return self.version
+
+    def changes_since(self, since_version: int) -> Optional[Tuple[int, List[Dict[str, str]]]]:
+        """(version, latest status of each seat changed after `since_version`), None if the log is too short."""
+        with self.lock:
+            version = self.version
+            if since_version == version:
+                return version, []
+            if not self.log or not self.log[0][0] <= since_version + 1 <= version:
+                return None
+            latest: Dict[str, str] = {}
+            for v, changes in self.log:
+                if v > since_version:
+                    latest.update(changes)
+        return version, [{"seat_code": c, "status": st} for c, st in latest.items()]
+
+    def to_list(self, state: bytes) -> List[Dict[str, Any]]:
+        return [{"seat_code": c, "status": STATUS_NAMES[s]} for c, s in zip(self.codes, state)]
+
+    def to_compact(self, state: bytes) -> Optional[Dict[str, Any]]:
+        if self.grid is None:
+            return None
+        rows, cols, cell_of = self.grid
+        cells = bytearray(GAP.encode("ascii") * (len(rows) * cols))
+        for cell, st in zip(cell_of, state):
+            cells[cell] = STATE_SYMBOLS[st]
+        return encode_cells(rows, cols, cells.decode("ascii"))
+
+    def available_count(self) -> int:
+        with self.lock:
+            return self.state.count(AVAILABLE)
+
+    def refusal(self, idx: int) -> str:
+        return "Seat is held" if self.state[idx] == HELD else "Seat already booked"
+
+
+class _WriteBehind:
+    """
+    Single writer thread applying queued DB operations with group commit.
+    If the thread dies (say its connection cannot be opened), every queued
+    and later operation fails with that error instead of waiting forever.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._queue: "queue.Queue[Optional[Tuple[Callable[[sqlite3.Cursor], Any], Future]]]" = queue.Queue()
+        self._lock = threading.Lock()  # orders `submit` against the writer failing
+        self._error: Optional[BaseException] = None
+        self._batch: List[Tuple[Callable[[sqlite3.Cursor], Any], Future]] = []
+        self._thread = threading.Thread(target=self._run, name="seatmap-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op: Callable[[sqlite3.Cursor], Any]) -> "Future[Any]":
+        """Queue `op(cursor)`; it runs inside a savepoint of the next batch."""
+        fut: "Future[Any]" = Future()
+        with self._lock:
+            if self._error is not None:
+                fut.set_exception(self._error)
+            else:
+                self._queue.put((op, fut))
+        return fut
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        try:
+            self._serve()
+        except BaseException as e:
+            self._fail(RuntimeError(f"seat writer stopped: {e}"))
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            self._error = error
+        pending = [fut for _, fut in self._batch]
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item[1])
+        for fut in pending:
+            if not fut.done():
+                fut.set_exception(error)
+
+    def _serve(self) -> None:
+        conn = db.connect(self.db_path)
+        conn.isolation_level = None  # explicit BEGIN/COMMIT only
+        cur = conn.cursor()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._batch = batch
+            self._apply(cur, batch)
+            self._batch = []
+        conn.close()
+
+    @staticmethod
+    def _apply(cur: sqlite3.Cursor, batch: List[Tuple[Callable[[sqlite3.Cursor], Any], Future]]) -> None:
+        results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        try:
+            db.begin_immediate(cur)
+            for op, fut in batch:
+                cur.execute("SAVEPOINT op;")
+                try:
+                    res = op(cur)
+                except Exception as e:
+                    cur.execute("ROLLBACK TO op;")
+                    cur.execute("RELEASE op;")
+                    results.append((fut, None, e))
+                    continue
+                # Business failures come back as (False, msg, ...): undo their writes too.
+                if isinstance(res, tuple) and res and res[0] is False:
+                    cur.execute("ROLLBACK TO op;")
+                cur.execute("RELEASE op;")
+                results.append((fut, res, None))
+            cur.execute("COMMIT;")
+        except Exception as e:
+            try:
+                cur.execute("ROLLBACK;")
+            except Exception:
+                pass
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for fut, res, err in results:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+
+class SeatMap:
+    """
+    Seat-state engine shared by all connections of one server process.
+    Call `load` once at startup to rebuild from `seats`/`seat_holds`;
+    showtimes created later are loaded lazily on first access.
+    """
+
+    def __init__(self, db_path: str, on_change: Optional[ChangeListener] = None) -> None:
+        self._maps: Dict[int, ShowtimeSeats] = {}
+        self._maps_lock = threading.Lock()
+        self._writer = _WriteBehind(db_path)
+        # hold_id -> (showtime_id, seat codes) of holds placed or loaded here
+        self._holds: Dict[str, Tuple[int, List[str]]] = {}
+        self._holds_lock = threading.Lock()
+        # Called after each committed change as on_change(showtime_id, version, [(seat_code, status)]).
+        self.on_change = on_change
+        self._first_version: Optional[int] = None
+
+    def _version_base(self, conn: sqlite3.Connection) -> int:
+        if self._first_version is None:
+            self._first_version = db.next_seatmap_epoch(conn) << EPOCH_SHIFT
+        return self._first_version
+
+    def load(self, conn: sqlite3.Connection) -> int:
+        rows = conn.execute(
+            "SELECT showtime_id, seat_code, status FROM seats ORDER BY showtime_id"
+        ).fetchall()
+        grouped: Dict[int, List[Tuple[str, str]]] = {}
+        for r in rows:
+            grouped.setdefault(int(r["showtime_id"]), []).append((r["seat_code"], r["status"]))
+        holds: Dict[int, Dict[str, HoldInfo]] = {}
+        for r in conn.execute(
+            "SELECT showtime_id, seat_code, hold_id, user_id, expires_at FROM seat_holds WHERE expires_at > ?",
+            (time.time(),),
+        ).fetchall():
+            holds.setdefault(int(r["showtime_id"]), {})[r["seat_code"]] = (
+                r["hold_id"], int(r["user_id"]), float(r["expires_at"])
+            )
+        base = self._version_base(conn)
+        with self._maps_lock:
+            self._maps = {sid: ShowtimeSeats(sid, seats, holds.get(sid), base) for sid, seats in grouped.items()}
+        for sid, seat_holds in holds.items():
+            self._remember_holds(sid, seat_holds)
+        return len(self._maps)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def _remember_holds(self, showtime_id: int, seat_holds: Dict[str, HoldInfo]) -> None:
+        with self._holds_lock:
+            for code, (hold_id, _, _) in seat_holds.items():
+                self._holds.setdefault(hold_id, (showtime_id, []))[1].append(code)
+
+    def showtime(self, conn: sqlite3.Connection, showtime_id: int) -> Optional[ShowtimeSeats]:
+        st = self._maps.get(showtime_id)
+        if st is not None:
+            return st
+        if conn.execute("SELECT 1 FROM showtimes WHERE id=?", (showtime_id,)).fetchone() is None:
+            return None
+        rows = conn.execute(
+            "SELECT seat_code, status FROM seats WHERE showtime_id=?", (showtime_id,)
+        ).fetchall()
+        seat_holds = db.get_seat_holds(conn, showtime_id)
+        loaded = ShowtimeSeats(
+            showtime_id, [(r["seat_code"], r["status"]) for r in rows], seat_holds, self._version_base(conn)
+        )
+        with self._maps_lock:
+            st = self._maps.setdefault(showtime_id, loaded)
+        if st is loaded:
+            self._remember_holds(showtime_id, seat_holds)
+        return st
+
+    def get_seats(self, conn: sqlite3.Connection, showtime_id: int, compact: bool = False,
+                  if_version: Optional[int] = None, since_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        `get_seats` response data: {"seats": [...], "version": v}, or the compact
+        form plus "version" (plain list kept for non-grid seat codes);
+        {"not_modified": True, "version": v} when `if_version` is current;
+        {"changes": [...], "since_version": s, "version": v} for `since_version`
+        while the log reaches back to it. None if the showtime does not exist.
+        """
+        st = self.showtime(conn, showtime_id)
+        if st is None:
+            return None
+        if if_version is not None and st.version == if_version:
+            return {"not_modified": True, "version": if_version}
+        if since_version is not None:
+            delta = st.changes_since(since_version)
+            if delta is not None:
+                return {"changes": delta[1], "since_version": since_version, "version": delta[0]}
+        state, version = st.snapshot()
+        result = st.to_compact(state) if compact else None
+        if result is None:
+            result = {"seats": st.to_list(state)}
+        result["version"] = version
+        return result
+
+    def _committed(self, st: ShowtimeSeats, changes: List[Tuple[str, str]]) -> None:
+        with st.lock:
+            version = st.bump(changes)
+        if self.on_change is not None:
+            self.on_change(st.showtime_id, version, changes)
+
+    def _claim(
+        self,
+        st: ShowtimeSeats,
+        seat_codes: List[str],
+        new_state: int,
+        hold_id: Optional[str] = None,
+        new_hold: Optional[HoldInfo] = None,
+    ) -> Tuple[Optional[str], List[int], List[Tuple[int, Optional[HoldInfo]]]]:
+        """
+        Move every seat to `new_state` (recording `new_hold` for HELD) if all
+        are free, all under one lock hold. `hold_id` lets the owner's own hold
+        through. Returns (error, seat indexes, previous (state, hold) per seat
+        for undo).
+        """
+        idxs = []
+        for code in seat_codes:
+            idx = st.index.get(code)
+            if idx is None:
+                return f"Seat not found: {code}", [], []
+            idxs.append(idx)
+        now = time.time()
+        with st.lock:
+            for code, idx in zip(seat_codes, idxs):
+                if not st.is_free(idx, now, hold_id):
+                    return f"{st.refusal(idx)}: {code}", [], []
+            before = [(st.state[idx], st.holds.get(idx)) for idx in idxs]
+            for idx in idxs:
+                st.take(idx, new_state)
+                if new_hold is not None:
+                    st.holds[idx] = new_hold
+        return None, idxs, before
+
+    @staticmethod
+    def _undo(st: ShowtimeSeats, idxs: List[int], before: List[Tuple[int, Optional[HoldInfo]]], keep: Optional[str] = None) -> None:
+        with st.lock:
+            reverted = []
+            for idx, (state, info) in zip(idxs, before):
+                if st.codes[idx] == keep:
+                    reverted.append((keep, STATUS_NAMES[st.state[idx]]))
+                    continue
+                st.take(idx, state)
+                if info is not None:
+                    st.holds[idx] = info
+                reverted.append((st.codes[idx], STATUS_NAMES[state]))
+            # The claimed seats were visible while the write was pending.
+            st.bump(reverted)
+
+    def book(self, conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_code: str) -> Tuple[bool, str, Optional[int]]:
+        st = self.showtime(conn, showtime_id)
+        if st is None:
+            return False, "Showtime not found", None
+        err, idxs, before = self._claim(st, [seat_code], BOOKED)
+        if err is not None:
+            return False, err.rsplit(": ", 1)[0], None
+
+        now = db.utc_now_iso()
+        fut = self._writer.submit(
+            lambda cur: db.book_seat_in_tx(cur, user_id, showtime_id, seat_code, now)
+        )
+        try:
+            ok, m, ticket_id = fut.result()
+        except Exception as e:
+            ok, m, ticket_id = False, f"Booking failed: {e}", None
+        if ok or m == "Seat already booked":
+            # Keep BOOKED when SQLite says the seat is taken (booked outside this process).
+            self._committed(st, [(seat_code, "booked")])
+        else:
+            self._undo(st, idxs, before)
+        return ok, m, ticket_id
+
+    def book_many(self, conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_codes: List[str]) -> Tuple[bool, str, List[int]]:
+        """All-or-nothing booking of several seats, one lock hold and one savepoint."""
+        st = self.showtime(conn, showtime_id)
+        if st is None:
+            return False, "Showtime not found", []
+        err, idxs, before = self._claim(st, seat_codes, BOOKED)
+        if err is not None:
+            return False, err, []
+
+        now = db.utc_now_iso()
+        fut = self._writer.submit(
+            lambda cur: db.book_seats_in_tx(cur, user_id, showtime_id, seat_codes, now)
+        )
+        try:
+            ok, m, ticket_ids = fut.result()
+        except Exception as e:
+            ok, m, ticket_ids = False, f"Booking failed: {e}", []
+        if ok:
+            self._committed(st, [(code, "booked") for code in seat_codes])
+        else:
+            taken = m.split(": ", 1)[1] if m.startswith("Seat already booked: ") else None
+            self._undo(st, idxs, before, keep=taken)
+        return ok, m, ticket_ids
+
+    def hold(
+        self, conn: sqlite3.Connection, user_id: int, showtime_id: int, seat_codes: List[str], ttl: float
+    ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+        st = self.showtime(conn, showtime_id)
+        if st is None:
+            return False, "Showtime not found", None
+        hold_id, expires_at = db.new_hold_id(), time.time() + ttl
+        err, idxs, before = self._claim(st, seat_codes, HELD, new_hold=(hold_id, user_id, expires_at))
+        if err is not None:
+            return False, err, None
+
+        fut = self._writer.submit(
+            lambda cur: db.hold_seats_in_tx(cur, user_id, showtime_id, seat_codes, hold_id, expires_at)
+        )
+        try:
+            ok, m = fut.result()
+        except Exception as e:
+            ok, m = False, f"Hold failed: {e}"
+        if not ok:
+            self._undo(st, idxs, before)
+            return False, m, None
+        with self._holds_lock:
+            self._holds[hold_id] = (showtime_id, list(seat_codes))
+        self._committed(st, [(code, "held") for code in seat_codes])
+        return True, "Held", {"hold_id": hold_id, "showtime_id": showtime_id, "seat_codes": seat_codes, "expires_at": expires_at}
+
+    def _own_hold(self, user_id: int, hold_id: str) -> Tuple[Optional[str], Optional[ShowtimeSeats], List[str]]:
+        with self._holds_lock:
+            entry = self._holds.get(hold_id)
+        if entry is None:
+            return "Hold not found", None, []
+        st = self._maps.get(entry[0])
+        if st is None:
+            return "Hold not found", None, []
+        codes = entry[1]
+        with st.lock:
+            infos = [st.holds.get(st.index[c]) for c in codes]
+        if any(info is None or info[0] != hold_id for info in infos):
+            return "Hold not found", None, []
+        if infos[0][1] != user_id:
+            return "Hold not found", None, []
+        if min(info[2] for info in infos) <= time.time():
+            return "Hold expired", None, []
+        return None, st, codes
+
+    def confirm_hold(self, user_id: int, hold_id: str) -> Tuple[bool, str, List[int]]:
+        err, st, codes = self._own_hold(user_id, hold_id)
+        if err is not None:
+            return False, err, []
+        err, idxs, before = self._claim(st, codes, BOOKED, hold_id)
+        if err is not None:
+            return False, err, []
+
+        now = db.utc_now_iso()
+        fut = self._writer.submit(lambda cur: db.confirm_hold_in_tx(cur, user_id, hold_id, now))
+        try:
+            ok, m, ticket_ids, _, _ = fut.result()
+        except Exception as e:
+            ok, m, ticket_ids = False, f"Booking failed: {e}", []
+        if not ok:
+            self._undo(st, idxs, before)
+            return False, m, []
+        with self._holds_lock:
+            self._holds.pop(hold_id, None)
+        self._committed(st, [(code, "booked") for code in codes])
+        return True, "Booked", ticket_ids
+
+    def release_hold(self, user_id: int, hold_id: str) -> Tuple[bool, str]:
+        err, st, codes = self._own_hold(user_id, hold_id)
+        if err is not None:
+            return False, err
+        err, idxs, before = self._claim(st, codes, AVAILABLE, hold_id)
+        if err is not None:
+            return False, err
+
+        fut = self._writer.submit(lambda cur: db.release_hold_in_tx(cur, user_id, hold_id))
+        try:
+            ok, m, _, _ = fut.result()
+        except Exception as e:
+            ok, m = False, f"Release failed: {e}"
+        if not ok:
+            self._undo(st, idxs, before)
+            return False, m
+        with self._holds_lock:
+            self._holds.pop(hold_id, None)
+        self._committed(st, [(code, "available") for code in codes])
+        return True, "Released"
+
+    def expire_hold(self, hold_id: str) -> None:
+        """Expiry-scheduler callback: free the seats of a hold whose TTL passed."""
+        with self._holds_lock:
+            entry = self._holds.pop(hold_id, None)
+        # entry is None for a hold already confirmed or released (the DELETE
+        # below is then a no-op) and for one that expired while the server was
+        # down, which `load` never put in memory but whose row is still there.
+        st = self._maps.get(entry[0]) if entry is not None else None
+        freed: List[str] = []
+        if st is not None:
+            now = time.time()
+            with st.lock:
+                for code in entry[1]:
+                    idx = st.index[code]
+                    info = st.holds.get(idx)
+                    if st.state[idx] == HELD and info is not None and info[0] == hold_id and info[2] <= now:
+                        st.take(idx, AVAILABLE)
+                        freed.append(code)
+        self._writer.submit(
+            lambda cur: cur.execute(
+                "DELETE FROM seat_holds WHERE hold_id=? AND expires_at <= ?", (hold_id, time.time())
+            ).rowcount
+        ).result()
+        if st is not None and freed:
+            self._committed(st, [(code, "available") for code in freed])
+
+    def cancel(self, user_id: int, ticket_id: int) -> Tuple[bool, str]:
+        fut = self._writer.submit(lambda cur: db.cancel_ticket_in_tx(cur, user_id, ticket_id))
+        try:
+            ok, m, row = fut.result()
+        except Exception as e:
+            return False, f"Cancel failed: {e}"
+        if ok:
+            st = self._maps.get(int(row["showtime_id"]))
+            if st is not None:
+                idx = st.index.get(row["seat_code"])
+                if idx is not None:
+                    with st.lock:
+                        st.take(idx, AVAILABLE)
+                    self._committed(st, [(row["seat_code"], "available")])
+        return ok, m
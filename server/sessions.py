@@ -0,0 +1,258 @@
+"""
+Login sessions.
+
+Tokens live in a fixed number of shards, each an LRU-ordered dict behind its
+own lock, so `get` is one hash plus one dict lookup and threads only contend
+when their tokens land in the same shard. Every successful `get` slides the
+expiry forward by the TTL; a reaper thread drops expired entries in the
+background. Past `max_sessions` the least recently used session of a shard
+is evicted from memory.
+
+A backend makes sessions outlive the process:
+
+  SqliteSessions    one row per session (token stored hashed). A token not
+                    in memory is looked up in the database (read-through), so
+                    a restarted server, or another server process on the same
+                    database, accepts it; memory eviction only drops the copy.
+                    With `revalidate` set, a cached token is re-read after that
+                    many seconds, so a logout in one process reaches the others.
+  SnapshotSessions  the whole store written to a JSON file by the reaper and
+                    on close, read back at start.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import db
+from .metrics import Counters
+
+SESSION_TTL_DEFAULT = 12 * 3600
+SESSIONS_MAX_DEFAULT = 100_000
+SHARDS = 16
+REAP_INTERVAL = 60.0
+# A sliding extension is written to the backend once it has moved the expiry
+# by this fraction of the TTL, not on every request.
+TOUCH_FRACTION = 0.1
+
+SessionRow = Tuple[str, Dict[str, Any], float]
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class SqliteSessions:
+    def __init__(self, pool: db.ConnectionPool) -> None:
+        self.pool = pool
+
+    def load(self) -> Iterable[SessionRow]:
+        return ()  # read-through instead of loading every session up front
+
+    def fetch(self, token: str, now: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        return db.load_session(self.pool.get(), token_hash(token), now)
+
+    def save(self, token: str, user: Dict[str, Any], expires_at: float) -> None:
+        db.save_session(self.pool.get(), token_hash(token), int(user["id"]), expires_at)
+
+    def touch(self, token: str, expires_at: float) -> None:
+        db.touch_session(self.pool.get(), token_hash(token), expires_at)
+
+    def delete(self, token: str) -> None:
+        db.delete_session(self.pool.get(), token_hash(token))
+
+    def purge(self, now: float) -> None:
+        db.purge_sessions(self.pool.get(), now)
+
+    def flush(self, rows: Iterable[SessionRow]) -> None:
+        pass
+
+
+class SnapshotSessions:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def load(self) -> Iterable[SessionRow]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            return ()
+        return [(r["token"], r["user"], float(r["expires_at"])) for r in rows]
+
+    def fetch(self, token: str, now: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        return None
+
+    def save(self, token: str, user: Dict[str, Any], expires_at: float) -> None:
+        pass
+
+    def touch(self, token: str, expires_at: float) -> None:
+        pass
+
+    def delete(self, token: str) -> None:
+        pass
+
+    def purge(self, now: float) -> None:
+        pass
+
+    def flush(self, rows: Iterable[SessionRow]) -> None:
+        """Write the snapshot atomically; it holds live tokens, so owner-only."""
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump([{"token": t, "user": u, "expires_at": e} for t, u, e in rows], f)
+        os.replace(tmp, self.path)
+
+
+class _Session:
+    __slots__ = ("user", "expires_at", "persisted_until", "checked_at")
+
+    def __init__(self, user: Dict[str, Any], expires_at: float, checked_at: float = 0.0) -> None:
+        self.user = user
+        self.expires_at = expires_at
+        self.persisted_until = expires_at
+        self.checked_at = checked_at
+
+
+class _Shard:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, _Session]" = OrderedDict()
+
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL_DEFAULT, max_sessions: int = SESSIONS_MAX_DEFAULT,
+                 backend: Any = None, reap_interval: float = REAP_INTERVAL, shards: int = SHARDS,
+                 revalidate: float = 0.0) -> None:
+        self.ttl = ttl
+        self.backend = backend
+        self.revalidate = revalidate
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_cap = max(1, max_sessions // shards)
+        self.counters = Counters()
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        if backend is not None:
+            now = time.time()
+            for token, user, expires_at in backend.load():
+                if expires_at > now:
+                    self._put(token, _Session(user, expires_at))
+        if reap_interval > 0:
+            self._reaper = threading.Thread(
+                target=self._run_reaper, args=(reap_interval,), name="session-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _shard(self, token: str) -> _Shard:
+        return self._shards[hash(token) % len(self._shards)]
+
+    def _put(self, token: str, session: _Session) -> None:
+        shard = self._shard(token)
+        with shard.lock:
+            shard.entries[token] = session
+            shard.entries.move_to_end(token)
+            while len(shard.entries) > self._shard_cap:
+                shard.entries.popitem(last=False)
+                self.counters.incr("evicted")
+
+    def create(self, user: Dict[str, Any]) -> str:
+        token = uuid.uuid4().hex
+        now = time.time()
+        expires_at = now + self.ttl
+        if self.backend is not None:
+            self.backend.save(token, user, expires_at)
+        self._put(token, _Session(user, expires_at, now))
+        return token
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        shard = self._shard(token)
+        with shard.lock:
+            session = shard.entries.get(token)
+            if session is not None:
+                if session.expires_at <= now:
+                    del shard.entries[token]
+                    self.counters.incr("expired")
+                    return None
+                if self.revalidate and now - session.checked_at >= self.revalidate:
+                    del shard.entries[token]
+                    session = None
+            if session is not None:
+                session.expires_at = now + self.ttl
+                shard.entries.move_to_end(token)
+                touch = session.expires_at - session.persisted_until >= self.ttl * TOUCH_FRACTION
+                if touch:
+                    session.persisted_until = session.expires_at
+                user = session.user
+        if session is not None:
+            if touch and self.backend is not None:
+                self.backend.touch(token, now + self.ttl)
+            return user
+        found = self.backend.fetch(token, now) if self.backend is not None else None
+        if found is None:
+            return None
+        user, expires_at = found
+        self._put(token, _Session(user, expires_at, now))
+        return user
+
+    def known(self, token: str) -> bool:
+        """A live session held in memory: no backend read and no renewal, cheap enough for any thread."""
+        shard = self._shard(token)
+        with shard.lock:
+            session = shard.entries.get(token)
+            return session is not None and session.expires_at > time.time()
+
+    def delete(self, token: str) -> None:
+        shard = self._shard(token)
+        with shard.lock:
+            shard.entries.pop(token, None)
+        if self.backend is not None:
+            self.backend.delete(token)
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def _rows(self) -> Iterator[SessionRow]:
+        for shard in self._shards:
+            with shard.lock:
+                rows = [(t, s.user, s.expires_at) for t, s in shard.entries.items()]
+            yield from rows
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Drop expired sessions; returns how many were dropped from memory."""
+        now = time.time() if now is None else now
+        dropped = 0
+        for shard in self._shards:
+            with shard.lock:
+                expired: List[str] = [t for t, s in shard.entries.items() if s.expires_at <= now]
+                for token in expired:
+                    del shard.entries[token]
+            dropped += len(expired)
+        if dropped:
+            self.counters.incr("expired", dropped)
+        if self.backend is not None:
+            self.backend.purge(now)
+            self.backend.flush(self._rows())
+        return dropped
+
+    def _run_reaper(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.reap()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+        if self.backend is not None:
+            self.backend.flush(self._rows())
@@ -0,0 +1,125 @@
+"""
+Multi-process server (`--workers N`).
+
+One Python process runs handler code and JSON on one core at a time, so
+`--workers` forks N server processes that accept on the same port: either
+all from one listening socket inherited from the supervisor, or (with
+`--reuseport`) each from its own SO_REUSEPORT socket, letting the kernel
+spread new connections across them.
+
+Every worker opens its own SQLite connections (WAL) on the same database,
+so seat safety rests on the booking transactions alone, as it does between
+threads. What used to be process-local is adjusted:
+
+  seat map          off: its in-memory seat state would diverge per process
+  catalogue cache   re-checks the catalogue version row on every lookup (`shared_db`)
+  sessions          read through the sessions table, re-checked every few seconds
+  --metrics-port    worker i serves metrics on port + i
+
+The supervisor only forks and waits. A worker that exits is started again;
+one that dies right after starting is restarted with a growing delay so a
+broken configuration does not spin.
+"""
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Any, Dict, Optional, Tuple
+
+from .db import connect, init_db
+from .main import listen_socket, run_server
+
+RESTART_WINDOW = 1.0
+RESTART_DELAY_MAX = 5.0
+
+
+def _serve_worker(index: int, sock: Optional[socket.socket], host: str, port: int, db_path: str, engine: str,
+                  options: Dict[str, Any], reuseport: bool) -> None:
+    options = dict(options, use_seatmap=False, shared_db=True)
+    if options.get("metrics_port") is not None:
+        options["metrics_port"] += index
+    if options.get("hash_workers") is None:
+        options["hash_workers"] = 1  # N workers already spread hashing over N cores
+    if reuseport:
+        sock = listen_socket(host, port, reuseport=True)
+    if engine == "asyncio":
+        from .aio import run_asyncio_server
+
+        run_asyncio_server(host, port, db_path, sock=sock, **options)
+    else:
+        run_server(host, port, db_path, sock=sock, **options)
+
+
+def run_workers(workers: int, host: str, port: int, db_path: str, engine: str = "threaded",
+                options: Optional[Dict[str, Any]] = None, reuseport: bool = False) -> None:
+    options = dict(options or {})
+    if options.get("use_seatmap", True):
+        print("[SERVER] --workers: in-memory seat map disabled, seats are served from SQLite")
+
+    # Migrate once, before any worker exists; nothing may keep a connection across fork.
+    conn = connect(db_path)
+    init_db(conn)
+    conn.close()
+
+    # With --reuseport this socket only reserves the port (never listens, gets no connections).
+    sock = listen_socket(host, port, reuseport=reuseport, listen=not reuseport)
+    port = sock.getsockname()[1]
+    children: Dict[int, Tuple[int, float]] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor decides when to stop
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                _serve_worker(index, None if reuseport else sock, host, port, db_path, engine, options, reuseport)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"[SERVER] Supervisor pid={os.getpid()}: {workers} {engine} workers on {host}:{port} (db={db_path})")
+    sys.stdout.flush()
+    for index in range(workers):
+        spawn(index)
+
+    delay = 0.0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (-1, 0.0))
+        if stopping or index < 0:
+            continue
+        print(f"[SERVER] Worker {index} (pid={pid}) exited with {os.waitstatus_to_exitcode(status)}; restarting")
+        sys.stdout.flush()
+        if time.monotonic() - started < RESTART_WINDOW:
+            delay = min(RESTART_DELAY_MAX, delay * 2 or 0.1)
+            time.sleep(delay)
+        else:
+            delay = 0.0
+        if not stopping:
+            spawn(index)
+    sock.close()
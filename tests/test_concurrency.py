@@ -1 +1,175 @@
+import threading
 
+from server import db
+
+
+def _setup(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "cinema.db"))
+    conn = pool.get()
+    db.init_db(conn)
+    movie_id = db.add_movie(conn, "M", "", 90)
+    showtime_id = db.add_showtime(conn, movie_id, "2026-01-01T19:00:00", "P1", 50000)
+    return pool, showtime_id
+
+
+def test_pool_connections_use_wal(tmp_path):
+    pool, _ = _setup(tmp_path)
+    assert pool.get().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_pool_gives_each_thread_its_own_connection(tmp_path):
+    pool, _ = _setup(tmp_path)
+    seen = []
+    t = threading.Thread(target=lambda: seen.append(pool.get()))
+    t.start()
+    t.join()
+    assert seen[0] is not pool.get()
+    assert len(pool) == 2
+    pool.close_all()
+
+
+def test_failed_write_does_not_keep_the_write_lock(tmp_path):
+    pool, showtime_id = _setup(tmp_path)
+    conn = pool.get()
+    assert db.create_user(conn, "u", "p")[0]
+    assert db.create_user(conn, "u", "p") == (False, "Username already exists")
+    assert not conn.in_transaction
+    other = db.connect(pool.db_path)
+    other.execute("PRAGMA busy_timeout = 100")
+    assert db.book_seat(other, 1, showtime_id, "A1")[0]
+    other.close()
+
+
+def test_concurrent_bookings_of_same_seat_book_once(tmp_path):
+    pool, showtime_id = _setup(tmp_path)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def worker(user_id):
+        conn = pool.get()
+        barrier.wait()
+        results.append(db.book_seat(conn, user_id, showtime_id, "A1")[0])
+        pool.release()
+
+    threads = [threading.Thread(target=worker, args=(1,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 1
+
+
+def test_seatmap_never_double_books_and_persists(tmp_path):
+    from server.seatmap import SeatMap
+
+    pool, showtime_id = _setup(tmp_path)
+    seatmap = SeatMap(pool.db_path)
+    seatmap.load(pool.get())
+    results = []
+    barrier = threading.Barrier(16)
+
+    def worker(user_id, seat):
+        barrier.wait()
+        results.append(seatmap.book(pool.get(), user_id, showtime_id, seat))
+
+    threads = [threading.Thread(target=worker, args=(1, "A1" if i % 2 else "B2")) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r[0] for r in results].count(True) == 2
+    seatmap.close()
+
+    # A fresh engine rebuilt from SQLite sees exactly what was committed.
+    rebuilt = SeatMap(pool.db_path)
+    rebuilt.load(pool.get())
+    seats = {s["seat_code"]: s["status"] for s in rebuilt.get_seats(pool.get(), showtime_id)["seats"]}
+    assert seats == {s["seat_code"]: s["status"] for s in db.get_seats(pool.get(), showtime_id)}
+    assert seats["A1"] == seats["B2"] == "booked"
+    rebuilt.close()
+
+
+def test_seatmap_writer_failure_fails_writes_instead_of_hanging(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from server.seatmap import SeatMap
+
+    pool, showtime_id = _setup(tmp_path)
+    (tmp_path / "not-a-dir").write_text("")
+    seatmap = SeatMap(str(tmp_path / "not-a-dir" / "cinema.db"))  # the writer cannot open its connection
+    seatmap.load(pool.get())
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        ok, m, _ = ex.submit(seatmap.book, pool.get(), 1, showtime_id, "A1").result(timeout=5)
+    assert not ok and m.startswith("Booking failed: seat writer stopped")
+    # The claim was undone and later writes fail the same way.
+    assert {s["seat_code"]: s["status"] for s in seatmap.get_seats(pool.get(), showtime_id)["seats"]}["A1"] == "available"
+    assert seatmap.book(pool.get(), 1, showtime_id, "A2")[1].startswith("Booking failed")
+    seatmap.close()
+
+
+def test_admission_buckets_and_bounded_queue():
+    import json
+
+    from server.admission import SERVER_BUSY, Admission, Limits
+
+    now = [0.0]
+    adm = Admission(Limits(ip_rate=2, ip_burst=3, token_rate=1, queue_max=2, queue_wait=0.05),
+                    slots=1, clock=lambda: now[0], is_session=lambda token: token == "t")
+    addr = ("10.0.0.1", 5000)
+    assert [adm.check(addr, {"action": "ping"}) for _ in range(3)] == [None] * 3
+    busy = json.loads(adm.check(addr, {"action": "ping"}))
+    assert busy["error"] == SERVER_BUSY and busy["data"]["retry_after"] == 0.5
+    assert adm.check(("10.0.0.2", 1), {"action": "ping"}) is None  # other IPs have their own bucket
+    now[0] += 0.5
+    assert adm.check(addr, {"data": {"token": "t"}}) is None
+    assert adm.check(("10.0.0.3", 1), {"data": {"token": "t"}}) is not None  # same token, another IP
+    # Made-up tokens share one bucket per IP: a fresh one per request is limited all the same.
+    assert adm.check(("10.0.0.4", 1), {"data": {"token": "fake0"}}) is None
+    assert adm.check(("10.0.0.4", 1), {"data": {"token": "fake1"}}) is not None
+    assert len(adm.by_token) == 2
+
+    # One slot: the holder runs, one request waits, the next is shed at once.
+    started, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=adm.run, args=(adm.enter(), lambda: started.set() or release.wait(5) and "done"))
+    holder.start()
+    started.wait(5)
+    waiting, queued = adm.enter(), adm.enter()
+    assert queued is not None and adm.enter() is None
+    # queue_wait runs out while the slot is taken: shed instead of run.
+    assert json.loads(adm.run(waiting, lambda: "ran"))["error"] == SERVER_BUSY
+    release.set()
+    holder.join(5)
+    assert adm.run(queued, lambda: "ran") == "ran"
+    assert adm.stats() == {
+        "connections_rejected_total": 0, "rate_limited_total": 3, "requests_shed_total": 2, "requests_queued": 0,
+    }
+
+
+def test_connection_threads_do_not_keep_metric_shards(tmp_path):
+    import socket
+    from concurrent.futures import ThreadPoolExecutor
+
+    from server.handlers import ServerContext, SessionStore
+    from server.main import client_thread
+    from server.metrics import Metrics
+
+    pool = db.ConnectionPool(str(tmp_path / "cinema.db"))
+    db.init_db(pool.get())
+    ctx = ServerContext(metrics=Metrics())
+    sessions = SessionStore()
+    with ThreadPoolExecutor(max_workers=2) as pipeline:
+        for i in range(200):
+            client, server = socket.socketpair()
+            t = threading.Thread(target=client_thread, args=(server, ("127.0.0.1", i), pool, sessions, ctx, pipeline))
+            t.start()
+            with client, client.makefile("rwb") as f:
+                f.write(b'{"action": "ping", "data": {}}\n')
+                f.flush()
+                assert f.readline()
+            t.join(5)
+
+    counts = ctx.metrics.counters.values()
+    assert counts["connections_opened"] == counts["connections_closed"] == 200
+    assert ctx.metrics.snapshot()["ping"]["count"] == 200
+    # One thread per connection, but only live threads keep a shard.
+    assert len(ctx.metrics.counters._shards) < 5 and len(ctx.metrics._shards) < 5
@@ -0,0 +1,188 @@
+import datetime as dt
+import sqlite3
+
+from server import db
+
+
+def _legacy_db(path):
+    """A cinema.db as created before schema versioning (step 1 tables, no schema_version)."""
+    conn = sqlite3.connect(path)
+    conn.executescript(db.MIGRATIONS[0][2])
+    conn.execute("INSERT INTO users(username, password_hash, role) VALUES('u', 'x', 'user')")
+    conn.execute("INSERT INTO movies(title) VALUES('Mo')")
+    conn.execute("INSERT INTO showtimes(movie_id, start_time, hall, price) VALUES(1, '2026-01-01T19:00:00', 'P1', 1)")
+    conn.execute(
+        "INSERT INTO tickets(user_id, showtime_id, seat_code, created_at, status) VALUES(1, 1, 'A1', 'now', 'cancelled')"
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_upgrades_legacy_db_and_is_idempotent(tmp_path):
+    path = str(tmp_path / "cinema.db")
+    _legacy_db(path)
+    conn = db.connect(path)
+    db.init_db(conn)
+    assert db.schema_version(conn) == db.SCHEMA_VERSION
+    assert db.migrate(conn) == db.SCHEMA_VERSION
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == 1
+
+    # The cancelled A1 ticket survived the tickets rebuild and no longer blocks the seat.
+    assert conn.execute("SELECT status FROM tickets WHERE id=1").fetchone()[0] == "cancelled"
+    ok, _, ticket_id = db.book_seat(conn, 1, 1, "A1")
+    assert ok and ticket_id == 2
+    assert db.cancel_ticket(conn, 1, ticket_id)[0]
+    assert db.book_seat(conn, 1, 1, "A1")[0]
+    assert [m["title"] for m in db.search_movies(conn, "mo", 10)] == ["Mo"]  # search index backfilled
+    conn.close()
+
+
+def test_versions_follow_writes_and_survive_restart(tmp_path):
+    import time
+
+    from server.seatmap import SeatMap
+
+    path = str(tmp_path / "cinema.db")
+    conn = db.connect(path)
+    db.init_db(conn)
+    catalogue = db.catalogue_version(conn)
+    movie_id = db.add_movie(conn, "M", "", 90)
+    showtime_id = db.add_showtime(conn, movie_id, "2026-01-01T19:00:00", "P1", 1)
+    assert db.catalogue_version(conn) == catalogue + 2
+    version, settled = db.showtime_version(conn, showtime_id)
+    ok, _, ticket_id = db.book_seat(conn, 1, showtime_id, "A1")
+    assert db.showtime_version(conn, showtime_id)[0] > version and settled
+    assert db.catalogue_version(conn) == catalogue + 2
+    assert db.showtime_version(conn, showtime_id + 1) is None
+
+    # A lapsed hold changes the seat view before its row is gone.
+    db.hold_seats(conn, 1, showtime_id, ["B1"], 0.01)
+    time.sleep(0.05)
+    version, settled = db.showtime_version(conn, showtime_id)
+    assert not settled
+    hold_id = db.list_holds(conn)[0][0]
+    db.expire_hold(conn, hold_id)
+    assert db.showtime_version(conn, showtime_id) == (version + 1, True)
+
+    # A restarted seat map never hands out a version it used before.
+    seatmap = SeatMap(path)
+    seatmap.load(conn)
+    before = seatmap.get_seats(conn, showtime_id)["version"]
+    assert seatmap.cancel(1, ticket_id)[0]
+    last = seatmap.get_seats(conn, showtime_id)["version"]
+    seatmap.close()
+    seatmap = SeatMap(path)
+    seatmap.load(conn)
+    assert seatmap.get_seats(conn, showtime_id)["version"] > last > before
+    seatmap.close()
+    conn.close()
+
+
+def test_hot_queries_never_full_scan(tmp_path):
+    conn = db.connect(str(tmp_path / "cinema.db"))
+    db.init_db(conn)
+    movie_id = db.add_movie(conn, "M", "", 90)
+    showtime_id = db.add_showtime(conn, movie_id, "2026-01-01T19:00:00", "P1", 1)
+    db.create_user(conn, "u", "p")
+    user = db.authenticate(conn, "u", "p")
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    db.authenticate(conn, "u", "p")
+    db.list_showtimes(conn, movie_id)
+    db.list_showtimes(conn, movie_id, limit=2, after_start_time="2026-01-01T19:00:00", after_id=showtime_id)
+    db.list_movies(conn, limit=2, after_id=movie_id, fields=["title"])
+    db.get_showtime(conn, showtime_id)
+    db.get_seats(conn, showtime_id)
+    db.showtime_version(conn, showtime_id)
+    db.seat_changes(conn, showtime_id, 1)
+    db.get_seat_holds(conn, showtime_id)
+    db.my_tickets(conn, user["id"])
+    db.my_tickets(conn, user["id"], limit=2, after_id=10)
+    db.search_movies(conn, "mo", 10, showing_after="2026-01-01T00:00:00")
+    ok, _, hold = db.hold_seats(conn, user["id"], showtime_id, ["B1"], 60)
+    db.confirm_hold(conn, user["id"], hold["hold_id"])
+    ok, _, ticket_id = db.book_seat(conn, user["id"], showtime_id, "A1")
+    db.cancel_ticket(conn, user["id"], ticket_id)
+    conn.set_trace_callback(None)
+
+    queries = [s for s in statements if s.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+    assert len(queries) > 10
+    for sql in queries:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        # SCAN f: search_movies' ranked subquery, already cut to `limit` rows.
+        scans = [d for d in plan if d.startswith("SCAN") and "INDEX" not in d and d != "SCAN f"]
+        assert not scans, (sql, plan)
+        if "WHERE s.movie_id" in sql or "WHERE t.user_id" in sql:
+            assert not any("TEMP B-TREE" in d for d in plan), plan
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + next(q for q in queries if "s.movie_id" in q))]
+    assert any(d.startswith("SEARCH s USING COVERING INDEX idx_showtimes_movie_start (movie_id=?") for d in plan), plan
+    conn.close()
+
+
+def test_search_movies_ranks_short_prefixes_before_joining(tmp_path):
+    conn = db.connect(str(tmp_path / "cinema.db"))
+    db.init_db(conn)
+    db.add_movie(conn, "Star", "", 90)
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert db.search_movies(conn, "s", 10) == []  # one letter: no prefix index, nothing run
+    assert not statements
+    assert [m["title"] for m in db.search_movies(conn, "st a", 10)] == ["Star"]
+    db.search_movies(conn, "st", 10, showing_after="2026-01-01T00:00:00")
+    conn.set_trace_callback(None)
+
+    assert db.fts_query("st a") == '"st"*'
+    for sql in [s for s in statements if s.startswith("SELECT")]:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        # movies_fts is ranked and cut to `limit` on its own; only those rows reach movies.
+        assert plan[0] == "MATERIALIZE f" and plan[1].startswith("SCAN movies_fts VIRTUAL TABLE"), plan
+        assert "SEARCH m USING INTEGER PRIMARY KEY (rowid=?)" in plan, plan
+        assert not any(d.startswith("SCAN showtimes") for d in plan), plan
+    conn.close()
+
+
+def test_seed_scale_is_deterministic_and_consistent(tmp_path):
+    from scripts.seed_demo import seed_scale
+
+    reports, dumps = [], []
+    for name in ("a.db", "b.db"):
+        conn = db.connect(str(tmp_path / name))
+        db.init_db(conn)
+        reports.append(seed_scale(conn, movies=30, halls=2, days=1, users=40, booked=0.4, seed=7,
+                                  start_date=dt.date(2026, 3, 1)))
+        titles = [r["title"] for r in conn.execute("SELECT title FROM movies ORDER BY id")]
+        booked = conn.execute("SELECT COUNT(*) FROM seats WHERE status='booked'").fetchone()[0]
+        active = conn.execute("SELECT COUNT(*) FROM tickets WHERE status='active'").fetchone()[0]
+        dumps.append((
+            titles,
+            [tuple(r) for r in conn.execute("SELECT movie_id, start_time, hall, price FROM showtimes ORDER BY id")],
+            [tuple(r) for r in conn.execute(
+                "SELECT user_id, showtime_id, seat_code, created_at, status FROM tickets ORDER BY id"
+            )],
+        ))
+        conn.close()
+    a, b = reports
+    assert a["rows"] == b["rows"] and a["rows"]["showtimes"] == 2 * 6
+    assert dumps[0] == dumps[1] and dumps[0][1][0][1].startswith("2026-03-01T")
+    assert booked == active == a["rows"]["booked_seats"] > 0
+    assert len(titles) == 30 and a["db_bytes"] > 0 and "my_tickets_heaviest_user" in a["probe_ms"]
+
+    # A second run on the same database: a deleted movie leaves the next id past MAX(id)+1.
+    conn = db.connect(str(tmp_path / "b.db"))
+    conn.execute("DELETE FROM movies WHERE id = ?", (db.add_movie(conn, "Gone", "", 90),))
+    conn.commit()
+    c = seed_scale(conn, movies=30, halls=2, days=1, users=40, booked=0.4, seed=7, start_date=dt.date(2026, 3, 1))
+    assert conn.execute("SELECT COUNT(*) FROM seat_changes").fetchone()[0] == 0  # bulk booking writes no history
+    versions = conn.execute("SELECT version FROM showtimes s WHERE id > 12 AND EXISTS "
+                            "(SELECT 1 FROM seats WHERE showtime_id = s.id AND status = 'booked')").fetchall()
+    assert {r[0] for r in versions} == {2}  # one bump from 1 per showtime
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'showtime_version_seat'").fetchone()[0] == 1
+    assert c["username_prefix"] != a["username_prefix"]
+    assert conn.execute("SELECT MIN(movie_id) FROM showtimes WHERE id > 12").fetchone()[0] == 32
+    assert conn.execute(
+        "SELECT COUNT(*) FROM tickets t JOIN seats s ON s.showtime_id = t.showtime_id AND s.seat_code = t.seat_code "
+        "WHERE t.status = 'active' AND (s.booked_by IS NOT t.user_id OR s.booked_at IS NOT t.created_at)"
+    ).fetchone()[0] == 0
+    conn.close()
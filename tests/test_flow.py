@@ -1 +1,327 @@
+import hashlib
+import json
 
+import pytest
+
+from server import db, passwords
+from server.cache import CatalogueCache
+from server.holds import HoldExpiry
+from server.handlers import ServerContext, SessionStore, handle
+from server.metrics import Metrics
+from server.seatmap import SeatMap
+
+
+@pytest.fixture(params=["sqlite", "seatmap"])
+def env(request, tmp_path):
+    conn = db.connect(str(tmp_path / "cinema.db"))
+    db.init_db(conn)
+    ctx = ServerContext(metrics=Metrics())
+    if request.param == "seatmap":
+        ctx.cache = CatalogueCache()
+        ctx.seatmap = SeatMap(str(tmp_path / "cinema.db"))
+        ctx.seatmap.load(conn)
+        ctx.holds = HoldExpiry(ctx.seatmap.expire_hold)
+    else:
+        reaper_conn = db.connect(str(tmp_path / "cinema.db"))
+        ctx.holds = HoldExpiry(lambda hold_id: db.expire_hold(reaper_conn, hold_id))
+    sessions = SessionStore()
+
+    def call(action, **data):
+        return json.loads(handle(conn, sessions, {"action": action, "data": data}, ctx))
+
+    admin = call("login", username="admin", password="admin123")["data"]["token"]
+    movie_id = call("admin_add_movie", token=admin, title="M", duration_min=90)["data"]["movie_id"]
+    showtime_id = call(
+        "admin_add_showtime", token=admin, movie_id=movie_id, start_time="2026-01-01T19:00:00", hall="P1", price=50000
+    )["data"]["showtime_id"]
+    call("register", username="u", password="p")
+    token = call("login", username="u", password="p")["data"]["token"]
+    call.admin = admin
+    call.ctx = ctx
+    call.conn = conn
+    yield call, token, showtime_id
+    ctx.holds.close()
+    if ctx.seatmap is not None:
+        ctx.seatmap.close()
+    conn.close()
+
+
+def _status(call, token, showtime_id):
+    seats = call("get_seats", token=token, showtime_id=showtime_id)["data"]["seats"]
+    return {s["seat_code"]: s["status"] for s in seats}
+
+
+def test_book_many_is_atomic(env):
+    call, token, showtime_id = env
+    resp = call("book_many", token=token, showtime_id=showtime_id, seat_codes=["a1", "A2", "A3"])
+    assert resp["ok"] and len(resp["data"]["ticket_ids"]) == 3
+
+    resp = call("book_many", token=token, showtime_id=showtime_id, seat_codes=["B1", "A2"])
+    assert not resp["ok"] and "A2" in resp["error"]
+    status = _status(call, token, showtime_id)
+    assert status["B1"] == "available"
+    assert [status[c] for c in ("A1", "A2", "A3")] == ["booked"] * 3
+    assert len(call("my_tickets", token=token)["data"]["tickets"]) == 3
+
+
+def test_cancelled_seat_can_be_booked_again(env):
+    call, token, showtime_id = env
+    ticket_id = call("book", token=token, showtime_id=showtime_id, seat_code="B2")["data"]["ticket_id"]
+    assert call("cancel", token=token, ticket_id=ticket_id)["ok"]
+    assert call("book", token=call.admin, showtime_id=showtime_id, seat_code="B2")["ok"]
+    assert _status(call, token, showtime_id)["B2"] == "booked"
+
+
+def test_get_seats_compact_matches_full_list(env):
+    from common.seats import decode_compact
+
+    call, token, showtime_id = env
+    call("book", token=token, showtime_id=showtime_id, seat_code="C4")
+    data = call("get_seats", token=token, showtime_id=showtime_id, format="compact")["data"]
+    assert data["rows"] == list("ABCDE") and data["cols"] == 8
+    assert {s["seat_code"]: s["status"] for s in decode_compact(data)} == _status(call, token, showtime_id)
+
+
+def test_catalogue_reads_see_admin_writes(env):
+    call, token, showtime_id = env
+    movie_id = call("list_movies", token=token)["data"]["movies"][0]["id"]
+    assert len(call("list_showtimes", token=token, movie_id=movie_id)["data"]["showtimes"]) == 1
+    call(
+        "admin_add_showtime", token=call.admin, movie_id=movie_id, start_time="2026-01-02T19:00:00", hall="P2", price=1
+    )
+    call("admin_add_movie", token=call.admin, title="N")
+    assert len(call("list_showtimes", token=token, movie_id=movie_id)["data"]["showtimes"]) == 2
+    assert [m["title"] for m in call("list_movies", token=token)["data"]["movies"]] == ["N", "M"]
+    if call.ctx.cache is not None:
+        call("list_movies", token=token)
+        assert call.ctx.cache.hits >= 1
+
+
+def test_if_version_reads_reply_not_modified_until_a_write(env):
+    call, token, showtime_id = env
+    movies = call("list_movies", token=token)["data"]
+    movie_id = movies["movies"][0]["id"]
+    showtimes = call("list_showtimes", token=token, movie_id=movie_id)["data"]
+    seats = call("get_seats", token=token, showtime_id=showtime_id, format="compact")["data"]
+    assert movies["version"] == showtimes["version"]
+
+    def current(action, version, **data):
+        return call(action, token=token, if_version=version, **data)["data"] == {"not_modified": True, "version": version}
+
+    assert current("list_movies", movies["version"]) and current("list_movies", movies["version"], limit=1)
+    assert current("list_showtimes", showtimes["version"], movie_id=movie_id)
+    assert current("get_seats", seats["version"], showtime_id=showtime_id)
+    assert call("get_seats", token=token, showtime_id=showtime_id, if_version="x")["error"] == "if_version must be int"
+
+    ticket_id = call("book", token=token, showtime_id=showtime_id, seat_code="A1")["data"]["ticket_id"]
+    assert not current("get_seats", seats["version"], showtime_id=showtime_id)
+    after_book = call("get_seats", token=token, showtime_id=showtime_id, if_version=seats["version"])["data"]
+    assert after_book["version"] > seats["version"] and "not_modified" not in after_book
+    assert current("list_movies", movies["version"])  # seats are not part of the catalogue
+    call("cancel", token=token, ticket_id=ticket_id)
+    assert not current("get_seats", after_book["version"], showtime_id=showtime_id)
+
+    call("admin_add_movie", token=call.admin, title="N")
+    resp = call("list_movies", token=token, if_version=movies["version"])["data"]
+    assert resp["version"] > movies["version"] and [m["title"] for m in resp["movies"]] == ["N", "M"]
+    assert not current("list_showtimes", showtimes["version"], movie_id=movie_id)
+    assert call.ctx.metrics.counters.value("not_modified") == 5
+
+
+def test_get_seats_since_version_returns_changes_or_full_map(env):
+    call, token, showtime_id = env
+    start = call("get_seats", token=token, showtime_id=showtime_id)["data"]["version"]
+    ticket_id = call("book", token=token, showtime_id=showtime_id, seat_code="A1")["data"]["ticket_id"]
+    call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["B1", "B2"])
+    call("book", token=token, showtime_id=showtime_id, seat_code="C1")
+    call("cancel", token=token, ticket_id=ticket_id)
+
+    delta = call("get_seats", token=token, showtime_id=showtime_id, since_version=start)["data"]
+    assert delta["since_version"] == start and "seats" not in delta
+    changes = {ch["seat_code"]: ch["status"] for ch in delta["changes"]}
+    assert changes == {"A1": "available", "B1": "held", "B2": "held", "C1": "booked"}
+    status = _status(call, token, showtime_id)
+    assert {code: status[code] for code in changes} == changes
+    same = call("get_seats", token=token, showtime_id=showtime_id, since_version=delta["version"])["data"]
+    assert same == {"changes": [], "since_version": delta["version"], "version": delta["version"]}
+
+    # Past the log's reach (or an unknown version) the whole map comes back.
+    for _ in range(db.SEAT_LOG_MAX // 2 + 1):
+        ticket_id = call("book", token=token, showtime_id=showtime_id, seat_code="D1")["data"]["ticket_id"]
+        call("cancel", token=token, ticket_id=ticket_id)
+    for since in (delta["version"], -5):
+        full = call("get_seats", token=token, showtime_id=showtime_id, since_version=since, format="compact")["data"]
+        assert "changes" not in full and full["cols"] == 8 and full["version"] > delta["version"]
+
+
+def test_hold_confirm_release_and_expiry(env):
+    import time
+
+    call, token, showtime_id = env
+    call("register", username="v", password="p")
+    other = call("login", username="v", password="p")["data"]["token"]
+
+    hold = call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["D1", "D2"])["data"]
+    assert _status(call, token, showtime_id)["D1"] == "held"
+    assert call("book", token=other, showtime_id=showtime_id, seat_code="D1")["error"] == "Seat is held"
+    assert not call("confirm_hold", token=other, hold_id=hold["hold_id"])["ok"]
+    resp = call("confirm_hold", token=token, hold_id=hold["hold_id"])
+    assert resp["ok"] and len(resp["data"]["ticket_ids"]) == 2
+    assert _status(call, token, showtime_id)["D2"] == "booked"
+
+    hold = call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["E1"])["data"]
+    assert call("release_hold", token=token, hold_id=hold["hold_id"])["ok"]
+    assert _status(call, token, showtime_id)["E1"] == "available"
+
+    bad = call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["E2"], ttl="soon")
+    assert bad["error"] == "ttl must be int" and _status(call, token, showtime_id)["E2"] == "available"
+    call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["E2"], ttl=1)
+    time.sleep(1.3)
+    assert _status(call, token, showtime_id)["E2"] == "available"
+    assert call("book", token=other, showtime_id=showtime_id, seat_code="E2")["ok"]
+
+
+def test_hold_expired_while_down_is_deleted_after_restart(env):
+    import time
+
+    call, token, showtime_id = env
+    conn, ctx = call.conn, call.ctx
+    hold = call("hold_seats", token=token, showtime_id=showtime_id, seat_codes=["E3"], ttl=1)["data"]
+    ctx.holds.close()  # "shut down" before the expiry fires
+    time.sleep(1.1)
+
+    # Restart as build_context does: every stored hold is scheduled again.
+    path = conn.execute("PRAGMA database_list").fetchone()["file"]
+    if ctx.seatmap is not None:
+        ctx.seatmap.close()
+        ctx.seatmap = SeatMap(path)
+        ctx.seatmap.load(conn)
+        ctx.holds = HoldExpiry(ctx.seatmap.expire_hold)
+    else:
+        ctx.holds = HoldExpiry(lambda hold_id: db.expire_hold(db.connect(path), hold_id))
+    assert db.list_holds(conn) == [(hold["hold_id"], hold["expires_at"])]
+    for hold_id, expires_at in db.list_holds(conn):
+        ctx.holds.schedule(hold_id, expires_at)
+    deadline = time.monotonic() + 5
+    while db.list_holds(conn) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert db.list_holds(conn) == []
+    assert db.showtime_version(conn, showtime_id)[1]  # settled
+    assert _status(call, token, showtime_id)["E3"] == "available"
+
+
+def test_dispatch_checks_and_metrics(env):
+    call, token, showtime_id = env
+    assert call("nope", token=token)["error"] == "Unknown action: nope"
+    assert call("get_seats", showtime_id=showtime_id)["error"] == "Missing token"
+    assert call("get_seats", token=token)["error"] == "showtime_id required"
+    assert call("get_seats", token=token, showtime_id="x")["error"] == "showtime_id must be int"
+    assert call("admin_add_movie", token=token, title="T")["error"] == "Admin only"
+
+    stats = call.ctx.metrics.snapshot()
+    seats = stats["get_seats"]
+    assert seats["count"] == 3 and seats["errors"] == 3
+    assert stats["login"]["count"] >= 2 and stats["login"]["errors"] == 0
+    assert set(seats) >= {"parse", "handle", "db", "serialize"}
+    assert stats["admin_add_showtime"]["handle"]["p99_us"] >= stats["admin_add_showtime"]["db"]["p50_us"] > 0
+
+    call("book", token=token, showtime_id=showtime_id, seat_code="A1")
+    call("book", token=token, showtime_id=showtime_id, seat_code="A1")
+    assert call("server_stats", token=token)["error"] == "Admin only"
+    stats = call("server_stats", token=call.admin)["data"]
+    assert stats["booking_conflicts_total"] == 1 and stats["sessions"] == 2
+
+
+def test_hall_layout_shapes_new_showtimes(env):
+    call, token, showtime_id = env
+    layout = ["VV.VV", "SSSSS", "CC.CC"]
+    assert call("admin_add_hall", token=call.admin, name="IMAX", layout=["SX"])["error"].startswith("Unknown seat class")
+    assert call("admin_add_hall", token=call.admin, name="IMAX", layout=layout)["ok"]
+    assert call("admin_add_hall", token=call.admin, name="IMAX", layout=layout)["error"] == "Hall already exists"
+    halls = {h["name"]: h for h in call("list_halls", token=token)["data"]["halls"]}
+    assert halls["IMAX"]["layout"] == layout and halls["IMAX"]["seats"] == 13
+
+    movie_id = call("list_movies", token=token)["data"]["movies"][0]["id"]
+    sid = call(
+        "admin_add_showtime", token=call.admin, movie_id=movie_id, start_time="2026-01-03T19:00:00", hall="IMAX", price=1
+    )["data"]["showtime_id"]
+    data = call("get_seats", token=token, showtime_id=sid, format="compact")["data"]
+    assert (data["rows"], data["cols"], data["cells"]) == (["A", "B", "C"], 5, "2O1.9O1.2O")
+    assert call("book", token=token, showtime_id=sid, seat_code="A3")["error"] == "Seat not found"
+    assert call("book", token=token, showtime_id=sid, seat_code="C5")["ok"]
+    assert len(_status(call, token, showtime_id)) == 40
+
+
+def test_legacy_password_is_rehashed_on_login(env, tmp_path):
+    call, token, showtime_id = env
+    conn = db.connect(str(tmp_path / "cinema.db"))
+    with conn:
+        conn.execute("INSERT INTO users(username, password_hash, role) VALUES('old', ?, 'user')", (hashlib.sha256(b"pw").hexdigest(),))
+    assert call("login", username="old", password="nope")["error"] == "Invalid credentials"
+    assert call("login", username="old", password="pw")["ok"]
+    stored = conn.execute("SELECT password_hash FROM users WHERE username='old'").fetchone()[0]
+    assert stored.startswith("scrypt$") and passwords.verify_password("pw", stored)
+    assert call("login", username="old", password="pw")["ok"]
+
+    call.ctx.hasher = passwords.PasswordHasher(workers=1, max_pending=0)
+    assert call("login", username="old", password="pw")["error"] == "Server busy, retry later"
+    assert call("server_stats", token=call.admin)["data"]["password_hash_rejected_total"] == 1
+    call.ctx.hasher.close()
+    conn.close()
+
+
+def test_keyset_pages_and_field_projection(env):
+    call, token, showtime_id = env
+    movie_id = call("list_movies", token=token)["data"]["movies"][0]["id"]
+    for title in ("N", "O", "P"):
+        call("admin_add_movie", token=call.admin, title=title, description="long text", duration_min=90)
+    for hall in ("P2", "P3"):  # same start_time as the first showtime: id breaks the tie
+        call("admin_add_showtime", token=call.admin, movie_id=movie_id, start_time="2026-01-01T19:00:00", hall=hall,
+             price=1)
+
+    def pages(action, **data):
+        out, cursor = [], {}
+        while True:
+            page = call(action, token=token, limit=2, **data, **cursor)["data"]
+            out.append(page)
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return out
+
+    movies = pages("list_movies", fields=["title"])
+    assert [[m["title"] for m in p["movies"]] for p in movies] == [["P", "O"], ["N", "M"]]
+    assert movies[0]["movies"][0].keys() == {"id", "title"}
+    assert movies[0]["next_cursor"] == {"after_id": movies[0]["movies"][-1]["id"]}
+    showtimes = pages("list_showtimes", movie_id=movie_id)
+    assert [s["hall"] for p in showtimes for s in p["showtimes"]] == ["P1", "P2", "P3"]
+    assert call("list_movies", token=token)["data"]["next_cursor"] is None
+
+    for seat in ("A1", "A2", "A3"):
+        call("book", token=token, showtime_id=showtime_id, seat_code=seat)
+    tickets = pages("my_tickets", fields=["seat_code"])
+    assert [t["seat_code"] for p in tickets for t in p["tickets"]] == ["A3", "A2", "A1"]
+
+    assert call("list_movies", token=token, limit=0)["error"] == "limit must be 1..200"
+    assert call("list_movies", token=token, fields=["password_hash"])["error"] == "Unknown field: password_hash"
+    assert call("my_tickets", token=token, after_id="x")["error"] == "after_id must be int"
+
+
+def test_search_movies_ranks_prefix_matches(env):
+    call, token, showtime_id = env
+    call("admin_add_movie", token=call.admin, title="Batman Begins", description="Người dơi", duration_min=140)
+    later = call("admin_add_movie", token=call.admin, title="Hành động", description="batman cameo", duration_min=90)
+    call("admin_add_showtime", token=call.admin, movie_id=later["data"]["movie_id"], start_time="2099-01-01T19:00:00",
+         hall="P1", price=1)
+
+    def titles(**data):
+        return [m["title"] for m in call("search_movies", token=token, **data)["data"]["movies"]]
+
+    assert titles(q="bat") == ["Batman Begins", "Hành động"]  # title hit ranks first
+    assert titles(q="hanh dong") == ["Hành động"]
+    assert titles(q="bat", upcoming=True) == ["Hành động"]
+    assert titles(q="bat", limit=1) == ["Batman Begins"]
+    assert titles(q='title:"x" OR *') == []
+    assert titles(q="b") == []  # too short to search
+    assert titles(q="bat b") == ["Batman Begins", "Hành động"]
+    assert call("search_movies", token=token, q="bat", fields=["title"])["data"]["movies"][0].keys() == {"id", "title"}
+    assert call("search_movies", token=token)["error"] == "q required"
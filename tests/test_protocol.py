@@ -8,3 +8,67 @@ def test_message_roundtrip():
     assert obj["action"] == "ping"
     assert obj["data"]["x"] == 1
 
+
+
+def test_frame_roundtrip_with_compression():
+    from common.protocol import FRAME_HEADER, Framing, decode_frame, response_ok
+
+    line = response_ok({"seats": [{"seat_code": f"A{i}", "status": "available"} for i in range(200)]})
+    wire = Framing(mode="frames", compress=True).encode(line)
+    length, flags = FRAME_HEADER.unpack(wire[:FRAME_HEADER.size])
+    assert length == len(wire) - FRAME_HEADER.size < len(line)
+    assert json.loads(decode_frame(flags, wire[FRAME_HEADER.size:])) == json.loads(line)
+
+
+def test_attach_id_echoes_request_id():
+    from common.protocol import attach_id, response_error
+
+    assert json.loads(attach_id(response_error("x"), "r1"))["id"] == "r1"
+
+
+def test_compact_seat_map_roundtrip():
+    from common.seats import decode_compact, encode_compact
+
+    seats = [{"seat_code": f"{r}{c}", "status": "available"} for r in "AB" for c in range(1, 13)]
+    seats[3]["status"] = "booked"
+    del seats[-1]  # gap at B12
+    compact = encode_compact(seats)
+    assert compact == {"format": "compact", "rows": ["A", "B"], "cols": 12, "cells": "3O1X19O1."}
+    key = lambda s: s["seat_code"]
+    assert sorted(decode_compact(compact), key=key) == sorted(seats, key=key)
+
+
+def test_pipeline_reply_without_id_fails_the_batch_only():
+    import socket
+    import threading
+
+    import pytest
+
+    from client.main import Client
+    from common.protocol import attach_id, response_error, response_ok
+
+    client_sock, server_sock = socket.socketpair()
+
+    def fake_server():
+        with server_sock, server_sock.makefile("rwb") as f:
+            ids = [json.loads(f.readline()).get("id") for _ in range(3)]
+            # The middle request "could not be parsed": its reply carries no id.
+            for line in (attach_id(response_ok(), ids[2]), response_error("Bad request: x"),
+                         attach_id(response_ok(), ids[0])):
+                f.write(line.encode())
+            f.flush()
+            f.readline()
+            f.write(response_ok({"pong": True}).encode())
+            f.flush()
+
+    t = threading.Thread(target=fake_server)
+    t.start()
+    c = Client("unused", 0)
+    c.sock, c.f = client_sock, client_sock.makefile("rwb")
+    try:
+        with pytest.raises(RuntimeError, match="Bad request: x"):
+            c.pipeline([("ping", {})] * 3)
+        assert c.ensure_ok(c.request("ping", {})) == {"pong": True}
+    finally:
+        c.close()
+        t.join(5)
@@ -0,0 +1,52 @@
+import time
+
+from server import db
+from server.sessions import SessionStore, SnapshotSessions, SqliteSessions
+
+USER = {"id": 1, "username": "admin", "role": "admin"}
+
+
+def test_sliding_expiry_reaper_and_lru_cap():
+    store = SessionStore(ttl=60, max_sessions=2, reap_interval=0, shards=1)
+    a, b = store.create(USER), store.create(USER)
+    assert store.get(a) == USER  # a is now the most recently used
+    c = store.create(USER)
+    assert store.get(b) is None and store.get(a) == USER and store.get(c) == USER
+    assert store.counters.value("evicted") == 1
+
+    now = time.time()
+    assert store.reap(now + 30) == 0  # get() slid the expiry forward
+    assert store.reap(now + 61) == 2 and len(store) == 0
+    store.close()
+
+
+def test_sqlite_sessions_survive_restart_and_logout(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "cinema.db"))
+    db.init_db(pool.get())
+    admin_id = pool.get().execute("SELECT id FROM users WHERE username='admin'").fetchone()[0]
+    user = {"id": admin_id, "username": "admin", "role": "admin"}
+
+    first = SessionStore(backend=SqliteSessions(pool), reap_interval=0)
+    token = first.create(user)
+    stored = pool.get().execute("SELECT token_hash FROM sessions").fetchone()[0]
+    assert stored != token
+
+    # A fresh store (restart, or another process) reads the token through from the table.
+    second = SessionStore(backend=SqliteSessions(pool), reap_interval=0)
+    assert second.get(token) == user and len(second) == 1
+    second.delete(token)
+    assert SessionStore(backend=SqliteSessions(pool), reap_interval=0).get(token) is None
+
+    expiring = SessionStore(ttl=60, backend=SqliteSessions(pool), reap_interval=0)
+    expiring.create(user)
+    expiring.reap(time.time() + 61)
+    assert pool.get().execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+    pool.close_all()
+
+
+def test_snapshot_sessions_round_trip(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    store = SessionStore(backend=SnapshotSessions(path), reap_interval=0)
+    token = store.create(USER)
+    store.close()
+    assert SessionStore(backend=SnapshotSessions(path), reap_interval=0).get(token) == USER
@@ -1 +1,296 @@
+import asyncio
+import json
+import socket
+import threading
+import concurrent.futures
 
+from server import aio
+
+
+def _start_asyncio_server(db_path, **options):
+    loop = asyncio.new_event_loop()
+    ready = concurrent.futures.Future()
+
+    async def boot():
+        fut = loop.create_future()
+        fut.add_done_callback(lambda f: ready.set_result(f.result()))
+        await aio.serve("127.0.0.1", 0, str(db_path), db_threads=2, ready=fut, **options)
+
+    threading.Thread(target=loop.run_until_complete, args=(boot(),), daemon=True).start()
+    return ready.result(timeout=5)
+
+
+def _rpc(f, action, data):
+    f.write((json.dumps({"action": action, "data": data}) + "\n").encode("utf-8"))
+    f.flush()
+    return json.loads(f.readline())
+
+
+def test_asyncio_engine_ping_and_login(tmp_path):
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    with socket.create_connection((host, port)) as s:
+        f = s.makefile("rwb")
+        assert _rpc(f, "ping", {})["data"] == {"pong": True}
+        resp = _rpc(f, "login", {"username": "admin", "password": "admin123"})
+        assert resp["ok"] and resp["data"]["user"]["role"] == "admin"
+
+
+def test_asyncio_engine_many_idle_connections(tmp_path):
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    socks = [socket.create_connection((host, port)) for _ in range(200)]
+    try:
+        f = socks[-1].makefile("rwb")
+        assert _rpc(f, "ping", {})["ok"]
+    finally:
+        for s in socks:
+            s.close()
+
+
+def test_pipelined_requests_get_their_ids_back(tmp_path):
+    from client.main import Client
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    c = Client(host, port)
+    c.connect()
+    try:
+        c.token = c.ensure_ok(c.request("login", {"username": "admin", "password": "admin123"}))["token"]
+        movie_id = c.ensure_ok(c.request("admin_add_movie", {"title": "M"}))["movie_id"]
+        resps = c.pipeline([("ping", {})] * 5 + [("list_movies", {}), ("list_showtimes", {"movie_id": movie_id})])
+        assert [r["ok"] for r in resps] == [True] * 7
+        assert resps[5]["data"]["movies"][0]["id"] == movie_id
+        assert resps[6]["data"]["showtimes"] == []
+        assert len({r["id"] for r in resps}) == 7
+
+        # Re-reads carry if_version; a not-modified reply is answered from the client's copy.
+        listed = c.read("list_movies", {})
+        raw = c.request("list_movies", {"if_version": listed["data"]["version"]})
+        assert raw["data"] == {"not_modified": True, "version": listed["data"]["version"]}
+        assert c.read("list_movies", {})["data"] == listed["data"]
+
+        c.ensure_ok(c.request("admin_add_movie", {"title": "N"}))
+        pages = c.pages("list_movies", "movies", limit=1)
+        assert next(pages)[0][0]["title"] == "N"  # later pages only requested on demand
+        assert [[m["title"] for m in movies] for movies, _more in pages] == [["M"]]
+    finally:
+        c.close()
+
+
+def test_hello_switches_connection_to_frames(tmp_path):
+    from client.main import Client
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    c = Client(host, port)
+    c.connect()
+    try:
+        assert c.hello()["framing"] == "frames"
+        assert c.framing.framed
+        c.token = c.ensure_ok(c.request("login", {"username": "admin", "password": "admin123"}))["token"]
+        assert [r["ok"] for r in c.pipeline([("ping", {}), ("list_movies", {})])] == [True, True]
+    finally:
+        c.close()
+
+
+def test_subscribers_receive_seat_events(tmp_path):
+    from client.main import Client
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    admin, watcher = Client(host, port), Client(host, port)
+    for c in (admin, watcher):
+        c.connect()
+        c.token = c.ensure_ok(c.request("login", {"username": "admin", "password": "admin123"}))["token"]
+    try:
+        movie_id = admin.ensure_ok(admin.request("admin_add_movie", {"title": "M"}))["movie_id"]
+        showtime_id = admin.ensure_ok(admin.request(
+            "admin_add_showtime", {"movie_id": movie_id, "start_time": "2026-01-01T10:00", "hall": "P1", "price": 1}
+        ))["showtime_id"]
+        version = watcher.subscribe_seats(showtime_id)
+        # Timing out with nothing pushed leaves the connection usable.
+        assert watcher.wait_event(timeout=0.2) is None
+        assert len(watcher.get_seats(showtime_id)) == 40
+        admin.book_many(showtime_id, ["A1", "A2"])
+        ev = watcher.wait_event(timeout=5)
+        assert ev["event"] == "seats" and ev["data"]["version"] == version + 1
+        assert [ch["seat_code"] for ch in ev["data"]["changes"]] == ["A1", "A2"]
+        # The re-read is a delta applied to the client's copy.
+        seats = {s["seat_code"]: s["status"] for s in watcher.get_seats(showtime_id)}
+        assert len(seats) == 40 and seats["A1"] == seats["A2"] == "booked" and seats["A3"] == "available"
+        assert watcher._seat_views[showtime_id][0] == version + 1
+        # Replies still come through with events interleaved.
+        assert watcher.ensure_ok(watcher.request("ping", {}))["pong"]
+    finally:
+        admin.close()
+        watcher.close()
+
+
+def test_connection_cap_and_token_rate_limit(tmp_path):
+    import time
+
+    from server.admission import SERVER_BUSY, Limits
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db", limits=Limits(max_connections=2, token_rate=5))
+    with socket.create_connection((host, port)) as s1, socket.create_connection((host, port)) as s2:
+        f1, f2 = s1.makefile("rwb"), s2.makefile("rwb")
+        token = _rpc(f1, "login", {"username": "admin", "password": "admin123"})["data"]["token"]
+        with socket.create_connection((host, port)) as s3:
+            rejected = json.loads(s3.makefile("rb").readline())
+        assert rejected["error"] == SERVER_BUSY and rejected["data"]["retry_after"] > 0
+
+        # The bucket follows the token across connections; untokened requests are not counted.
+        resps = [_rpc(f, "list_movies", {"token": token}) for f in (f1, f2) * 4]
+        assert [r["ok"] for r in resps] == [True] * 5 + [False] * 3
+        assert resps[-1]["error"] == SERVER_BUSY and 0 < resps[-1]["data"]["retry_after"] <= 0.2
+        assert _rpc(f2, "ping", {})["ok"]
+        f1.write(b'{"action": "ping", "id": 7, "data": {"token": "%s"}}\n' % token.encode())
+        f1.flush()
+        assert json.loads(f1.readline())["id"] == 7
+        # A new made-up token per request does not get a fresh bucket each time.
+        fakes = [_rpc(f2, "list_movies", {"token": f"fake{i}"}) for i in range(7)]
+        assert [r.get("error") == SERVER_BUSY for r in fakes] == [False] * 5 + [True] * 2
+        f1.close()
+        f2.close()
+
+    # Closed connections free their places (once the server has seen them close).
+    deadline = time.monotonic() + 5
+    while True:
+        with socket.create_connection((host, port)) as s4:
+            if _rpc(s4.makefile("rwb"), "ping", {})["ok"] or time.monotonic() > deadline:
+                break
+        time.sleep(0.05)
+    assert time.monotonic() <= deadline
+
+
+def test_server_stats_and_metrics_endpoint(tmp_path):
+    import urllib.request
+
+    from server.metrics import render_text, serve_metrics
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    with socket.create_connection((host, port)) as s:
+        f = s.makefile("rwb")
+        token = _rpc(f, "login", {"username": "admin", "password": "admin123"})["data"]["token"]
+        _rpc(f, "ping", {})
+        stats = _rpc(f, "server_stats", {"token": token})["data"]
+    assert stats["connections"] >= 1 and stats["sessions"] >= 1 and stats["threads"] > 1
+    assert stats["bytes_in_total"] > 0 and stats["bytes_out_total"] > 0
+    assert stats["actions"]["ping"]["count"] == 1 and stats["actions"]["ping"]["handle"]["p99_us"] >= 1
+
+    httpd = serve_metrics("127.0.0.1", 0, lambda: stats)
+    try:
+        url = "http://%s:%d/metrics" % httpd.server_address
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+    finally:
+        httpd.shutdown()
+    assert body == render_text(stats)
+    assert 'cinema_requests_total{action="ping"} 1' in body
+    assert "# TYPE cinema_bytes_in_total counter" in body
+
+
+def test_loadgen_mixes_report(tmp_path):
+    from scripts.loadgen import LoadConfig, run
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    for mix in ("browse", "rush", "churn"):
+        report = asyncio.run(run(LoadConfig(host=host, port=port, users=20, duration=0.5, mix=mix, showtimes=2)))
+        assert report["users_connected"] == 20 and report["requests"] > 0
+        assert report["latency_ms"]["p99"] >= report["latency_ms"]["p50"]
+        if mix == "rush":
+            assert report["actions"]["book"]["count"] >= 1
+    assert report["actions"]["cancel"]["count"] >= 1
+
+
+def test_workers_share_the_database_and_restart(tmp_path):
+    import os
+    import signal
+    import subprocess
+    import sys
+    import time
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "server.main", "--port", str(port), "--db", str(tmp_path / "cinema.db"),
+         "--workers", "2", "--kdf", "pbkdf2_sha256"],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    def connect():
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                return socket.create_connection(("127.0.0.1", port), timeout=10).makefile("rwb")
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    try:
+        admin = connect()
+        token = _rpc(admin, "login", {"username": "admin", "password": "admin123"})["data"]["token"]
+        readers = [connect() for _ in range(8)]
+        for f in readers:
+            assert _rpc(f, "list_movies", {"token": token})["data"]["movies"] == []
+
+        # Written in one worker; every worker's catalogue cache and session lookup sees it.
+        assert _rpc(admin, "admin_add_movie", {"token": token, "title": "M", "duration_min": 90})["ok"]
+        for f in readers:
+            assert [m["title"] for m in _rpc(f, "list_movies", {"token": token})["data"]["movies"]] == ["M"]
+
+        def workers():
+            with open(f"/proc/{proc.pid}/task/{proc.pid}/children") as f:
+                return set(map(int, f.read().split()))
+
+        before = workers()
+        victim = _rpc(admin, "server_stats", {"token": token})["data"]["pid"]
+        assert len(before) == 2 and victim in before
+        os.kill(victim, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while len(workers() - {victim}) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(workers() - {victim}) == 2
+        for f in [connect() for _ in range(4)]:
+            assert _rpc(f, "list_movies", {"token": token})["ok"]
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(timeout=10) == 0
+
+
+def test_bulk_import_ndjson_and_csv(tmp_path):
+    from client.main import Client
+    from scripts.bulk_import import run
+
+    ndjson = tmp_path / "schedule.ndjson"
+    lines = [json.dumps({"type": "movie", "title": "Bulk", "duration_min": 100}), "{not json"]
+    lines += [json.dumps({"movie_title": "Bulk", "start_time": f"2026-03-01T{h:02d}:00:00", "hall": "P1", "price": 1})
+              for h in range(10, 22)]
+    lines.append(json.dumps({"movie_title": "Nope", "start_time": "2026-03-01T10:00:00", "hall": "P1", "price": 1}))
+    ndjson.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    csv_path = tmp_path / "schedule.csv"
+    csv_path.write_text(
+        "type,title,movie_title,start_time,hall,price\n"
+        "movie,Csv,,,,\n"
+        "showtime,,Csv,2026-03-02T10:00:00,P2,5\n"
+        "showtime,,Csv,2026-03-02T12:00:00,P2,0\n",
+        encoding="utf-8",
+    )
+
+    host, port = _start_asyncio_server(tmp_path / "cinema.db")
+    c = Client(host, port)
+    c.connect()
+    try:
+        c.token = c.ensure_ok(c.request("login", {"username": "admin", "password": "admin123"}))["token"]
+        totals = run(c, str(ndjson), batch_size=5)
+        assert (totals["movies"], totals["showtimes"], totals["seats"]) == (1, 12, 12 * 40)
+        assert [line for line, _ in totals["errors"]] == [2, 15]
+        assert totals["errors"][1][1] == "Movie not found"
+
+        totals = run(c, str(csv_path))
+        assert (totals["movies"], totals["showtimes"]) == (1, 1)
+        assert totals["errors"] == [(4, "start_time, hall, price required")]
+
+        movie_id = c.ensure_ok(c.request("list_movies", {}))["movies"][0]["id"]
+        showtimes = c.ensure_ok(c.request("list_showtimes", {"movie_id": movie_id}))["showtimes"]
+        assert [s["hall"] for s in showtimes] == ["P2"] and len(c.get_seats(showtimes[0]["id"])) == 40
+    finally:
+        c.close()